@@ -5,14 +5,27 @@ Supports multiple vector stores, embedding providers, and retrieval strategies
 """
 
 import asyncio
+import concurrent.futures
+import copy
+import heapq
 import json
 import hashlib
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
 import uuid
 import numpy as np
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Tuple, AsyncGenerator
-from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Any, Tuple, Set, Iterator, AsyncGenerator, Callable, Hashable
+from dataclasses import dataclass, field, asdict, replace
 from enum import Enum
+from multiprocessing import shared_memory
 from abc import ABC, abstractmethod
 import aiohttp
 import logging
@@ -30,6 +43,8 @@ class VectorStoreProvider(Enum):
     QDRANT = 'qdrant'
     MILVUS = 'milvus'
     FAISS = 'faiss'
+    MMAP = 'mmap'  # Memory-mapped files on local disk
+    SHARDED = 'sharded'  # Hash-partitioned across local worker processes
     MEMORY = 'memory'  # In-memory for testing
 
 
@@ -107,6 +122,22 @@ class VectorStoreConfig:
     metric: str = 'cosine'  # cosine, euclidean, dotproduct
     cloud_provider: Optional[str] = None
     region: Optional[str] = None
+    storage_layout: str = 'dict'  # dict, matrix (memory provider only)
+    compression: str = 'none'  # none, float16, int8, binary (matrix layout only)
+    rescore: bool = False  # Keep a side copy of compressed rows to rescore candidates (codes only when False)
+    rescore_dtype: str = 'float16'  # Side copy precision: float16, float32
+    rescore_factor: int = 4  # Compressed candidates rescored per requested result
+    index_type: str = 'flat'  # flat, ivf, hnsw (hnsw is served by the faiss store)
+    nlist: Optional[int] = None  # IVF lists (defaults to sqrt(N) at training time)
+    nprobe: int = 8  # IVF lists scanned per query
+    hnsw_m: int = 16  # HNSW links per node (doubled on level 0)
+    ef_construction: int = 200  # HNSW beam width while inserting
+    ef_search: int = 64  # HNSW beam width while searching
+    persist_path: Optional[str] = None  # Directory for local index files (faiss, mmap providers)
+    read_only: bool = False  # Open a persisted store for searching only (mmap provider)
+    compaction_threshold: float = 0.3  # Dead-row ratio that schedules background compaction
+    shards: int = 0  # Worker processes for the sharded provider (0 = one per CPU)
+    executor_workers: int = 0  # Threads scoring memory-provider searches off the event loop (0 = inline, so hybrid legs run back to back)
 
 
 @dataclass
@@ -115,8 +146,19 @@ class EmbeddingConfig:
     provider: EmbeddingProvider
     model: str
     api_key: Optional[str] = None
-    batch_size: int = 100
+    batch_size: int = 100  # Most texts per embedding request
+    max_batch_tokens: int = 250000  # Estimated tokens per embedding request (kept under the provider limit)
+    max_concurrency: int = 4  # Batch requests embed_batch keeps in flight
+    max_retries: int = 3  # Retries per request on 429 and 5xx responses
+    retry_delay: float = 1.0  # Seconds before the first retry (unless the server sends Retry-After)
+    retry_backoff: float = 2.0  # Delay multiplier after each retry
     dimensions: Optional[int] = None
+    query_cache_size: int = 1024  # Query embeddings kept in memory (0 disables the cache)
+    query_cache_ttl: Optional[float] = None  # Seconds before a cached query embedding expires
+    query_cache_path: Optional[str] = None  # File the query cache is loaded from and saved to
+    cache_path: Optional[str] = None  # SQLite file caching embeddings by text hash (None disables)
+    cache_size: int = 100000  # Embeddings the file cache keeps before evicting the least recently used
+    coalesce_window: float = 0.0  # Seconds embed() calls wait behind an in-flight request to share the next (0 disables)
 
 
 @dataclass
@@ -139,6 +181,16 @@ class RetrievalConfig:
     max_tokens: Optional[int] = None
     include_metadata: bool = True
     hybrid_alpha: float = 0.5  # For hybrid search (0 = keyword only, 1 = vector only)
+    hybrid_fusion: str = 'weighted'  # weighted (raw scores), minmax (per-leg normalized), rrf (ranks)
+    rrf_k: int = 60  # Rank offset for reciprocal rank fusion
+    vector_depth: Optional[int] = None  # Hybrid vector-leg candidates (default top_k * 2)
+    keyword_depth: Optional[int] = None  # Hybrid keyword-leg candidates (default top_k * 2)
+    context_window: int = 1  # Neighboring chunks on each side added by contextual search
+    result_cache_size: int = 256  # Searches whose results RAGManager caches (0 disables the cache)
+    mmr_lambda: float = 0.5  # For MMR search (0 = diversity only, 1 = relevance only)
+    cascade_multiplier: int = 1  # First-stage candidates per needed result; above 1 rescores them from kept float32 vectors
+    rescore_precision: str = 'float32'  # Arithmetic for exact rescoring: float32 or float64
+    executor_workers: int = 0  # Threads running MMR selection and rescoring off the event loop (0 = inline)
 
 
 @dataclass
@@ -215,17 +267,45 @@ class BaseEmbeddingProvider(ABC):
         """Get embedding dimensions"""
         pass
     
+    def fingerprint(self) -> str:
+        """Identity of learned state that changes embeddings beyond model and dimensions"""
+        return ''
+    
     async def cleanup(self) -> None:
         """Cleanup resources"""
         if self.session:
             await self.session.close()
 
 
+def _plan_batches(texts: List[str], max_items: int, max_tokens: int) -> List[List[int]]:
+    """Group text indices into requests under an item cap and an estimated token budget
+    
+    Texts are packed shortest first so each request holds similar lengths;
+    a text over the budget on its own is sent as a single request.
+    """
+    tokens = [len(text) // 4 + 1 for text in texts]
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    batch_tokens = 0
+    for index in sorted(range(len(texts)), key=tokens.__getitem__):
+        if batch and (len(batch) >= max_items or batch_tokens + tokens[index] > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(index)
+        batch_tokens += tokens[index]
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 # ============== OpenAI Embeddings ==============
 
 class OpenAIEmbeddings(BaseEmbeddingProvider):
     """OpenAI embedding provider"""
     
+    ENDPOINT = 'https://api.openai.com/v1/embeddings'
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    
     def __init__(self, config: EmbeddingConfig):
         super().__init__(config)
         self.headers = {
@@ -235,43 +315,71 @@ class OpenAIEmbeddings(BaseEmbeddingProvider):
     
     async def embed(self, text: str) -> List[float]:
         """Generate OpenAI embedding"""
-        if not self.session:
-            self.session = aiohttp.ClientSession()
-        
-        async with self.session.post(
-            'https://api.openai.com/v1/embeddings',
-            headers=self.headers,
-            json={
-                'model': self.config.model or 'text-embedding-3-small',
-                'input': text
-            }
-        ) as response:
-            data = await response.json()
-            return data['data'][0]['embedding']
+        return (await self._request(text))[0]
     
     async def embed_batch(self, texts: List[str]) -> List[List[float]]:
-        """Generate OpenAI embeddings in batch"""
+        """Generate OpenAI embeddings, keeping up to max_concurrency batch requests in flight"""
+        plan = _plan_batches(texts, self.config.batch_size or 100, self.config.max_batch_tokens)
+        semaphore = asyncio.Semaphore(max(1, self.config.max_concurrency))
+        
+        async def embed_slice(batch: List[int]) -> List[List[float]]:
+            async with semaphore:
+                return await self._request([texts[i] for i in batch])
+        
+        tasks = [asyncio.ensure_future(embed_slice(batch)) for batch in plan]
+        try:
+            batches = await asyncio.gather(*tasks)
+        except BaseException:
+            # One batch failed for good; stop sending the rest
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        # Batches are packed by length, so put results back in input order
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        for batch, results in zip(plan, batches):
+            for index, embedding in zip(batch, results):
+                embeddings[index] = embedding
+        return embeddings
+    
+    async def _request(self, input: Any) -> List[List[float]]:
+        """One embeddings request, retried with jittered exponential backoff on 429 and 5xx"""
         if not self.session:
             self.session = aiohttp.ClientSession()
         
-        batch_size = self.config.batch_size or 100
-        embeddings = []
-        
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
+        delay = self.config.retry_delay
+        for attempt in range(self.config.max_retries + 1):
+            retry_after = None
+            try:
+                async with self.session.post(
+                    self.ENDPOINT,
+                    headers=self.headers,
+                    json={
+                        'model': self.config.model or 'text-embedding-3-small',
+                        'input': input
+                    }
+                ) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        return [d['embedding'] for d in sorted(data['data'], key=lambda d: d['index'])]
+                    error = f"OpenAI embeddings error {response.status}: {await response.text()}"
+                    if response.status not in self.RETRY_STATUSES:
+                        raise Exception(error)
+                    retry_after = response.headers.get('Retry-After')
+            except aiohttp.ClientConnectionError as e:
+                error = f"OpenAI embeddings connection error: {e}"
             
-            async with self.session.post(
-                'https://api.openai.com/v1/embeddings',
-                headers=self.headers,
-                json={
-                    'model': self.config.model or 'text-embedding-3-small',
-                    'input': batch
-                }
-            ) as response:
-                data = await response.json()
-                embeddings.extend([d['embedding'] for d in data['data']])
+            if attempt == self.config.max_retries:
+                break
+            try:
+                wait = float(retry_after)
+            except (TypeError, ValueError):
+                # Jitter spreads out concurrent batches that were throttled together
+                wait = delay * random.uniform(0.5, 1.0)
+            await asyncio.sleep(wait)
+            delay *= self.config.retry_backoff
         
-        return embeddings
+        raise Exception(error)
     
     def get_dimensions(self) -> int:
         """Get OpenAI embedding dimensions"""
@@ -283,13 +391,674 @@ class OpenAIEmbeddings(BaseEmbeddingProvider):
         return dimensions.get(self.config.model, 1536)
 
 
+# ============== Local Hashing Embeddings ==============
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    """Vectorized SplitMix64 mix of uint64 values"""
+    z = values + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+class HashingEmbeddings(BaseEmbeddingProvider):
+    """Offline embeddings: hashed TF-IDF features reduced by a sparse random projection
+    
+    A vector depends only on the text, the model name (which keys the feature
+    hash) and the IDF weights learned by fit(), so every process computes the
+    same embedding. Without fit() every feature has weight 1.
+    """
+    
+    FEATURES = 1 << 20  # Hashed TF-IDF buckets
+    NONZEROS = 8  # Signed projection entries per bucket
+    DEFAULT_DIMENSIONS = 384
+    IDF_FILE = 'hashing_idf.npz'
+    
+    def __init__(self, config: EmbeddingConfig):
+        super().__init__(config)
+        self.dimensions = config.dimensions or self.DEFAULT_DIMENSIONS
+        self.key = hashlib.blake2b((config.model or '').encode()).digest()
+        self.idf: Optional[np.ndarray] = None  # bucket -> weight, set by fit()
+        self.document_count = 0
+        self.document_frequency: Optional[np.ndarray] = None  # bucket -> documents containing it
+        self.idf_fingerprint = ''
+    
+    async def embed(self, text: str) -> List[float]:
+        """Embed one text locally"""
+        return (await self.embed_batch([text]))[0]
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts locally"""
+        return self.transform(texts).tolist()
+    
+    def get_dimensions(self) -> int:
+        """Configured dimensions"""
+        return self.dimensions
+    
+    def fingerprint(self) -> str:
+        """Digest of the IDF weights, empty before fit()"""
+        return self.idf_fingerprint
+    
+    def fit(self, corpus: List[str]) -> None:
+        """Learn smoothed IDF weights from a corpus"""
+        _, buckets, _ = self._term_frequencies(corpus)
+        self._set_idf(len(corpus), np.bincount(buckets, minlength=self.FEATURES))
+    
+    def save(self, path: str) -> None:
+        """Write fitted document frequencies (sparse) to a directory"""
+        if self.document_frequency is None:
+            return
+        seen = np.flatnonzero(self.document_frequency)
+        target = os.path.join(path, self.IDF_FILE)
+        with open(target + '.tmp', 'wb') as f:
+            np.savez(f, count=self.document_count, buckets=seen, frequency=self.document_frequency[seen])
+        os.replace(target + '.tmp', target)
+    
+    def load(self, path: str) -> bool:
+        """Restore document frequencies written by save(); False when there are none"""
+        target = os.path.join(path, self.IDF_FILE)
+        if not os.path.exists(target):
+            return False
+        with np.load(target) as arrays:
+            document_frequency = np.zeros(self.FEATURES, dtype=np.int64)
+            document_frequency[arrays['buckets']] = arrays['frequency']
+            self._set_idf(int(arrays['count']), document_frequency)
+        return True
+    
+    def _set_idf(self, count: int, document_frequency: np.ndarray) -> None:
+        """Derive IDF weights and their fingerprint from document frequencies"""
+        self.document_count = count
+        self.document_frequency = document_frequency
+        self.idf = (np.log((1 + count) / (1 + document_frequency)) + 1).astype(np.float32)
+        self.idf_fingerprint = hashlib.blake2b(self.idf.tobytes(), digest_size=8).hexdigest()
+    
+    def transform(self, texts: List[str]) -> np.ndarray:
+        """Unit-length float32 embeddings, one row per text"""
+        documents, buckets, weights = self._term_frequencies(texts)
+        if self.idf is not None:
+            weights = weights * self.idf[buckets]
+        
+        # Each bucket adds +/-weight at NONZEROS positions derived from its number
+        seeds = buckets.astype(np.uint64)[:, None] * np.uint64(self.NONZEROS) + np.arange(self.NONZEROS, dtype=np.uint64)
+        mixed = _splitmix64(seeds)
+        positions = (mixed % np.uint64(self.dimensions)).astype(np.int64)
+        signs = np.where(mixed >> np.uint64(63), -1.0, 1.0)
+        vectors = np.bincount(
+            (documents[:, None] * self.dimensions + positions).ravel(),
+            weights=(signs * weights[:, None]).ravel(),
+            minlength=len(texts) * self.dimensions
+        )
+        return _normalize(vectors.reshape(len(texts), self.dimensions).astype(np.float32))
+    
+    def _term_frequencies(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Sparse (document, bucket, sublinear term frequency) triples for a batch"""
+        buckets: Dict[str, int] = {}  # Each distinct feature is hashed once per batch
+        pairs = []
+        for document, text in enumerate(texts):
+            offset = document * self.FEATURES
+            for feature in self._features(text):
+                bucket = buckets.get(feature)
+                if bucket is None:
+                    digest = hashlib.blake2b(feature.encode(), digest_size=8, key=self.key).digest()
+                    bucket = buckets[feature] = int.from_bytes(digest, 'little') % self.FEATURES
+                pairs.append(offset + bucket)
+        
+        keys, counts = np.unique(np.asarray(pairs, dtype=np.int64), return_counts=True)
+        return keys // self.FEATURES, keys % self.FEATURES, 1 + np.log(counts)
+    
+    @staticmethod
+    def _features(text: str) -> List[str]:
+        """Word unigrams and bigrams"""
+        tokens = _tokenize(text)
+        return tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+
+
+# ============== Query Caches ==============
+
+class QueryEmbeddingCache:
+    """LRU cache of query embeddings keyed by embedding model, dimensions and whitespace-normalized query text"""
+    
+    FORMAT_VERSION = 2
+    
+    def __init__(
+        self,
+        model: str,
+        dimensions: Optional[int] = None,
+        max_size: int = 1024,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None
+    ):
+        self.model = model
+        self.dimensions = dimensions
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.entries: 'OrderedDict[str, Tuple[np.ndarray, float]]' = OrderedDict()  # key -> (vector, stored at)
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, query: str) -> Optional[List[float]]:
+        """Cached embedding for a query, refreshing its recency"""
+        key = self._key(query)
+        entry = self.entries.get(key)
+        if entry is not None and self.ttl is not None and time.time() - entry[1] > self.ttl:
+            del self.entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0].tolist()
+    
+    def put(self, query: str, embedding: List[float]) -> None:
+        """Store a query embedding as float32, evicting the least recently used"""
+        key = self._key(query)
+        self.entries[key] = (np.asarray(embedding, dtype=np.float32), time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        """Drop all entries and counters"""
+        self.entries.clear()
+        self.hits = self.misses = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache stats"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+    
+    def load(self) -> None:
+        """Restore unexpired entries saved by save()"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        with np.load(self.path) as data:
+            if int(data['format']) < self.FORMAT_VERSION:
+                logger.info(f"Discarding query cache in format {int(data['format'])}")
+                return
+            if int(data['format']) != self.FORMAT_VERSION:
+                raise ValueError(f"Unsupported query cache format: {int(data['format'])}")
+            ends = np.cumsum(data['lengths'])
+            vectors = np.split(data['vectors'], ends[:-1]) if len(ends) else []
+            for key, vector, stored_at in zip(data['keys'].tolist(), vectors, data['stored_at'].tolist()):
+                if self.ttl is None or time.time() - stored_at <= self.ttl:
+                    self.entries[key] = (vector, stored_at)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    def save(self) -> None:
+        """Write entries in recency order, replacing the file atomically"""
+        if not self.path:
+            return
+        vectors = [vector for vector, _ in self.entries.values()]
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                format=np.asarray(self.FORMAT_VERSION),
+                keys=np.asarray(list(self.entries), dtype=str),
+                lengths=np.asarray([len(v) for v in vectors], dtype=np.int64),
+                vectors=np.concatenate(vectors) if vectors else np.zeros(0, dtype=np.float32),
+                stored_at=np.asarray([stored_at for _, stored_at in self.entries.values()])
+            )
+        os.replace(self.path + '.tmp', self.path)
+    
+    def _key(self, query: str) -> str:
+        """Model, dimensions and query with whitespace collapsed; case is kept since embeddings are case sensitive"""
+        return f"{self.model}\x00{self.dimensions}\x00{' '.join(query.split())}"
+
+
+class SearchResultCache:
+    """LRU cache of search results tagged with the index version they were computed at"""
+    
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.entries: 'OrderedDict[str, Tuple[Hashable, List[SearchResult]]]' = OrderedDict()  # key -> (version, results)
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str, version: Hashable) -> Optional[List[SearchResult]]:
+        """Cached results, unless the index has changed since they were stored"""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] != version:
+            del self.entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        self.entries.move_to_end(key)
+        self.hits += 1
+        # Copies, so callers can annotate results without touching the cache
+        return [replace(result) for result in entry[1]]
+    
+    def put(self, key: str, version: Hashable, results: List[SearchResult]) -> None:
+        """Store results computed against an index version"""
+        self.entries[key] = (version, [replace(result) for result in results])
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        """Drop all entries and counters"""
+        self.entries.clear()
+        self.hits = self.misses = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache stats"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+    
+    @staticmethod
+    def key(
+        query: str,
+        filter: Optional[Dict[str, Any]],
+        top_k: int,
+        strategy: str,
+        include_metadata: bool
+    ) -> str:
+        """Cache key for one search's parameters"""
+        return json.dumps([query, filter, top_k, strategy, include_metadata], sort_keys=True, default=str)
+
+
+# ============== Chunk Embedding Cache ==============
+
+class ChunkEmbeddingCache:
+    """SQLite-backed LRU cache of embeddings keyed by model, dimensions and a hash of the text"""
+    
+    SCHEMA_VERSION = 1
+    LOOKUP_BATCH = 500  # Hashes per SELECT, under SQLite's bound-parameter limit
+    
+    def __init__(
+        self,
+        path: str,
+        model: str,
+        dimensions: Optional[int] = None,
+        max_size: int = 100000
+    ):
+        self.path = path
+        self.model = model
+        self.dimensions = dimensions or 0  # 0 = the model's native size
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        # Calls arrive on worker threads; the lock serializes them on the one connection
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, self.SCHEMA_VERSION):
+            raise ValueError(f"Unsupported embedding cache schema: {version}")
+        self.connection.executescript(f"""
+            PRAGMA journal_mode = WAL;
+            PRAGMA user_version = {self.SCHEMA_VERSION};
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                hash BLOB NOT NULL,
+                vector BLOB NOT NULL,
+                used INTEGER NOT NULL,
+                PRIMARY KEY (model, dimensions, hash)
+            );
+            CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used);
+        """)
+        # Logical clock for recency; rows touched by one call share a tick
+        self.clock = self.connection.execute('SELECT COALESCE(MAX(used), 0) FROM embeddings').fetchone()[0]
+        self.size = self.connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]  # Kept in step with writes
+    
+    def get_many(self, texts: List[str], variant: str = '') -> List[Optional[List[float]]]:
+        """Cached embeddings in input order (None for misses), refreshing the recency of hits"""
+        model = self._model(variant)
+        hashes = [self._hash(text) for text in texts]
+        unique = list(dict.fromkeys(hashes))
+        found: Dict[bytes, bytes] = {}
+        with self.lock:
+            for start in range(0, len(unique), self.LOOKUP_BATCH):
+                part = unique[start:start + self.LOOKUP_BATCH]
+                found.update(self.connection.execute(
+                    'SELECT hash, vector FROM embeddings WHERE model = ? AND dimensions = ? '
+                    f"AND hash IN ({', '.join('?' * len(part))})",
+                    (model, self.dimensions, *part)
+                ))
+            
+            if found:
+                self.clock += 1
+                with self.connection:
+                    self.connection.executemany(
+                        'UPDATE embeddings SET used = ? WHERE model = ? AND dimensions = ? AND hash = ?',
+                        [(self.clock, model, self.dimensions, key) for key in found]
+                    )
+            
+            embeddings = []
+            for key in hashes:
+                vector = found.get(key)
+                if vector is None:
+                    self.misses += 1
+                    embeddings.append(None)
+                else:
+                    self.hits += 1
+                    embeddings.append(np.frombuffer(vector, dtype=np.float32).tolist())
+        return embeddings
+    
+    def put_many(self, texts: List[str], embeddings: List[List[float]], variant: str = '') -> None:
+        """Store embeddings as float32, evicting the least recently used beyond max_size"""
+        model = self._model(variant)
+        rows = [
+            (model, self.dimensions, self._hash(text), np.asarray(embedding, dtype=np.float32).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self.lock, self.connection:
+            self.clock += 1
+            # Rows already present hold the same vector, so only new keys are written and counted
+            changes = self.connection.total_changes
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?, ?)',
+                [(*row, self.clock) for row in rows]
+            )
+            self.size += self.connection.total_changes - changes
+            excess = self.size - self.max_size
+            if excess > 0:
+                self.size -= self.connection.execute(
+                    'DELETE FROM embeddings WHERE rowid IN '
+                    '(SELECT rowid FROM embeddings ORDER BY used LIMIT ?)',
+                    (excess,)
+                ).rowcount
+    
+    def clear(self) -> None:
+        """Drop all entries and counters"""
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM embeddings')
+            self.size = 0
+        self.hits = self.misses = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache stats"""
+        lookups = self.hits + self.misses
+        return {
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+    
+    def close(self) -> None:
+        """Close the database"""
+        with self.lock:
+            self.connection.close()
+    
+    def _model(self, variant: str) -> str:
+        """Model key, qualified by the provider's fingerprint when it has one"""
+        return f"{self.model}#{variant}" if variant else self.model
+    
+    @staticmethod
+    def _hash(text: str) -> bytes:
+        """Content address of a text"""
+        return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class CachedEmbeddingProvider(BaseEmbeddingProvider):
+    """Embedding provider wrapper that serves previously embedded texts from a ChunkEmbeddingCache"""
+    
+    def __init__(self, provider: BaseEmbeddingProvider, cache: ChunkEmbeddingCache):
+        super().__init__(provider.config)
+        self.provider = provider
+        self.cache = cache
+    
+    async def embed(self, text: str) -> List[float]:
+        """Cached or fresh embedding for one text"""
+        return (await self.embed_batch([text]))[0]
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Cached embeddings, with one provider call for the distinct misses; SQLite runs off the event loop"""
+        variant = self.provider.fingerprint()
+        embeddings = await asyncio.to_thread(self.cache.get_many, texts, variant)
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if not missing:
+            return embeddings
+        
+        fresh = await self.provider.embed_batch(missing)
+        await asyncio.to_thread(self.cache.put_many, missing, fresh, variant)
+        by_text = dict(zip(missing, fresh))
+        return [by_text[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+    
+    def get_dimensions(self) -> int:
+        """Dimensions of the wrapped provider"""
+        return self.provider.get_dimensions()
+    
+    def fingerprint(self) -> str:
+        """Fingerprint of the wrapped provider"""
+        return self.provider.fingerprint()
+    
+    async def cleanup(self) -> None:
+        """Clean up the wrapped provider and close the cache"""
+        await self.provider.cleanup()
+        self.cache.close()
+
+
+# ============== Embedding Request Coalescing ==============
+
+class CoalescingEmbeddingProvider(BaseEmbeddingProvider):
+    """Embedding provider wrapper that merges concurrent embed() calls into shared embed_batch requests
+    
+    With no batch in flight a call goes out on the next loop iteration, together
+    with whatever else was issued in the same iteration. While a batch is in
+    flight, calls made within `window` seconds of the first pending one go out
+    as the next batch (sooner once `max_batch` distinct texts are waiting).
+    Pending calls are keyed by text, so identical queries share a single embedding.
+    """
+    
+    def __init__(self, provider: BaseEmbeddingProvider, window: float, max_batch: int):
+        super().__init__(provider.config)
+        self.provider = provider
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.pending: Dict[str, List[asyncio.Future]] = {}  # text -> callers waiting on it
+        self.timer: Optional[asyncio.Handle] = None
+        self.inflight: Set[asyncio.Task] = set()
+        self.calls = 0
+        self.requests = 0
+    
+    async def embed(self, text: str) -> List[float]:
+        """Embedding for one text, sent with the other calls in its window"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.setdefault(text, []).append(future)
+        self.calls += 1
+        
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self.timer is None and self.inflight:
+            self.timer = loop.call_later(self.window, self._flush)
+        elif self.timer is None:
+            # Nothing to wait behind, so an uncontended call adds no latency
+            self.timer = loop.call_soon(self._flush)
+        return await future
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Batch calls are already batched; pass them straight through"""
+        return await self.provider.embed_batch(texts)
+    
+    def get_dimensions(self) -> int:
+        """Dimensions of the wrapped provider"""
+        return self.provider.get_dimensions()
+    
+    def fingerprint(self) -> str:
+        """Fingerprint of the wrapped provider"""
+        return self.provider.fingerprint()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """embed() calls against the batch requests that served them"""
+        return {
+            'calls': self.calls,
+            'requests': self.requests,
+            'calls_per_request': self.calls / self.requests if self.requests else 0.0,
+            'pending': len(self.pending)
+        }
+    
+    async def cleanup(self) -> None:
+        """Send pending calls, wait for in-flight batches, then clean up the wrapped provider"""
+        self._flush()
+        if self.inflight:
+            await asyncio.gather(*self.inflight, return_exceptions=True)
+        await self.provider.cleanup()
+    
+    def _flush(self) -> None:
+        """Start one batch request for everything pending"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        
+        batch, self.pending = self.pending, {}
+        self.requests += 1
+        task = asyncio.ensure_future(self._dispatch(batch))
+        self.inflight.add(task)
+        task.add_done_callback(self.inflight.discard)
+    
+    async def _dispatch(self, batch: Dict[str, List[asyncio.Future]]) -> None:
+        """Run a batch request and hand each caller its embedding (or the error)"""
+        texts = list(batch)
+        try:
+            embeddings = await self.provider.embed_batch(texts)
+        except asyncio.CancelledError:
+            for futures in batch.values():
+                for future in futures:
+                    future.cancel()
+            raise
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        
+        for text, embedding in zip(texts, embeddings):
+            for future in batch[text]:
+                if not future.done():  # The caller may have been cancelled meanwhile
+                    future.set_result(embedding)
+
+
+# ============== Similarity Metrics ==============
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize vectors so a dot product is a cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorMetric:
+    """Batched higher-is-better similarity kernels for the configured metric
+    
+    Stored rows are prepared once at upsert (unit rows for cosine, squared
+    norms for euclidean), so a query costs a single matrix product.
+    """
+    
+    NAMES = ('cosine', 'dotproduct', 'euclidean')
+    
+    def __init__(self, name: str):
+        if name not in self.NAMES:
+            raise ValueError(f"Unsupported metric: {name}")
+        self.name = name
+    
+    def prepare(self, vectors: Any, dtype: Any = np.float32) -> np.ndarray:
+        """Stored (or query) form of vectors: float32 by default, unit length for cosine"""
+        vectors = np.asarray(vectors, dtype=dtype)
+        if self.name == 'cosine':
+            return _normalize(vectors)
+        return vectors
+    
+    def sq_norms(self, vectors: np.ndarray) -> Optional[np.ndarray]:
+        """Squared row norms the euclidean kernel needs, precomputed per row"""
+        if self.name != 'euclidean':
+            return None
+        return np.einsum('...i,...i->...', vectors, vectors)
+    
+    def rank_scores(
+        self,
+        queries: np.ndarray,
+        matrix: np.ndarray,
+        sq_norms: Optional[np.ndarray]
+    ) -> np.ndarray:
+        """Scores ordered like the metric; euclidean drops the per-query constant"""
+        products = queries @ matrix.T
+        if self.name == 'euclidean':
+            return 2 * products - sq_norms  # |q|^2 - |x - q|^2
+        return products
+    
+    def finalize(self, scores: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """Reported scores for selected rank_scores; euclidean becomes 1 / (1 + distance)"""
+        if self.name != 'euclidean':
+            return scores
+        query_sq = self.sq_norms(queries)
+        if queries.ndim == 2:
+            query_sq = query_sq[:, None]
+        return 1 / (1 + np.sqrt(np.maximum(query_sq - scores, 0)))
+    
+    def pairwise(self, a: Any, b: Any, dtype: Any = np.float32) -> np.ndarray:
+        """Similarity of every row of a to every row of b, on the search score scale"""
+        a, b = self.prepare(a, dtype), self.prepare(b, dtype)
+        return self.finalize(self.rank_scores(a, b, self.sq_norms(b)), a)
+    
+    def similarity(self, a: List[float], b: List[float]) -> float:
+        """Similarity of two vectors"""
+        return float(self.pairwise([a], [b])[0, 0])
+    
+    def bounded(self, score: float) -> float:
+        """Score mapped onto the keyword score scale; dot products go through a logistic"""
+        if self.name == 'dotproduct':
+            return float(1 / (1 + np.exp(-score)))
+        return score
+
+
 # ============== Base Vector Store ==============
 
+def _create_executor(workers: int) -> Optional[concurrent.futures.ThreadPoolExecutor]:
+    """Thread pool for CPU-bound search work, or None to run it inline"""
+    if workers <= 0:
+        return None
+    # NumPy releases the GIL in its kernels, so threads keep the event loop responsive
+    return concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rag-search')
+
+
+async def _run_in(executor: Optional[concurrent.futures.Executor], fn: Callable[..., Any], *args: Any) -> Any:
+    """Run fn in the executor, or inline on the event loop when there is none"""
+    if executor is None:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
 class BaseVectorStore(ABC):
     """Abstract base class for vector stores"""
     
+    SEARCH_EXECUTOR = False  # Whether executor_workers moves this store's search scoring onto threads
+    DURABLE_WRITES = False  # Whether every write is on disk when it returns, rather than at save or cleanup
+    
     def __init__(self, config: VectorStoreConfig):
         self.config = config
+        self.metric = VectorMetric(config.metric)
+        if config.executor_workers > 0 and not self.SEARCH_EXECUTOR:
+            logger.warning(f"executor_workers has no effect on {type(self).__name__}")
     
     @abstractmethod
     async def initialize(self) -> None:
@@ -311,6 +1080,28 @@ class BaseVectorStore(ABC):
         """Search for similar chunks"""
         pass
     
+    async def search_batch(
+        self,
+        embeddings: List[List[float]],
+        top_k: int,
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[List[SearchResult]]:
+        """Search several queries at once (concurrent single searches by default)"""
+        filters = _batch_filters(filters, len(embeddings))
+        return list(await asyncio.gather(*(
+            self.search(embedding, top_k, filter)
+            for embedding, filter in zip(embeddings, filters)
+        )))
+    
+    async def keyword_search(
+        self,
+        query: str,
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """BM25 keyword search (stores without a local text index return nothing)"""
+        return []
+    
     @abstractmethod
     async def delete(self, ids: List[str]) -> None:
         """Delete chunks by ID"""
@@ -321,86 +1112,2706 @@ class BaseVectorStore(ABC):
         """Clear all data"""
         pass
     
-    @abstractmethod
-    async def get_stats(self) -> Dict[str, Any]:
-        """Get statistics"""
-        pass
+    @abstractmethod
+    async def get_stats(self) -> Dict[str, Any]:
+        """Get statistics"""
+        pass
+    
+    def version(self) -> Optional[Hashable]:
+        """Token that changes whenever search results could change, or None when the store cannot tell"""
+        return None
+
+
+# ============== Memory Vector Store ==============
+
+class MemoryVectorStore(BaseVectorStore):
+    """In-memory vector store for testing"""
+    
+    SEARCH_EXECUTOR = True
+    STACK_BLOCK = 512  # Rows converted per call; list conversion holds the GIL for the whole call
+    
+    def __init__(self, config: VectorStoreConfig):
+        super().__init__(config)
+        # chunk_id -> (embedding, chunk, metadata index slot); slots grow in insertion order
+        self.vectors: Dict[str, Tuple[List[float], DocumentChunk, int]] = {}
+        # Chunks, prepared rows, squared norms and slots, rebuilt after writes
+        self.stacked: Optional[Tuple[List[DocumentChunk], np.ndarray, Optional[np.ndarray], np.ndarray]] = None
+        self.writes = 0  # Bumped on every change; a stack built across a change is not kept
+        self.next_slot = 0
+        self.keyword_index = KeywordIndex()  # chunk_id -> terms
+        self.metadata_index = MetadataIndex()  # slot -> filterable fields
+        self.executor = _create_executor(config.executor_workers)
+    
+    async def initialize(self) -> None:
+        """Initialize memory store"""
+        pass  # No initialization needed
+    
+    async def upsert(self, chunks: List[DocumentChunk]) -> None:
+        """Insert chunks into memory"""
+        for chunk in chunks:
+            if chunk.embedding:
+                entry = self.vectors.get(chunk.id)
+                if entry is None:
+                    slot = self.next_slot
+                    self.next_slot += 1
+                else:
+                    # Replacing keeps the dict position, so the slot stays in order
+                    slot = entry[2]
+                    self.metadata_index.remove(slot, _chunk_fields(entry[1]))
+                self.vectors[chunk.id] = (chunk.embedding, chunk, slot)
+                self.metadata_index.add(slot, _chunk_fields(chunk))
+                self.keyword_index.add(chunk.id, chunk.content)
+                self.stacked = None
+                self.writes += 1
+    
+    async def search(
+        self,
+        query_embedding: List[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """Search in memory"""
+        return (await self.search_batch([query_embedding], top_k, [filter]))[0]
+    
+    async def search_batch(
+        self,
+        embeddings: List[List[float]],
+        top_k: int,
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[List[SearchResult]]:
+        """Score all queries against one stacked matrix of the stored vectors"""
+        if not self.vectors or top_k <= 0 or not embeddings:
+            return [[] for _ in embeddings]
+        
+        # Filters resolve to slots here, before the executor runs alongside later writes
+        groups = [
+            (members, self.metadata_index.select(filter) if filter else None)
+            for filter, members in _group_filters(filters, len(embeddings))
+        ]
+        stacked = self.stacked
+        if stacked is None:
+            writes = self.writes
+            stacked = await _run_in(self.executor, self._stack, list(self.vectors.values()))
+            if writes == self.writes:
+                self.stacked = stacked
+        return await _run_in(self.executor, self._search_stacked, stacked, embeddings, top_k, groups)
+    
+    def _stack(
+        self,
+        entries: List[Tuple[List[float], DocumentChunk, int]]
+    ) -> Tuple[List[DocumentChunk], np.ndarray, Optional[np.ndarray], np.ndarray]:
+        """Chunks, prepared rows, squared norms and slots for a snapshot of the stored vectors"""
+        matrix = np.concatenate([
+            self.metric.prepare([entry[0] for entry in entries[start:start + self.STACK_BLOCK]])
+            for start in range(0, len(entries), self.STACK_BLOCK)
+        ])
+        slots = np.fromiter((entry[2] for entry in entries), dtype=np.int64, count=len(entries))
+        return [entry[1] for entry in entries], matrix, self.metric.sq_norms(matrix), slots
+    
+    def _search_stacked(
+        self,
+        stacked: Tuple[List[DocumentChunk], np.ndarray, Optional[np.ndarray], np.ndarray],
+        embeddings: List[List[float]],
+        top_k: int,
+        groups: List[Tuple[np.ndarray, Optional[np.ndarray]]]
+    ) -> List[List[SearchResult]]:
+        """Top-K per query group over a stacked snapshot; touches no mutable store state"""
+        results: List[List[SearchResult]] = [[] for _ in embeddings]
+        chunks, matrix, sq_norms, slots = stacked
+        queries = self.metric.prepare(embeddings)
+        
+        for members, allowed_slots in groups:
+            # Unfiltered queries score the stacked matrix as is, without copying rows out
+            allowed = None
+            candidates, candidate_norms = matrix, sq_norms
+            if allowed_slots is not None:
+                # Snapshot slots ascend; slots written after the snapshot find no row
+                allowed = np.minimum(np.searchsorted(slots, allowed_slots), len(slots) - 1)
+                allowed = allowed[slots[allowed] == allowed_slots]
+                if len(allowed) == 0:
+                    continue
+                candidates = matrix[allowed]
+                candidate_norms = None if sq_norms is None else sq_norms[allowed]
+            scores = self.metric.rank_scores(queries[members], candidates, candidate_norms)
+            order = _top_k_rows(scores, top_k)
+            top_scores = self.metric.finalize(np.take_along_axis(scores, order, axis=1), queries[members])
+            found = order if allowed is None else allowed[order]
+            for index, rows, row_scores in zip(members.tolist(), found, top_scores):
+                results[index] = [
+                    SearchResult(chunk=chunks[row], score=float(score))
+                    for row, score in zip(rows, row_scores)
+                ]
+        return results
+    
+    async def keyword_search(
+        self,
+        query: str,
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """BM25 search over the keyword index, screened by the metadata index"""
+        allowed = set(self.metadata_index.select(filter).tolist()) if filter else None
+        return await _run_in(self.executor, self._keyword_search, query, top_k, allowed)
+    
+    def _keyword_search(
+        self,
+        query: str,
+        top_k: int,
+        allowed: Optional[Set[int]]
+    ) -> List[SearchResult]:
+        """BM25 scoring; chunks deleted while it runs are skipped"""
+        accept = None
+        if allowed is not None:
+            def accept(id: str) -> bool:
+                entry = self.vectors.get(id)
+                return entry is not None and entry[2] in allowed
+        
+        results = []
+        for id, score in self.keyword_index.search(query, top_k, accept):
+            entry = self.vectors.get(id)
+            if entry is not None:
+                results.append(SearchResult(chunk=entry[1], score=score))
+        return results
+    
+    async def delete(self, ids: List[str]) -> None:
+        """Delete from memory"""
+        for id in ids:
+            entry = self.vectors.pop(id, None)
+            if entry is not None:
+                self.metadata_index.remove(entry[2], _chunk_fields(entry[1]))
+            self.keyword_index.remove(id)
+        self.stacked = None
+        self.writes += 1
+    
+    async def clear(self) -> None:
+        """Clear memory"""
+        self.vectors.clear()
+        self.keyword_index.clear()
+        self.metadata_index.clear()
+        self.stacked = None
+        self.writes += 1
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """Get memory stats"""
+        if self.vectors:
+            first_vector = next(iter(self.vectors.values()))
+            dimensions = len(first_vector[0])
+        else:
+            dimensions = 0
+        
+        return {
+            'count': len(self.vectors),
+            'dimensions': dimensions
+        }
+    
+    def version(self) -> Optional[Hashable]:
+        """Write counter"""
+        return self.writes
+    
+    async def cleanup(self) -> None:
+        """Stop the search threads"""
+        if self.executor:
+            self.executor.shutdown(wait=False)
+    
+    def _matches_filter(self, metadata: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+        """Check if metadata matches filter"""
+        return _matches_filter(metadata, filter)
+
+
+def _top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top K scores, best first"""
+    if top_k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < scores.size:
+        indices = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        indices = np.arange(scores.size)
+    return indices[np.argsort(-scores[indices], kind='stable')]
+
+
+def _top_k_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Column indices of the top K scores in each row, best first"""
+    top_k = min(top_k, scores.shape[1])
+    if top_k < scores.shape[1]:
+        indices = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        indices = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, indices, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(indices, order, axis=1)
+
+
+def _batch_filters(
+    filters: Optional[List[Optional[Dict[str, Any]]]],
+    count: int
+) -> List[Optional[Dict[str, Any]]]:
+    """One filter per query"""
+    if filters is None:
+        return [None] * count
+    if len(filters) != count:
+        raise ValueError(f"Got {len(filters)} filters for {count} queries")
+    return list(filters)
+
+
+def _group_filters(
+    filters: Optional[List[Optional[Dict[str, Any]]]],
+    count: int
+) -> List[Tuple[Optional[Dict[str, Any]], np.ndarray]]:
+    """Query positions grouped by identical filter, so each group shares one candidate set"""
+    groups: Dict[str, Tuple[Optional[Dict[str, Any]], List[int]]] = {}
+    for index, filter in enumerate(_batch_filters(filters, count)):
+        key = json.dumps(filter, sort_keys=True, default=str)
+        groups.setdefault(key, (filter, []))[1].append(index)
+    return [(filter, np.asarray(members, dtype=np.int64)) for filter, members in groups.values()]
+
+
+def _chunk_to_dict(chunk: DocumentChunk) -> Dict[str, Any]:
+    """Serializable chunk fields without the embedding"""
+    data = asdict(chunk)
+    data.pop('embedding')
+    return data
+
+
+def _chunk_fields(chunk: DocumentChunk) -> Dict[str, Any]:
+    """Filterable fields of a chunk: its metadata plus document_id"""
+    return {'document_id': chunk.document_id, **chunk.metadata}
+
+
+def _matches_filter(metadata: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+    """Check if metadata matches filter ($eq, $ne, $in, $nin, $gt, $gte, $lt, $lte, $and, $or)"""
+    for key, condition in filter.items():
+        if key == '$and':
+            if not all(_matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(_matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif not _matches_condition(metadata.get(key), condition):
+            return False
+    return True
+
+
+def _matches_condition(value: Any, condition: Any) -> bool:
+    """Check one field value against an operator condition"""
+    if not isinstance(condition, dict):
+        condition = {'$eq': condition}
+    values = _field_values(value)
+    
+    for op, operand in condition.items():
+        if op == '$eq':
+            matched = operand in values
+        elif op == '$ne':
+            matched = operand not in values
+        elif op == '$in':
+            matched = any(v in operand for v in values)
+        elif op == '$nin':
+            matched = not any(v in operand for v in values)
+        elif op in _RANGE_OPERATORS:
+            if _is_number(operand):
+                values = [v for v in values if _is_number(v)]
+            matched = any(_compare(v, op, operand) for v in values)
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        if not matched:
+            return False
+    return True
+
+
+_RANGE_OPERATORS = {
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+}
+
+
+def _compare(value: Any, op: str, operand: Any) -> bool:
+    """Range comparison that treats incomparable types as a miss"""
+    try:
+        return _RANGE_OPERATORS[op](value, operand)
+    except TypeError:
+        return False
+
+
+def _is_number(value: Any) -> bool:
+    """Numeric but not bool"""
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, bool)
+
+
+def _field_values(value: Any) -> List[Any]:
+    """Values a field contributes to matching (list elements, or the value itself)"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+
+# ============== Metadata Index ==============
+
+class MetadataIndex:
+    """Inverted index over chunk fields that compiles filters into row sets"""
+    
+    def __init__(self):
+        self.postings: Dict[str, Dict[Any, Set[int]]] = {}  # key -> value -> rows
+        self.ranges: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}  # key -> sorted numeric values, rows
+        self.all_rows: Set[int] = set()
+    
+    def add(self, row: int, fields: Dict[str, Any]) -> None:
+        """Index a row's fields"""
+        self.all_rows.add(row)
+        for key, value in fields.items():
+            for item in _field_values(value):
+                try:
+                    self.postings.setdefault(key, {}).setdefault(item, set()).add(row)
+                except TypeError:
+                    continue  # Unhashable values are not indexed
+                self.ranges.pop(key, None)
+    
+    def remove(self, row: int, fields: Dict[str, Any]) -> None:
+        """Drop a row's fields"""
+        self.all_rows.discard(row)
+        for key, value in fields.items():
+            values = self.postings.get(key)
+            if values is None:
+                continue
+            for item in _field_values(value):
+                try:
+                    rows = values.get(item)
+                except TypeError:
+                    continue
+                if rows is not None:
+                    rows.discard(row)
+                    if not rows:
+                        del values[item]
+                    self.ranges.pop(key, None)
+    
+    def remap(self, mapping: np.ndarray) -> None:
+        """Renumber rows through mapping (old row -> new row, -1 drops the row)"""
+        mapping = mapping.tolist()
+        for values in self.postings.values():
+            for value, rows in list(values.items()):
+                moved = {mapping[row] for row in rows if mapping[row] >= 0}
+                if moved:
+                    values[value] = moved
+                else:
+                    del values[value]
+        self.all_rows = {mapping[row] for row in self.all_rows if mapping[row] >= 0}
+        self.ranges.clear()
+    
+    def clear(self) -> None:
+        """Drop all postings"""
+        self.postings.clear()
+        self.ranges.clear()
+        self.all_rows.clear()
+    
+    def select(self, filter: Dict[str, Any]) -> np.ndarray:
+        """Sorted rows matching a filter"""
+        rows = self._select(filter)
+        return np.sort(np.fromiter(rows, dtype=np.int64, count=len(rows)))
+    
+    def _select(self, filter: Dict[str, Any]) -> Set[int]:
+        """Rows matching every clause of a filter"""
+        result: Optional[Set[int]] = None
+        for key, condition in filter.items():
+            if key == '$and':
+                rows = self._intersect(self._select(sub) for sub in condition)
+            elif key == '$or':
+                rows = set().union(*(self._select(sub) for sub in condition))
+            else:
+                rows = self._select_field(key, condition)
+            result = rows if result is None else result & rows
+            if not result:
+                return set()
+        return set(self.all_rows) if result is None else result
+    
+    def _select_field(self, key: str, condition: Any) -> Set[int]:
+        """Rows whose field satisfies an operator condition"""
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        values = self.postings.get(key, {})
+        
+        matches = []
+        for op, operand in condition.items():
+            if op == '$eq':
+                rows = self._lookup(values, operand)
+            elif op == '$ne':
+                rows = self.all_rows - self._lookup(values, operand)
+            elif op == '$in':
+                rows = set().union(*(self._lookup(values, v) for v in operand))
+            elif op == '$nin':
+                rows = self.all_rows - set().union(*(self._lookup(values, v) for v in operand))
+            elif op in _RANGE_OPERATORS:
+                rows = self._range(key, op, operand)
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+            matches.append(rows)
+        return self._intersect(matches)
+    
+    def _range(self, key: str, op: str, operand: Any) -> Set[int]:
+        """Rows in a range: binary search for numbers, a value scan otherwise"""
+        if not _is_number(operand):
+            return set().union(*(
+                rows for value, rows in self.postings.get(key, {}).items()
+                if _compare(value, op, operand)
+            ))
+        
+        values, rows = self._range_arrays(key)
+        if op in ('$gt', '$gte'):
+            start = np.searchsorted(values, operand, side='right' if op == '$gt' else 'left')
+            return set(rows[start:].tolist())
+        end = np.searchsorted(values, operand, side='left' if op == '$lt' else 'right')
+        return set(rows[:end].tolist())
+    
+    def _range_arrays(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Numeric values of a key with their rows, sorted by value (cached)"""
+        if key not in self.ranges:
+            pairs = [
+                (value, row)
+                for value, rows in self.postings.get(key, {}).items() if _is_number(value)
+                for row in rows
+            ]
+            values = np.asarray([value for value, _ in pairs], dtype=np.float64)
+            rows = np.asarray([row for _, row in pairs], dtype=np.int64)
+            order = np.argsort(values, kind='stable')
+            self.ranges[key] = (values[order], rows[order])
+        return self.ranges[key]
+    
+    @staticmethod
+    def _lookup(values: Dict[Any, Set[int]], operand: Any) -> Set[int]:
+        """Postings for one value"""
+        try:
+            return values.get(operand, set())
+        except TypeError:
+            return set()
+    
+    def _intersect(self, row_sets: Any) -> Set[int]:
+        """Intersection of row sets, smallest first"""
+        ordered = sorted(row_sets, key=len)
+        if not ordered:
+            return set(self.all_rows)
+        return ordered[0].intersection(*ordered[1:])
+
+
+# ============== Keyword Index ==============
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def _tokenize(text: str) -> List[str]:
+    """Lowercased word tokens"""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class KeywordIndex:
+    """Inverted index over chunk text scored with Okapi BM25
+    
+    Keys are whatever the owning store addresses chunks by (ids or rows).
+    Text is tokenized once when added; a query touches only the postings of
+    its own terms.
+    """
+    
+    K1 = 1.2  # Term-frequency saturation
+    B = 0.75  # Document-length normalization
+    
+    def __init__(self):
+        self.postings: Dict[str, Dict[Any, int]] = {}  # term -> key -> term frequency
+        self.terms: Dict[Any, Tuple[str, ...]] = {}  # key -> distinct terms
+        self.lengths: Dict[Any, int] = {}  # key -> token count
+        self.total_length = 0
+        self.lock = threading.RLock()  # Searches may run on executor threads while writes arrive
+    
+    def __len__(self) -> int:
+        return len(self.lengths)
+    
+    def add(self, key: Any, text: str) -> None:
+        """Index (or re-index) a key's text"""
+        tokens = _tokenize(text)
+        counts = Counter(tokens)
+        with self.lock:
+            self.remove(key)
+            for term, count in counts.items():
+                self.postings.setdefault(term, {})[key] = count
+            self.terms[key] = tuple(counts)
+            self.lengths[key] = len(tokens)
+            self.total_length += len(tokens)
+    
+    def remove(self, key: Any) -> None:
+        """Drop a key's postings"""
+        with self.lock:
+            length = self.lengths.pop(key, None)
+            if length is None:
+                return
+            self.total_length -= length
+            for term in self.terms.pop(key):
+                keys = self.postings[term]
+                del keys[key]
+                if not keys:
+                    del self.postings[term]
+    
+    def clear(self) -> None:
+        """Drop all postings"""
+        with self.lock:
+            self.postings.clear()
+            self.terms.clear()
+            self.lengths.clear()
+            self.total_length = 0
+    
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        accept: Optional[Any] = None
+    ) -> List[Tuple[Any, float]]:
+        """Top-K (key, score) pairs; accept(key) screens candidates such as filter misses"""
+        if not self.lengths or top_k <= 0:
+            return []
+        
+        scores: Dict[Any, float] = {}
+        with self.lock:
+            count = len(self.lengths)
+            average_length = self.total_length / count or 1.0
+            for term in set(_tokenize(query)):
+                keys = self.postings.get(term)
+                if not keys:
+                    continue
+                idf = float(np.log(1 + (count - len(keys) + 0.5) / (len(keys) + 0.5)))
+                for key, frequency in keys.items():
+                    norm = frequency + self.K1 * (1 - self.B + self.B * self.lengths[key] / average_length)
+                    scores[key] = scores.get(key, 0.0) + idf * frequency * (self.K1 + 1) / norm
+        
+        candidates = scores.items()
+        if accept:
+            candidates = [(key, score) for key, score in candidates if accept(key)]
+        return heapq.nlargest(top_k, candidates, key=lambda item: item[1])
+
+
+# ============== Vector Compression ==============
+
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+class VectorCodec:
+    """Compressed row storage for unit-normalized vectors"""
+    
+    MODES = ('float16', 'int8', 'binary')
+    BLOCK_ROWS = 65536  # Rows decoded per step to bound temporary memory
+    
+    def __init__(self, mode: str, dimension: int):
+        if mode not in self.MODES:
+            raise ValueError(f"Unsupported compression: {mode}")
+        self.mode = mode
+        self.dimension = dimension
+        self.scale = np.zeros(dimension, dtype=np.float32)  # int8 step per dimension
+        self.codes = np.zeros((0, self.code_width), dtype=self.code_dtype)
+    
+    @property
+    def code_width(self) -> int:
+        """Stored values per vector"""
+        return (self.dimension + 7) // 8 if self.mode == 'binary' else self.dimension
+    
+    @property
+    def code_dtype(self) -> type:
+        """Stored value type"""
+        return {'float16': np.float16, 'int8': np.int8, 'binary': np.uint8}[self.mode]
+    
+    @property
+    def bytes_per_vector(self) -> int:
+        """Code size of one vector"""
+        return self.code_width * np.dtype(self.code_dtype).itemsize
+    
+    def resize(self, capacity: int, size: int) -> None:
+        """Reallocate code storage, keeping the first `size` rows"""
+        codes = np.zeros((capacity, self.code_width), dtype=self.code_dtype)
+        codes[:size] = self.codes[:size]
+        self.codes = codes
+    
+    def gather(self, rows: np.ndarray) -> None:
+        """Move `rows` to the front, in order"""
+        self.codes[:len(rows)] = self.codes[rows]
+    
+    def encode(self, rows: np.ndarray, vectors: np.ndarray, size: int) -> None:
+        """Write compressed codes for vectors into rows"""
+        if self.mode == 'float16':
+            self.codes[rows] = vectors.astype(np.float16)
+        elif self.mode == 'int8':
+            self._widen_scale(np.abs(vectors).max(axis=0), size)
+            step = np.where(self.scale == 0, 1, self.scale)
+            self.codes[rows] = np.clip(np.rint(vectors / step), -127, 127).astype(np.int8)
+        else:
+            self.codes[rows] = np.packbits(vectors > 0, axis=1)
+    
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        """Approximate float32 vectors for rows"""
+        codes = self.codes[rows]
+        if self.mode == 'float16':
+            return codes.astype(np.float32)
+        if self.mode == 'int8':
+            return codes.astype(np.float32) * self.scale
+        signs = np.unpackbits(codes, axis=-1)[..., :self.dimension].astype(np.float32) * 2 - 1
+        return signs / np.sqrt(self.dimension)
+    
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray], size: int) -> np.ndarray:
+        """Approximate similarity of query against rows (all rows when None)"""
+        count = size if rows is None else len(rows)
+        blocks = []
+        
+        if self.mode == 'binary':
+            # Hamming distance between sign codes, mapped onto [-1, 1]
+            packed = np.packbits(query > 0)
+            for start in range(0, count, self.BLOCK_ROWS):
+                block = self._block(rows, start, count)
+                hamming = _POPCOUNT[np.bitwise_xor(block, packed)].sum(axis=1, dtype=np.int32)
+                blocks.append(1 - 2 * hamming.astype(np.float32) / self.dimension)
+        else:
+            # Asymmetric scoring: fold the int8 steps into the query once
+            weights = query * self.scale if self.mode == 'int8' else query
+            for start in range(0, count, self.BLOCK_ROWS):
+                blocks.append(self._block(rows, start, count).astype(np.float32) @ weights)
+        
+        return np.concatenate(blocks) if blocks else np.empty(0, dtype=np.float32)
+    
+    def score_matrix(self, queries: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Approximate similarities of several queries against rows, as one product"""
+        if self.mode == 'binary':
+            # Sign vectors scaled like decode() give the same score as the Hamming mapping
+            queries = np.where(queries > 0, 1, -1).astype(np.float32) / np.sqrt(self.dimension)
+        return queries @ self.decode(rows).T
+    
+    def _block(self, rows: Optional[np.ndarray], start: int, count: int) -> np.ndarray:
+        """Slice of codes for one scoring step"""
+        end = min(start + self.BLOCK_ROWS, count)
+        return self.codes[start:end] if rows is None else self.codes[rows[start:end]]
+    
+    def _widen_scale(self, peaks: np.ndarray, size: int) -> None:
+        """Grow int8 steps to cover new peaks, requantizing stored rows"""
+        needed = peaks.astype(np.float32) / 127
+        grown = needed > self.scale
+        if not grown.any():
+            return
+        
+        columns = np.flatnonzero(grown)
+        if size:
+            ratio = self.scale[columns] / needed[columns]
+            requantized = np.rint(self.codes[:size, columns].astype(np.float32) * ratio)
+            self.codes[:size, columns] = requantized.astype(np.int8)
+        self.scale[columns] = needed[columns]
+
+
+# ============== Matrix Vector Store ==============
+
+class MatrixVectorStore(BaseVectorStore):
+    """In-memory vector store backed by one contiguous float32 matrix"""
+    
+    SEARCH_EXECUTOR = True
+    MIN_CAPACITY = 16
+    RECALL_SAMPLES = 32  # Queries per recall estimate
+    RECALL_ROWS = 1024  # Rows whose float16 vectors are kept as recall ground truth
+    BATCH_SCORES = 1 << 24  # Score matrix entries computed per block of queries
+    
+    def __init__(self, config: VectorStoreConfig):
+        super().__init__(config)
+        self.compressed = config.compression != 'none'
+        # Uncompressed rows live in a float32 matrix; compressed rows in codes plus an optional rescoring copy
+        self.matrix_dtype = np.dtype(np.float32) if not self.compressed else (
+            np.dtype(config.rescore_dtype) if config.rescore else None
+        )
+        self.dimension: Optional[int] = None
+        self.matrix: Optional[np.ndarray] = None  # Rows used for exact scoring
+        self.sq_norms: Optional[np.ndarray] = None  # Row squared norms (euclidean metric)
+        self.codec: Optional[VectorCodec] = None  # Compressed rows
+        self.capacity = 0
+        self.size = 0
+        self.ids: List[str] = []  # row -> chunk_id
+        self.chunks: List[DocumentChunk] = []  # row -> chunk
+        self.rows: Dict[str, int] = {}  # chunk_id -> live row
+        self.live = np.zeros(0, dtype=bool)  # row -> not tombstoned
+        self.dead_count = 0
+        self.compactions = 0
+        self.compaction_task: Optional[asyncio.Task] = None
+        self.writes = 0  # Bumped on every change; keys the cached recall estimate and checks pool searches
+        self.executor = _create_executor(config.executor_workers)
+        self.searches = 0  # Searches scoring a snapshot on the executor
+        self.searches_idle = asyncio.Event()  # Set when no executor search is in flight
+        self.searches_idle.set()
+        self.recall: Optional[Tuple[Tuple[int, int], Dict[str, Optional[float]]]] = None
+        self.recall_ids: List[str] = []  # Reservoir sample of written chunk ids
+        self.recall_slots: Dict[str, int] = {}  # chunk_id -> row of recall_vectors
+        self.recall_vectors = np.zeros((0, 0), dtype=np.float16)
+        self.recall_seen = 0
+        self.recall_rng = np.random.default_rng(0)
+        self.metadata_index = MetadataIndex()
+        self.keyword_index = KeywordIndex()  # chunk_id -> terms
+        if self.compressed and config.metric != 'cosine':
+            raise ValueError('Compressed matrix layouts support only the cosine metric')
+        if self.compressed and config.rescore_dtype not in ('float16', 'float32'):
+            raise ValueError(f"Unsupported rescore dtype: {config.rescore_dtype}")
+        if self.compressed and config.rescore and config.rescore_dtype == config.compression:
+            raise ValueError('The rescoring copy must be more precise than the compressed codes')
+        if config.dimension:
+            self._allocate(config.dimension)
+    
+    async def initialize(self) -> None:
+        """Initialize matrix store"""
+        pass  # No initialization needed
+    
+    async def upsert(self, chunks: List[DocumentChunk]) -> None:
+        """Insert or overwrite rows, growing the matrix by doubling"""
+        # Last write wins for duplicate ids within one batch
+        latest = {chunk.id: chunk for chunk in chunks if chunk.embedding}
+        if not latest:
+            return
+        
+        batch = list(latest.values())
+        vectors = self.metric.prepare([chunk.embedding for chunk in batch])
+        self._check_dimension(vectors.shape[1])
+        
+        rows = np.empty(len(batch), dtype=np.int64)
+        new_count = sum(1 for chunk in batch if chunk.id not in self.rows)
+        self._reserve(self.size + new_count)
+        
+        for i, chunk in enumerate(batch):
+            if self.codec:
+                # Codes hold the vector; keep a copy without the float list, not the caller's chunk
+                chunk = replace(chunk, embedding=None)
+            row = self.rows.get(chunk.id)
+            if row is None:
+                row = self.size
+                self.rows[chunk.id] = row
+                self.ids.append(chunk.id)
+                self.chunks.append(chunk)
+                self.live[row] = True
+                self.size += 1
+            else:
+                self.metadata_index.remove(row, _chunk_fields(self.chunks[row]))
+                self.chunks[row] = chunk
+            self.metadata_index.add(row, _chunk_fields(chunk))
+            self.keyword_index.add(chunk.id, chunk.content)
+            rows[i] = row
+        
+        self._write_rows(rows, vectors)
+    
+    async def search(
+        self,
+        embedding: List[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """Single matrix-vector product followed by partial top-K selection"""
+        return (await self._search([embedding], top_k, [filter]))[0]
+    
+    async def search_batch(
+        self,
+        embeddings: List[List[float]],
+        top_k: int,
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[List[SearchResult]]:
+        """Matrix-matrix product per distinct filter, followed by batched top-K selection"""
+        return await self._search(embeddings, top_k, filters)
+    
+    async def _search(
+        self,
+        embeddings: List[List[float]],
+        top_k: int,
+        filters: Optional[List[Optional[Dict[str, Any]]]]
+    ) -> List[List[SearchResult]]:
+        """Rank queries on the executor when there is one, otherwise inline"""
+        results: List[List[SearchResult]] = [[] for _ in embeddings]
+        if self.size == self.dead_count or top_k <= 0 or not embeddings:
+            return results
+        
+        queries = self.metric.prepare(embeddings)
+        self._check_dimension(queries.shape[1])
+        
+        ranked = None
+        compaction_pending = self.compaction_task is not None and not self.compaction_task.done()
+        if self.executor and not compaction_pending:
+            # Score a snapshot on the pool; a write in the meantime means ranking again here
+            writes = self.writes
+            groups = self._filter_groups(filters, len(embeddings))
+            self.searches += 1
+            self.searches_idle.clear()
+            try:
+                ranked = await _run_in(self.executor, self._snapshot()._rank_groups, queries, groups, top_k)
+            finally:
+                self.searches -= 1
+                if not self.searches:
+                    self.searches_idle.set()
+            if writes != self.writes:
+                ranked = None
+        if ranked is None:
+            ranked = self._rank_groups(queries, self._filter_groups(filters, len(embeddings)), top_k)
+        
+        for members, group in ranked:
+            for index, (top, scores) in zip(members.tolist(), group):
+                results[index] = [self._result(row, score) for row, score in zip(top, scores)]
+        return results
+    
+    async def keyword_search(
+        self,
+        query: str,
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """BM25 search over the keyword index, screened by the metadata index"""
+        accept = None
+        if filter:
+            allowed = set(self.metadata_index.select(filter).tolist())
+            accept = lambda id: self.rows[id] in allowed
+        return [
+            self._result(self.rows[id], score)
+            for id, score in self.keyword_index.search(query, top_k, accept)
+        ]
+    
+    async def delete(self, ids: List[str]) -> None:
+        """Tombstone rows; compaction reclaims them in the background"""
+        self._tombstone(ids)
+    
+    async def clear(self) -> None:
+        """Clear matrix"""
+        if self.compaction_task:
+            self.compaction_task.cancel()
+            self.compaction_task = None
+        self.size = 0
+        self.dead_count = 0
+        self.writes += 1
+        self.ids.clear()
+        self.chunks.clear()
+        self.rows.clear()
+        self.keyword_index.clear()
+        self.metadata_index.clear()
+        self.recall_ids.clear()
+        self.recall_slots.clear()
+        self.recall_seen = 0
+        if self.dimension:
+            self._allocate(self.dimension)
+    
+    async def cleanup(self) -> None:
+        """Stop the search threads"""
+        if self.executor:
+            self.executor.shutdown(wait=False)
+    
+    def version(self) -> Optional[Hashable]:
+        """Write counter (compaction counts as a write)"""
+        return self.writes
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """Get matrix stats"""
+        code_bytes = self.codec.bytes_per_vector if self.codec else 0
+        full_bytes = self.dimension * self.matrix.itemsize if self.matrix is not None else 0
+        count = self.size - self.dead_count
+        stats = {
+            'count': count,
+            'dimensions': self.dimension if count else 0,
+            'capacity': self.capacity,
+            'dead_rows': self.dead_count,
+            'compactions': self.compactions,
+            'compression': self.config.compression,
+            'bytes_per_vector': code_bytes + full_bytes,
+            'memory_bytes': self.capacity * (code_bytes + full_bytes)
+        }
+        if self.codec:
+            stats['code_bytes_per_vector'] = code_bytes
+            stats['recall_at_10'] = self._estimate_recall(10)
+        return stats
+    
+    def compact(self) -> None:
+        """Drop tombstoned rows, renumbering live rows contiguously"""
+        if not self.dead_count:
+            return
+        keep = self._live_rows()
+        remap = np.full(self.size, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        self._compact_rows(keep, remap)
+        self.compactions += 1
+        self.writes += 1
+    
+    def _filter_groups(
+        self,
+        filters: Optional[List[Optional[Dict[str, Any]]]],
+        count: int
+    ) -> List[Tuple[np.ndarray, Optional[np.ndarray]]]:
+        """Query positions sharing each distinct filter, with the rows it allows"""
+        return [
+            (members, self.metadata_index.select(filter) if filter else None)
+            for filter, members in _group_filters(filters, count)
+        ]
+    
+    def _rank_groups(
+        self,
+        queries: np.ndarray,
+        groups: List[Tuple[np.ndarray, Optional[np.ndarray]]],
+        top_k: int
+    ) -> List[Tuple[np.ndarray, List[Tuple[np.ndarray, np.ndarray]]]]:
+        """Ranked rows for every query, one batched pass per filter group"""
+        return [
+            (members, self._rank_batch(queries[members], rows, top_k))
+            for members, rows in groups
+            if rows is None or len(rows)
+        ]
+    
+    def _snapshot(self) -> 'MatrixVectorStore':
+        """Shallow copy for executor searches; writes that reallocate storage leave its arrays alone"""
+        view = copy.copy(self)
+        if self.codec:
+            view.codec = copy.copy(self.codec)
+        return view
+    
+    def _rank(
+        self,
+        query: np.ndarray,
+        rows: Optional[np.ndarray],
+        top_k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-K rows and scores among `rows` (all rows when None)"""
+        top_k = min(top_k, self._candidate_count(rows))
+        if self.codec is None:
+            matrix, sq_norms = self._exact_rows(rows)
+            scores = self._drop_dead(self.metric.rank_scores(query, matrix, sq_norms), rows)
+            order = _top_k_indices(scores, top_k)
+            return (order if rows is None else rows[order]), self.metric.finalize(scores[order], query)
+        
+        # Coarse pass over compressed codes
+        coarse = self._drop_dead(self.codec.scores(query, rows, self.size), rows)
+        pool = top_k * max(1, self.config.rescore_factor) if self.matrix is not None else top_k
+        order = _top_k_indices(coarse, min(pool, self._candidate_count(rows)))
+        candidates = order if rows is None else rows[order]
+        if self.matrix is None:
+            return candidates, coarse[order]
+        
+        # Rescore the small candidate set from the side copy
+        exact = self.matrix[candidates].astype(np.float32) @ query
+        order = _top_k_indices(exact, top_k)
+        return candidates[order], exact[order]
+    
+    def _rank_batch(
+        self,
+        queries: np.ndarray,
+        rows: Optional[np.ndarray],
+        top_k: int
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Top-K rows and scores for each query, scoring blocks of queries at once"""
+        if self.codec:
+            return [self._rank(query, rows, top_k) for query in queries]
+        
+        matrix, sq_norms = self._exact_rows(rows)
+        top_k = min(top_k, self._candidate_count(rows))
+        step = max(1, self.BATCH_SCORES // len(matrix))
+        ranked = []
+        for start in range(0, len(queries), step):
+            block = queries[start:start + step]
+            scores = self._drop_dead(self.metric.rank_scores(block, matrix, sq_norms), rows)
+            order = _top_k_rows(scores, top_k)
+            top = order if rows is None else rows[order]
+            ranked.extend(zip(top, self.metric.finalize(np.take_along_axis(scores, order, axis=1), block)))
+        return ranked
+    
+    def _candidate_count(self, rows: Optional[np.ndarray]) -> int:
+        """Live rows a ranking pass can return"""
+        return self.size - self.dead_count if rows is None else len(rows)
+    
+    def _drop_dead(self, scores: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Exclude tombstoned rows from full-scan scores (filtered rows are always live)"""
+        if rows is None and self.dead_count:
+            scores[..., ~self.live[:self.size]] = -np.inf
+        return scores
+    
+    def _exact_rows(self, rows: Optional[np.ndarray]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Full-precision rows (all when None) with their squared norms"""
+        if rows is None:
+            rows = slice(0, self.size)
+        return self.matrix[rows], None if self.sq_norms is None else self.sq_norms[rows]
+    
+    def _result(self, row: int, score: float) -> SearchResult:
+        """Build a search result, restoring the embedding when it was released"""
+        chunk = self.chunks[row]
+        if self.codec:
+            chunk = replace(chunk, embedding=self._vectors(row).tolist())
+        return SearchResult(chunk=chunk, score=float(score))
+    
+    def _estimate_recall(self, k: int) -> Dict[str, Optional[float]]:
+        """Recall@k of the compressed search over the sampled rows, cached until the next write
+        
+        The sample's float16 vectors, kept as rows are written, stand in for
+        exact search, so codes-only stores get an estimate too.
+        """
+        if self.recall is not None and self.recall[0] == (self.writes, k):
+            return self.recall[1]
+        
+        ids = [id for id in self.recall_ids if id in self.rows]
+        if not ids:
+            return {'coarse': None, 'rescored': None}
+        rows = np.fromiter((self.rows[id] for id in ids), dtype=np.int64, count=len(ids))
+        truth_vectors = self.recall_vectors[[self.recall_slots[id] for id in ids]].astype(np.float32)
+        
+        rng = np.random.default_rng(0)
+        samples = rng.choice(len(ids), min(self.RECALL_SAMPLES, len(ids)), replace=False)
+        noise = rng.normal(scale=0.1 / np.sqrt(self.dimension), size=(len(samples), self.dimension))
+        queries = _normalize(truth_vectors[samples] + noise.astype(np.float32))
+        
+        k = min(k, len(ids))
+        truth = _top_k_rows(queries @ truth_vectors.T, k)
+        coarse = self.codec.score_matrix(queries, rows)
+        if self.matrix is None:
+            pool = _top_k_rows(coarse, k)
+            rescored = None
+        else:
+            pool = _top_k_rows(coarse, min(k * max(1, self.config.rescore_factor), len(ids)))
+            exact = queries @ self.matrix[rows].astype(np.float32).T
+            rescored = np.take_along_axis(
+                pool, _top_k_rows(np.take_along_axis(exact, pool, axis=1), k), axis=1
+            )
+        
+        total = k * len(queries)
+        estimate = {
+            'coarse': float(sum(np.isin(pool[i, :k], truth[i]).sum() for i in range(len(queries))) / total),
+            'rescored': None if rescored is None else float(
+                sum(np.isin(rescored[i], truth[i]).sum() for i in range(len(queries))) / total
+            )
+        }
+        self.recall = ((self.writes, k), estimate)
+        return estimate
+    
+    def _write_rows(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """Store normalized vectors into rows"""
+        self.writes += 1
+        if self.matrix is not None:
+            self.matrix[rows] = vectors
+        if self.sq_norms is not None:
+            self.sq_norms[rows] = self.metric.sq_norms(vectors)
+        if self.codec:
+            self.codec.encode(rows, vectors, self.size)
+            self._sample_rows(rows, vectors)
+    
+    def _sample_rows(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """Keep float16 copies of a reservoir sample of written rows for recall estimates"""
+        for row, vector in zip(rows.tolist(), vectors):
+            id = self.ids[row]
+            slot = self.recall_slots.get(id)
+            if slot is None:
+                self.recall_seen += 1
+                if len(self.recall_ids) < self.RECALL_ROWS:
+                    slot = len(self.recall_ids)
+                    self.recall_ids.append(id)
+                else:
+                    slot = int(self.recall_rng.integers(self.recall_seen))
+                    if slot >= self.RECALL_ROWS:
+                        continue
+                    del self.recall_slots[self.recall_ids[slot]]
+                    self.recall_ids[slot] = id
+                self.recall_slots[id] = slot
+            if slot >= len(self.recall_vectors):
+                grown = np.zeros((min(self.RECALL_ROWS, max(16, slot * 2)), self.dimension), dtype=np.float16)
+                grown[:len(self.recall_vectors)] = self.recall_vectors
+                self.recall_vectors = grown
+            self.recall_vectors[slot] = vector
+    
+    def _release_row(self, row: int) -> None:
+        """Unindex a row before it is deleted"""
+        self.metadata_index.remove(row, _chunk_fields(self.chunks[row]))
+    
+    def _tombstone(self, ids: List[str]) -> None:
+        """Mark rows dead; searches skip them until compaction drops them"""
+        for id in ids:
+            row = self.rows.pop(id, None)
+            if row is None:
+                continue
+            self._release_row(row)
+            self.keyword_index.remove(id)
+            self.live[row] = False
+            self.dead_count += 1
+            self.writes += 1
+        self._schedule_compaction()
+    
+    def _schedule_compaction(self) -> None:
+        """Compact in a background task once the dead-row ratio passes the threshold"""
+        if self.dead_count < max(self.MIN_CAPACITY, self.size * self.config.compaction_threshold):
+            return
+        if self.compaction_task and not self.compaction_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.compact()  # No event loop to defer to
+            return
+        self.compaction_task = loop.create_task(self._compact_soon())
+    
+    async def _compact_soon(self) -> None:
+        """Let the triggering call return and executor searches drain before compacting"""
+        await asyncio.sleep(0)
+        while self.searches:
+            await self.searches_idle.wait()
+        self.compact()
+    
+    def _compact_rows(self, keep: np.ndarray, remap: np.ndarray) -> None:
+        """Gather live rows to the front and renumber everything that refers to rows"""
+        size = len(keep)
+        if self.matrix is not None:
+            self.matrix[:size] = self.matrix[keep]
+        if self.sq_norms is not None:
+            self.sq_norms[:size] = self.sq_norms[keep]
+        if self.codec:
+            self.codec.gather(keep)
+        self.live[:size] = True
+        self.live[size:self.size] = False
+        
+        self.ids = [self.ids[row] for row in keep.tolist()]
+        self.chunks = [self.chunks[row] for row in keep.tolist()]
+        self.rows = {id: row for row, id in enumerate(self.ids)}
+        self.metadata_index.remap(remap)
+        self.size = size
+        self.dead_count = 0
+        
+        # Give memory back once the matrix is mostly empty
+        if self.capacity > self.MIN_CAPACITY and size * 4 < self.capacity:
+            self._resize(max(size * 2, self.MIN_CAPACITY))
+    
+    def _live_rows(self) -> np.ndarray:
+        """Rows holding searchable vectors"""
+        return np.flatnonzero(self.live[:self.size])
+    
+    def _vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Best available float32 vectors for rows"""
+        if self.matrix is not None:
+            return self.matrix[rows].astype(np.float32, copy=False)
+        return self.codec.decode(rows)
+    
+    def _allocate(self, dimension: int) -> None:
+        """Create empty storage for the given dimension"""
+        self.dimension = dimension
+        self.capacity = 0
+        self.matrix = None if self.matrix_dtype is None else np.zeros((0, dimension), dtype=self.matrix_dtype)
+        self.recall_vectors = np.zeros((0, dimension), dtype=np.float16)
+        self.sq_norms = np.zeros(0, dtype=np.float32) if self.metric.name == 'euclidean' else None
+        self.live = np.zeros(0, dtype=bool)
+        self.codec = VectorCodec(self.config.compression, dimension) if self.compressed else None
+    
+    def _reserve(self, capacity: int) -> None:
+        """Grow storage by amortized doubling"""
+        if capacity > self.capacity:
+            self._resize(max(capacity, self.capacity * 2, self.MIN_CAPACITY))
+    
+    def _resize(self, capacity: int) -> None:
+        """Reallocate storage, keeping live rows"""
+        if self.matrix is not None:
+            matrix = np.zeros((capacity, self.dimension), dtype=self.matrix_dtype)
+            matrix[:self.size] = self.matrix[:self.size]
+            self.matrix = matrix
+        if self.sq_norms is not None:
+            sq_norms = np.zeros(capacity, dtype=np.float32)
+            sq_norms[:self.size] = self.sq_norms[:self.size]
+            self.sq_norms = sq_norms
+        live = np.zeros(capacity, dtype=bool)
+        live[:self.size] = self.live[:self.size]
+        self.live = live
+        if self.codec:
+            self.codec.resize(capacity, self.size)
+        self.capacity = capacity
+    
+    def _check_dimension(self, dimension: int) -> None:
+        """Fix the dimension on first write and reject mismatches"""
+        if self.dimension is None:
+            self._allocate(dimension)
+        elif dimension != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {dimension} does not match store dimension {self.dimension}"
+            )
+
+
+# ============== IVF Vector Store ==============
+
+class IVFVectorStore(MatrixVectorStore):
+    """Matrix store with an inverted-file (IVF) index for sub-linear search"""
+    
+    MIN_TRAIN_SIZE = 1024  # Exact search below this many rows
+    TRAIN_ITERATIONS = 10
+    TRAIN_SAMPLES_PER_LIST = 32
+    RETRAIN_GROWTH = 2.0  # Retrain once the store doubles since training
+    RETRAIN_ERROR = 1.5  # ...or new rows quantize this much worse than the training set
+    
+    def __init__(self, config: VectorStoreConfig):
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[List[int]] = []  # list -> rows
+        self.assignments = np.zeros(0, dtype=np.int32)  # row -> list
+        self.positions = np.zeros(0, dtype=np.int64)  # row -> position in its list
+        self.trained_size = 0
+        self.trained_error = 0.0
+        self.drift_error = 0.0  # Quantization error of rows assigned since training
+        self.drift_count = 0
+        super().__init__(config)
+        if config.metric != 'cosine':
+            raise ValueError('IVFVectorStore supports only the cosine metric')
+    
+    async def clear(self) -> None:
+        """Clear matrix and index"""
+        await super().clear()
+        self.centroids = None
+        self.lists = []
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.positions = np.zeros(0, dtype=np.int64)
+        self.trained_size = 0
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """Get matrix and index stats"""
+        stats = await super().get_stats()
+        stats.update({
+            'index': 'ivf',
+            'trained': self.centroids is not None,
+            'nlist': len(self.lists),
+            'nprobe': self.config.nprobe,
+            'largest_list': max((len(rows) for rows in self.lists), default=0)
+        })
+        return stats
+    
+    def train(self) -> None:
+        """Train the coarse quantizer with spherical k-means and rebuild posting lists"""
+        live = self._live_rows()
+        nlist = min(self.config.nlist or max(1, int(np.sqrt(len(live)))), len(live))
+        rng = np.random.default_rng(0)
+        sample_size = min(len(live), nlist * self.TRAIN_SAMPLES_PER_LIST)
+        sample = self._vectors(np.sort(rng.choice(live, sample_size, replace=False)))
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)]
+        
+        for _ in range(self.TRAIN_ITERATIONS):
+            labels = (sample @ centroids.T).argmax(axis=1)
+            counts = np.bincount(labels, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            filled = counts > 0
+            
+            sums = np.empty_like(centroids)
+            sums[filled] = np.add.reduceat(sample[np.argsort(labels, kind='stable')], starts[filled], axis=0)
+            # Reseed empty lists from random sample points
+            sums[~filled] = sample[rng.choice(sample_size, int((~filled).sum()))]
+            centroids = _normalize(sums)
+        
+        self.centroids = centroids.astype(np.float32)
+        self.lists = [[] for _ in range(nlist)]
+        self.assignments[:] = -1
+        
+        errors = [
+            self._assign(live[start:start + VectorCodec.BLOCK_ROWS])
+            for start in range(0, len(live), VectorCodec.BLOCK_ROWS)
+        ]
+        self.trained_error = float(np.concatenate(errors).mean())
+        self.trained_size = len(live)
+        self.drift_error = 0.0
+        self.drift_count = 0
+    
+    def _rank(
+        self,
+        query: np.ndarray,
+        rows: Optional[np.ndarray],
+        top_k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Scan only the posting lists of the nprobe closest centroids"""
+        if self.centroids is None:
+            return super()._rank(query, rows, top_k)
+        
+        probes = _top_k_indices(self.centroids @ query, min(self.config.nprobe, len(self.lists)))
+        candidates = np.concatenate([np.asarray(self.lists[p], dtype=np.int64) for p in probes])
+        if rows is not None:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+        
+        if len(candidates) < top_k:
+            # Probed lists cannot fill the request; fall back to an exact scan
+            return super()._rank(query, rows, top_k)
+        return super()._rank(query, candidates, top_k)
+    
+    def _rank_batch(
+        self,
+        queries: np.ndarray,
+        rows: Optional[np.ndarray],
+        top_k: int
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Probe lists per query once trained; exact batched scoring before that"""
+        if self.centroids is None:
+            return super()._rank_batch(queries, rows, top_k)
+        return [self._rank(query, rows, top_k) for query in queries]
+    
+    def _write_rows(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """Store rows and assign them to their closest list"""
+        super()._write_rows(rows, vectors)
+        if self.centroids is None:
+            if self.size - self.dead_count >= self.MIN_TRAIN_SIZE:
+                self.train()
+            return
+        
+        for row in rows.tolist():
+            if self.assignments[row] >= 0:
+                self._unlink(row)
+        errors = self._assign(rows)
+        self.drift_error += float(errors.sum())
+        self.drift_count += len(rows)
+        
+        if self._drifted():
+            self.train()
+    
+    def _release_row(self, row: int) -> None:
+        """Remove a deleted row from its posting list"""
+        super()._release_row(row)
+        if self.assignments[row] >= 0:
+            self._unlink(row)
+    
+    def _compact_rows(self, keep: np.ndarray, remap: np.ndarray) -> None:
+        """Renumber posting lists; list order and positions are unchanged"""
+        size = len(keep)
+        self.assignments[:size] = self.assignments[keep]
+        self.positions[:size] = self.positions[keep]
+        self.assignments[size:self.size] = -1
+        mapping = remap.tolist()
+        self.lists = [[mapping[row] for row in members] for members in self.lists]
+        super()._compact_rows(keep, remap)
+    
+    def _resize(self, capacity: int) -> None:
+        """Reallocate storage and per-row index arrays"""
+        super()._resize(capacity)
+        assignments = np.full(capacity, -1, dtype=np.int32)
+        positions = np.zeros(capacity, dtype=np.int64)
+        keep = min(self.size, len(self.assignments))
+        assignments[:keep] = self.assignments[:keep]
+        positions[:keep] = self.positions[:keep]
+        self.assignments = assignments
+        self.positions = positions
+    
+    def _assign(self, rows: np.ndarray) -> np.ndarray:
+        """Link rows to their closest centroid; returns quantization errors"""
+        similarities = self._vectors(rows) @ self.centroids.T
+        list_ids = similarities.argmax(axis=1)
+        for row, list_id in zip(rows.tolist(), list_ids.tolist()):
+            self.positions[row] = len(self.lists[list_id])
+            self.lists[list_id].append(row)
+            self.assignments[row] = list_id
+        return 1 - similarities[np.arange(len(rows)), list_ids]
+    
+    def _unlink(self, row: int) -> None:
+        """Swap-remove a row from its posting list"""
+        members = self.lists[self.assignments[row]]
+        position = self.positions[row]
+        last = members.pop()
+        if last != row:
+            members[position] = last
+            self.positions[last] = position
+        self.assignments[row] = -1
+    
+    def _drifted(self) -> bool:
+        """Whether the quantizer no longer fits the data"""
+        if self.size - self.dead_count >= self.trained_size * self.RETRAIN_GROWTH:
+            return True
+        if self.drift_count < len(self.lists):
+            return False
+        return self.drift_error / self.drift_count > self.trained_error * self.RETRAIN_ERROR
+
+
+# ============== Sharded Vector Store ==============
+
+_ATTACHED_BLOCKS: Dict[str, Tuple[shared_memory.SharedMemory, Tuple[np.ndarray, Optional[np.ndarray], np.ndarray]]] = {}
+
+
+def _shared_block_size(capacity: int, dimension: int, euclidean: bool) -> int:
+    """Bytes for a shard's rows, squared norms (euclidean only) and live flags"""
+    return max(1, capacity * (dimension * 4 + (4 if euclidean else 0) + 1))
+
+
+def _shared_views(
+    buffer: Any,
+    capacity: int,
+    dimension: int,
+    euclidean: bool
+) -> Tuple[np.ndarray, Optional[np.ndarray], np.ndarray]:
+    """Matrix, squared norms and live flags laid out back to back in a shared block"""
+    matrix = np.ndarray((capacity, dimension), dtype=np.float32, buffer=buffer)
+    offset = matrix.nbytes
+    sq_norms = None
+    if euclidean:
+        sq_norms = np.ndarray(capacity, dtype=np.float32, buffer=buffer, offset=offset)
+        offset += sq_norms.nbytes
+    live = np.ndarray(capacity, dtype=bool, buffer=buffer, offset=offset)
+    return matrix, sq_norms, live
+
+
+def _free_block(block: shared_memory.SharedMemory) -> None:
+    """Close and unlink a shared block; live views keep the mapping until they go away"""
+    try:
+        block.close()
+    except BufferError:
+        pass
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _shard_search(
+    name: str,
+    capacity: int,
+    dimension: int,
+    metric: str,
+    size: int,
+    queries: np.ndarray,
+    rows: Optional[np.ndarray],
+    top_k: int
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Worker side of a shard search: top-K rows and scores per query over a shared block"""
+    if name not in _ATTACHED_BLOCKS:
+        # A new name means the shard moved to a fresh block; the old one is retired
+        for block, _ in _ATTACHED_BLOCKS.values():
+            try:
+                block.close()
+            except BufferError:
+                pass
+        _ATTACHED_BLOCKS.clear()
+        block = shared_memory.SharedMemory(name=name)
+        _ATTACHED_BLOCKS[name] = (block, _shared_views(block.buf, capacity, dimension, metric == 'euclidean'))
+    matrix, sq_norms, live = _ATTACHED_BLOCKS[name][1]
+    
+    vector_metric = VectorMetric(metric)
+    selected = slice(0, size) if rows is None else rows
+    scores = vector_metric.rank_scores(
+        queries, matrix[selected], None if sq_norms is None else sq_norms[selected]
+    )
+    # Rows tombstoned since the request was sent drop out here
+    scores[:, ~live[selected]] = -np.inf
+    order = _top_k_rows(scores, top_k)
+    top_scores = np.take_along_axis(scores, order, axis=1)
+    finals = vector_metric.finalize(top_scores, queries)
+    
+    found = order if rows is None else rows[order]
+    return [(top[keep], final[keep]) for top, final, keep in zip(found, finals, np.isfinite(top_scores))]
+
+
+class _SharedMatrixShard(MatrixVectorStore):
+    """Matrix store whose rows live in a shared memory block a worker process searches
+    
+    Rows a search may be reading are never rewritten: replaced chunks are
+    tombstoned and appended, and growth or compaction moves rows into a new
+    block. Old blocks are retired until the owning store is idle.
+    """
+    
+    def __init__(self, config: VectorStoreConfig):
+        self.block: Optional[shared_memory.SharedMemory] = None
+        self.retired: List[shared_memory.SharedMemory] = []
+        super().__init__(config)
+    
+    async def upsert(self, chunks: List[DocumentChunk]) -> None:
+        """Append new versions of existing chunks instead of overwriting their rows"""
+        self._tombstone([chunk.id for chunk in chunks if chunk.embedding and chunk.id in self.rows])
+        await super().upsert(chunks)
+    
+    async def clear(self) -> None:
+        """Clear rows, leaving lists handed to in-flight searches untouched"""
+        self.ids, self.chunks = [], []
+        await super().clear()
+    
+    def release_retired(self) -> None:
+        """Free blocks no search can still be reading"""
+        for block in self.retired:
+            _free_block(block)
+        self.retired = []
+    
+    def _compact_rows(self, keep: np.ndarray, remap: np.ndarray) -> None:
+        """Compact into a fresh block so in-flight searches keep a consistent view"""
+        self._resize(self.capacity)
+        super()._compact_rows(keep, remap)
+    
+    def _allocate(self, dimension: int) -> None:
+        """Create empty storage, retiring the current block"""
+        if self.block is not None:
+            self.retired.append(self.block)
+            self.block = None
+        super()._allocate(dimension)
+    
+    def _resize(self, capacity: int) -> None:
+        """Move rows into a new shared block of the given capacity"""
+        euclidean = self.sq_norms is not None
+        block = shared_memory.SharedMemory(
+            create=True,
+            size=_shared_block_size(capacity, self.dimension, euclidean)
+        )
+        matrix, sq_norms, live = _shared_views(block.buf, capacity, self.dimension, euclidean)
+        matrix[:self.size] = self.matrix[:self.size]
+        if euclidean:
+            sq_norms[:self.size] = self.sq_norms[:self.size]
+        live[:self.size] = self.live[:self.size]
+        live[self.size:] = False
+        
+        if self.block is not None:
+            self.retired.append(self.block)
+        self.block = block
+        self.matrix, self.sq_norms, self.live = matrix, sq_norms, live
+        self.capacity = capacity
+
+
+class ShardedVectorStore(BaseVectorStore):
+    """Chunks hash-partitioned across shards, each searched by its own worker process
+    
+    Shards keep their rows in shared memory, so workers score them in place
+    without copying. The parent keeps the metadata and keyword indexes,
+    scatters every query to all shards and merges their top-K lists.
+    """
+    
+    START_METHOD = 'spawn'  # Forking a process that runs an event loop and BLAS threads is unsafe
+    
+    def __init__(self, config: VectorStoreConfig):
+        super().__init__(config)
+        if config.compression != 'none':
+            raise ValueError('The sharded store does not support compression')
+        count = config.shards or os.cpu_count() or 1
+        self.keyword_index = KeywordIndex()  # chunk_id -> terms, shared by every shard
+        # Shards are searched in worker processes, never on a thread pool of their own
+        self.shards = [_SharedMatrixShard(replace(config, executor_workers=0)) for _ in range(count)]
+        for shard in self.shards:
+            shard.keyword_index = self.keyword_index
+        context = multiprocessing.get_context(self.START_METHOD)
+        self.executors = [
+            concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context)
+            for _ in range(count)
+        ]
+        self.searches = 0  # Searches in flight; retired blocks are freed when it drops to zero
+    
+    async def initialize(self) -> None:
+        """Start the worker processes"""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for executor in self.executors))
+    
+    async def upsert(self, chunks: List[DocumentChunk]) -> None:
+        """Route chunks to their shards"""
+        embedded = [chunk for chunk in chunks if chunk.embedding]
+        if not embedded:
+            return
+        # Fix the dimension on every shard, so no shard accepts a different one later
+        dimension = len(embedded[0].embedding)
+        for shard in self.shards:
+            shard._check_dimension(dimension)
+        
+        for shard, group in zip(self.shards, self._partition(embedded, lambda chunk: chunk.id)):
+            if group:
+                await shard.upsert(group)
+        self._release_retired()
+    
+    async def search(
+        self,
+        embedding: List[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """Scatter one query to every shard and merge the results"""
+        return (await self.search_batch([embedding], top_k, [filter]))[0]
+    
+    async def search_batch(
+        self,
+        embeddings: List[List[float]],
+        top_k: int,
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[List[SearchResult]]:
+        """Scatter each filter group to every shard, then gather-merge the top-K per query"""
+        results: List[List[SearchResult]] = [[] for _ in embeddings]
+        if not self._count() or top_k <= 0 or not embeddings:
+            return results
+        
+        queries = self.metric.prepare(embeddings)
+        self.shards[0]._check_dimension(queries.shape[1])
+        
+        loop = asyncio.get_running_loop()
+        jobs = []  # (query positions, shard chunks at dispatch, pending shard search)
+        for filter, members in _group_filters(filters, len(embeddings)):
+            for shard, executor in zip(self.shards, self.executors):
+                rows = shard.metadata_index.select(filter) if filter else None
+                limit = min(top_k, shard._candidate_count(rows))
+                if limit <= 0:
+                    continue
+                jobs.append((members, shard.chunks, loop.run_in_executor(
+                    executor, _shard_search, shard.block.name, shard.capacity, shard.dimension,
+                    self.metric.name, shard.size, queries[members], rows, limit
+                )))
+        
+        self.searches += 1
+        try:
+            ranked = await asyncio.gather(*(search for _, _, search in jobs))
+        finally:
+            self.searches -= 1
+            self._release_retired()
+        
+        # Merge per query: concatenate every shard's candidates and keep the best
+        candidates: List[List[Tuple[List[DocumentChunk], np.ndarray, np.ndarray]]] = [[] for _ in embeddings]
+        for (members, chunks, _), shard_ranked in zip(jobs, ranked):
+            for index, (rows, scores) in zip(members.tolist(), shard_ranked):
+                candidates[index].append((chunks, rows, scores))
+        
+        for index, parts in enumerate(candidates):
+            if not parts:
+                continue
+            scores = np.concatenate([scores for _, _, scores in parts])
+            owners = np.concatenate([np.full(len(rows), part) for part, (_, rows, _) in enumerate(parts)])
+            rows = np.concatenate([rows for _, rows, _ in parts])
+            results[index] = [
+                SearchResult(chunk=parts[owners[i]][0][rows[i]], score=float(scores[i]))
+                for i in _top_k_indices(scores, top_k).tolist()
+            ]
+        return results
+    
+    async def keyword_search(
+        self,
+        query: str,
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """BM25 search over the store-wide keyword index, screened by each shard's metadata index"""
+        accept = None
+        if filter:
+            allowed = [set(shard.metadata_index.select(filter).tolist()) for shard in self.shards]
+            
+            def accept(id: str) -> bool:
+                number = self._shard_number(id)
+                return self.shards[number].rows[id] in allowed[number]
+        
+        results = []
+        for id, score in self.keyword_index.search(query, top_k, accept):
+            shard = self.shards[self._shard_number(id)]
+            results.append(shard._result(shard.rows[id], score))
+        return results
+    
+    async def delete(self, ids: List[str]) -> None:
+        """Tombstone chunks in their shards"""
+        for shard, group in zip(self.shards, self._partition(ids, lambda id: id)):
+            if group:
+                await shard.delete(group)
+        self._release_retired()
+    
+    async def clear(self) -> None:
+        """Clear every shard"""
+        for shard in self.shards:
+            await shard.clear()
+        self._release_retired()
+    
+    def version(self) -> Optional[Hashable]:
+        """Write counters of every shard"""
+        return tuple(shard.writes for shard in self.shards)
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """Get totals and per-shard counts"""
+        counts = [shard.size - shard.dead_count for shard in self.shards]
+        return {
+            'count': sum(counts),
+            'dimensions': self.shards[0].dimension if sum(counts) else 0,
+            'shards': len(self.shards),
+            'shard_counts': counts,
+            'dead_rows': sum(shard.dead_count for shard in self.shards),
+            'shared_memory_bytes': sum(shard.block.size for shard in self.shards if shard.block)
+        }
+    
+    async def cleanup(self) -> None:
+        """Stop the workers and free every shared block"""
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+        for shard in self.shards:
+            if shard.compaction_task:
+                shard.compaction_task.cancel()
+            if shard.block is not None:
+                shard.retired.append(shard.block)
+                shard.block = None
+            shard.release_retired()
+    
+    def _count(self) -> int:
+        """Live chunks across shards"""
+        return sum(shard.size - shard.dead_count for shard in self.shards)
+    
+    def _shard_number(self, id: str) -> int:
+        """Stable shard for a chunk id (Python's str hash changes between processes)"""
+        digest = hashlib.blake2b(id.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') % len(self.shards)
+    
+    def _partition(self, items: List[Any], key: Any) -> List[List[Any]]:
+        """Items grouped by the shard their id hashes to"""
+        groups: List[List[Any]] = [[] for _ in self.shards]
+        for item in items:
+            groups[self._shard_number(key(item))].append(item)
+        return groups
+    
+    def _release_retired(self) -> None:
+        """Free retired shard blocks once no search can be reading them"""
+        if self.searches == 0:
+            for shard in self.shards:
+                shard.release_retired()
+
+
+# ============== FAISS Vector Store ==============
+
+class FAISSVectorStore(BaseVectorStore):
+    """FAISS-backed local vector store with flat, IVF or HNSW indexes"""
+    
+    INDEX_FILE = 'index.faiss'
+    META_FILE = 'chunks.json'
+    FORMAT_VERSION = 1
+    TRAIN_POINTS_PER_LIST = 39  # FAISS needs this many points per IVF centroid
+    EXACT_FILTER_IDS = 2048  # Allowed ids up to which filtered searches skip the index and score exactly
+    
+    def __init__(self, config: VectorStoreConfig):
+        super().__init__(config)
+        import faiss
+        self.faiss = faiss
+        self.dimension: Optional[int] = config.dimension
+        self.index: Optional[Any] = None
+        self.ids: Dict[str, int] = {}  # chunk_id -> faiss id
+        self.chunks: Dict[int, DocumentChunk] = {}  # faiss id -> chunk
+        self.next_id = 0
+        self.deleted_count = 0  # HNSW nodes removed from the mapping but not the graph
+        self.writes = 0  # Bumped on every change
+        self.live_bits = np.zeros(0, dtype=np.uint8)  # faiss id bitmap of live chunks
+        self.keyword_index = KeywordIndex()  # faiss id -> terms
+        self.metadata_index = MetadataIndex()  # faiss id -> filterable fields
+    
+    async def initialize(self) -> None:
+        """Load the persisted index, or create an empty one"""
+        path = self.config.persist_path
+        if path and os.path.exists(os.path.join(path, self.INDEX_FILE)):
+            self.load(path)
+        elif self.dimension and self.index is None:
+            self.index = self._build_index(self.dimension)
+    
+    async def upsert(self, chunks: List[DocumentChunk]) -> None:
+        """Add chunks under fresh FAISS ids, replacing earlier versions"""
+        latest = {chunk.id: chunk for chunk in chunks if chunk.embedding}
+        if not latest:
+            return
+        
+        vectors = self._prepare([chunk.embedding for chunk in latest.values()])
+        if self.index is None:
+            self.index = self._build_index(self.dimension)
+        await self.delete([id for id in latest if id in self.ids])
+        
+        faiss_ids = np.arange(self.next_id, self.next_id + len(latest), dtype=np.int64)
+        self.next_id += len(latest)
+        for faiss_id, chunk in zip(faiss_ids.tolist(), latest.values()):
+            self.ids[chunk.id] = faiss_id
+            # FAISS owns the vector now; results reconstruct it on demand
+            self.chunks[faiss_id] = replace(chunk, embedding=None)
+            self.keyword_index.add(faiss_id, chunk.content)
+            self.metadata_index.add(faiss_id, _chunk_fields(chunk))
+        
+        self.index.add_with_ids(vectors, faiss_ids)
+        self._mark_live(faiss_ids, True)
+        self.writes += 1
+        self._maybe_train()
+    
+    async def search(
+        self,
+        embedding: List[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """Search the FAISS index, narrowing filters through the metadata index"""
+        return (await self.search_batch([embedding], top_k, [filter]))[0]
+    
+    async def search_batch(
+        self,
+        embeddings: List[List[float]],
+        top_k: int,
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[List[SearchResult]]:
+        """One FAISS search call per distinct filter, scoring small filtered sets exactly"""
+        results: List[List[SearchResult]] = [[] for _ in embeddings]
+        if self.index is None or not self.chunks or top_k <= 0 or not embeddings:
+            return results
+        
+        queries = self._prepare(embeddings)
+        k = min(top_k, self.index.ntotal)
+        for filter, members in _group_filters(filters, len(embeddings)):
+            allowed = self.metadata_index.select(filter) if filter else None
+            if allowed is None:
+                distances, labels = self._search_index(queries[members], k, self._live_selector())
+            elif not len(allowed):
+                continue
+            elif len(allowed) <= self.EXACT_FILTER_IDS:
+                distances, labels = self._search_exact(queries[members], k, allowed)
+            else:
+                distances, labels = self._search_index(queries[members], k, self.faiss.IDSelectorBatch(allowed))
+                # The selector only sees ids in the probed IVF lists or the HNSW beam; queries
+                # it starved are rescored exactly over the allowed ids
+                short = (labels >= 0).sum(axis=1) < min(k, len(allowed))
+                if short.any():
+                    distances[short], labels[short] = self._search_exact(queries[members][short], k, allowed)
+            
+            for index, row_distances, row_labels in zip(members.tolist(), distances.tolist(), labels.tolist()):
+                results[index] = self._results(row_distances, row_labels, top_k)
+        return results
+    
+    async def keyword_search(
+        self,
+        query: str,
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """BM25 search over the keyword index, screened by the metadata index"""
+        accept = None
+        if filter:
+            allowed = set(self.metadata_index.select(filter).tolist())
+            accept = lambda faiss_id: faiss_id in allowed
+        return [
+            SearchResult(chunk=self._chunk(faiss_id), score=score)
+            for faiss_id, score in self.keyword_index.search(query, top_k, accept)
+        ]
+    
+    async def delete(self, ids: List[str]) -> None:
+        """Remove ids from the index (HNSW marks them deleted instead)"""
+        faiss_ids = [self.ids.pop(id) for id in ids if id in self.ids]
+        if not faiss_ids:
+            return
+        for faiss_id in faiss_ids:
+            self.metadata_index.remove(faiss_id, _chunk_fields(self.chunks.pop(faiss_id)))
+            self.keyword_index.remove(faiss_id)
+        self._mark_live(np.asarray(faiss_ids, dtype=np.int64), False)
+        self.writes += 1
+        
+        if self.config.index_type == 'hnsw':
+            # HNSW graphs cannot drop nodes; searches skip tombstones through the live bitmap
+            # and the graph is rebuilt once they pass the threshold
+            self.deleted_count += len(faiss_ids)
+            if self.deleted_count > self.index.ntotal * self.config.compaction_threshold:
+                self.compact()
+        else:
+            self.index.remove_ids(np.asarray(faiss_ids, dtype=np.int64))
+    
+    async def clear(self) -> None:
+        """Clear index and mappings"""
+        self.index = self._build_index(self.dimension) if self.dimension else None
+        self.ids.clear()
+        self.chunks.clear()
+        self.keyword_index.clear()
+        self.metadata_index.clear()
+        self.live_bits = np.zeros(0, dtype=np.uint8)
+        self.deleted_count = 0
+        self.writes += 1
+    
+    def version(self) -> Optional[Hashable]:
+        """Write counter"""
+        return self.writes
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """Get FAISS stats"""
+        return {
+            'count': len(self.chunks),
+            'dimensions': self.dimension if self.chunks else 0,
+            'index_type': self.config.index_type,
+            'trained': bool(self.index is not None and self.index.is_trained),
+            'ntotal': self.index.ntotal if self.index is not None else 0,
+            'tombstones': self.deleted_count
+        }
+    
+    async def cleanup(self) -> None:
+        """Persist the index when a path is configured"""
+        if self.config.persist_path and self.index is not None:
+            self.save(self.config.persist_path)
+    
+    def save(self, path: str) -> None:
+        """Write the index with write_index plus a JSON sidecar for chunks"""
+        os.makedirs(path, exist_ok=True)
+        self.faiss.write_index(self.index, os.path.join(path, self.INDEX_FILE))
+        with open(os.path.join(path, self.META_FILE), 'w') as f:
+            json.dump({
+                'format': self.FORMAT_VERSION,
+                'dimension': self.dimension,
+                'index_type': self.config.index_type,
+                'metric': self.config.metric,
+                'next_id': self.next_id,
+                'deleted_count': self.deleted_count,
+                'chunks': [
+                    {'faiss_id': faiss_id, **_chunk_to_dict(chunk)}
+                    for faiss_id, chunk in self.chunks.items()
+                ]
+            }, f, default=str)
+    
+    def load(self, path: str) -> None:
+        """Read an index and sidecar written by save()"""
+        with open(os.path.join(path, self.META_FILE)) as f:
+            meta = json.load(f)
+        if meta['format'] != self.FORMAT_VERSION:
+            raise ValueError(f"Unsupported FAISS store format: {meta['format']}")
+        if (meta['index_type'], meta['metric']) != (self.config.index_type, self.config.metric):
+            raise ValueError('Saved FAISS index does not match this store configuration')
+        
+        self.index = self.faiss.read_index(os.path.join(path, self.INDEX_FILE))
+        self._configure(self.index)
+        self.dimension = meta['dimension']
+        self.next_id = meta['next_id']
+        self.deleted_count = meta['deleted_count']
+        self.chunks = {}
+        self.ids = {}
+        self.keyword_index.clear()
+        self.metadata_index.clear()
+        for data in meta['chunks']:
+            faiss_id = data.pop('faiss_id')
+            chunk = self.chunks[faiss_id] = DocumentChunk(**data)
+            self.ids[data['id']] = faiss_id
+            self.keyword_index.add(faiss_id, data['content'])
+            self.metadata_index.add(faiss_id, _chunk_fields(chunk))
+        self.live_bits = np.zeros(0, dtype=np.uint8)
+        self._mark_live(np.fromiter(self.chunks, dtype=np.int64, count=len(self.chunks)), True)
+        self.writes += 1
+    
+    def compact(self) -> None:
+        """Rebuild the index from live vectors, dropping tombstones"""
+        faiss_ids = np.fromiter(self.chunks.keys(), dtype=np.int64, count=len(self.chunks))
+        vectors = np.vstack([self.index.reconstruct(int(i)) for i in faiss_ids]) if len(faiss_ids) else None
+        self.index = self._build_index(self.dimension, vectors)
+        if vectors is not None:
+            self.index.add_with_ids(vectors, faiss_ids)
+        self.deleted_count = 0
+    
+    def _build_index(self, dimension: int, train_vectors: Optional[np.ndarray] = None) -> Any:
+        """Create an empty index for the configured type and metric"""
+        faiss = self.faiss
+        metric = self._metric()
+        
+        if self.config.index_type == 'hnsw':
+            index = faiss.IndexIDMap2(faiss.IndexHNSWFlat(dimension, self.config.hnsw_m, metric))
+        elif self.config.index_type == 'ivf' and train_vectors is not None:
+            nlist = self.config.nlist or max(1, int(np.sqrt(len(train_vectors))))
+            index = faiss.IndexIVFFlat(faiss.IndexFlat(dimension, metric), dimension, nlist, metric)
+            index.train(train_vectors)
+            # Hashtable direct map keeps reconstruct() and remove_ids() working together
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        else:
+            # IVF indexes start flat until there is enough data to train them
+            index = faiss.IndexIDMap2(faiss.IndexFlat(dimension, metric))
+        
+        self._configure(index)
+        return index
+    
+    def _configure(self, index: Any) -> None:
+        """Apply search-time parameters to a built or loaded index"""
+        inner = self.faiss.downcast_index(index.index) if hasattr(index, 'id_map') else index
+        if hasattr(inner, 'hnsw'):
+            inner.hnsw.efConstruction = self.config.ef_construction
+            inner.hnsw.efSearch = self.config.ef_search
+        if hasattr(inner, 'nprobe'):
+            inner.nprobe = self.config.nprobe
+    
+    def _maybe_train(self) -> None:
+        """Move an IVF store from its flat stand-in to a trained IVF index"""
+        if self.config.index_type != 'ivf' or not hasattr(self.index, 'id_map'):
+            return
+        nlist = self.config.nlist or max(1, int(np.sqrt(len(self.chunks))))
+        if len(self.chunks) < nlist * self.TRAIN_POINTS_PER_LIST:
+            return
+        
+        flat = self.faiss.downcast_index(self.index.index)
+        vectors = flat.reconstruct_n(0, flat.ntotal)
+        faiss_ids = self.faiss.vector_to_array(self.index.id_map)
+        self.index = self._build_index(self.dimension, vectors)
+        self.index.add_with_ids(vectors, faiss_ids)
+    
+    def _metric(self) -> int:
+        """FAISS metric for the configured similarity"""
+        if self.config.metric == 'euclidean':
+            return self.faiss.METRIC_L2
+        return self.faiss.METRIC_INNER_PRODUCT
+    
+    def _mark_live(self, faiss_ids: np.ndarray, live: bool) -> None:
+        """Set or clear faiss ids in the live bitmap"""
+        size = (self.next_id + 7) // 8
+        if len(self.live_bits) < size:
+            grown = np.zeros(max(size, 2 * len(self.live_bits)), dtype=np.uint8)
+            grown[:len(self.live_bits)] = self.live_bits
+            self.live_bits = grown
+        bits = np.left_shift(1, faiss_ids & 7).astype(np.uint8)
+        if live:
+            np.bitwise_or.at(self.live_bits, faiss_ids >> 3, bits)
+        else:
+            np.bitwise_and.at(self.live_bits, faiss_ids >> 3, ~bits)
+    
+    def _live_selector(self) -> Optional[Any]:
+        """Selector over the live bitmap while the HNSW graph holds tombstones"""
+        if not self.deleted_count:
+            return None
+        return self.faiss.IDSelectorBitmap(len(self.live_bits), self.faiss.swig_ptr(self.live_bits))
+    
+    def _search_index(self, queries: np.ndarray, k: int, selector: Optional[Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """Search the index, restricted to a selector's ids when given"""
+        if selector is None:
+            return self.index.search(queries, k)
+        return self.index.search(queries, k, params=self._search_params(selector))
+    
+    def _search_exact(self, queries: np.ndarray, k: int, faiss_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Distances and labels laid out like a search, from scoring faiss_ids exhaustively"""
+        found = min(k, len(faiss_ids))
+        vectors = self.index.reconstruct_batch(faiss_ids)
+        found_distances, order = self.faiss.knn(queries, vectors, found, metric=self._metric())
+        distances = np.zeros((len(queries), k), dtype=np.float32)
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        distances[:, :found] = found_distances
+        labels[:, :found] = faiss_ids[order]
+        return distances, labels
+    
+    def _search_params(self, selector: Any) -> Any:
+        """Search parameters carrying an id selector"""
+        faiss = self.faiss
+        if self.config.index_type == 'hnsw':
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.config.ef_search)
+        if not hasattr(self.index, 'id_map'):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.config.nprobe)
+        return faiss.SearchParameters(sel=selector)
+    
+    def _results(self, distances: List[float], labels: List[int], top_k: int) -> List[SearchResult]:
+        """Search results for one query's FAISS output"""
+        results = []
+        for distance, faiss_id in zip(distances, labels):
+            if faiss_id not in self.chunks:
+                continue  # Padding (-1)
+            results.append(SearchResult(chunk=self._chunk(faiss_id), score=self._score(distance)))
+            if len(results) == top_k:
+                break
+        
+        return results
+    
+    def _chunk(self, faiss_id: int) -> DocumentChunk:
+        """Stored chunk with its vector reconstructed from the index"""
+        chunk = self.chunks[faiss_id]
+        if chunk.embedding is None:
+            chunk = replace(chunk, embedding=self.index.reconstruct(faiss_id).tolist())
+        return chunk
+    
+    def _prepare(self, embeddings: List[List[float]]) -> np.ndarray:
+        """Contiguous float32 rows, normalized for cosine"""
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.dimension}"
+            )
+        if self.config.metric == 'cosine':
+            self.faiss.normalize_L2(vectors)
+        return vectors
+    
+    def _score(self, distance: float) -> float:
+        """Higher-is-better score from a FAISS distance"""
+        if self.config.metric == 'euclidean':
+            return float(1 / (1 + np.sqrt(max(distance, 0.0))))  # FAISS returns squared L2
+        return float(distance)
 
 
-# ============== Memory Vector Store ==============
+# ============== Memory-Mapped Vector Store ==============
 
-class MemoryVectorStore(BaseVectorStore):
-    """In-memory vector store for testing"""
+class MmapVectorStore(BaseVectorStore):
+    """File-backed vector store: mmap'd segments, append-only chunk sidecar and a WAL
+    
+    One writer process and any number of read-only processes can open the same
+    directory; readers share the segment pages through the OS page cache.
+    Writes are durable once logged; readers see them at the next checkpoint.
+    """
+    
+    FORMAT_VERSION = 2
+    SEGMENT_ROWS = 32768
+    DURABLE_WRITES = True
+    CHECKPOINT_BYTES = 16 << 20  # WAL size that forces a checkpoint
+    CHECKPOINT_SECONDS = 5.0  # Longest a logged write waits for a checkpoint
+    MANIFEST_FILE = 'manifest.json'
+    SEGMENT_FILE = 'segment-{generation:04d}-{number:05d}.{kind}.npy'
+    SIDECAR_FILE = 'chunks-{generation:04d}.jsonl'
+    WAL_FILE = 'wal.log'
     
     def __init__(self, config: VectorStoreConfig):
         super().__init__(config)
-        self.vectors: Dict[str, Tuple[List[float], DocumentChunk]] = {}
+        if not config.persist_path:
+            raise ValueError('MmapVectorStore requires VectorStoreConfig.persist_path')
+        if config.metric != 'cosine':
+            raise ValueError('MmapVectorStore supports only the cosine metric')
+        self.path = config.persist_path
+        self.read_only = config.read_only
+        self.dimension: Optional[int] = config.dimension
+        self.size = 0  # Rows written, including dead ones
+        self.live_count = 0
+        self.sidecar_bytes = 0
+        self.segments: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []  # vectors, (offset, length), live
+        self.rows: Optional[Dict[str, int]] = None  # chunk_id -> row, loaded on first write
+        self.metadata_index: Optional[MetadataIndex] = None  # Loaded on first filtered search
+        self.keyword_index: Optional[KeywordIndex] = None  # row -> terms, loaded with the metadata index
+        self.indexed_size = 0  # Rows covered by the metadata and keyword indexes
+        self.sidecar_fd: Optional[int] = None
+        self.dirty: Set[int] = set()  # Segments written since the last checkpoint
+        self.wal_bytes = 0  # WAL appended since the last checkpoint
+        self.checkpoint_timer: Optional[asyncio.TimerHandle] = None
+        self.manifest_mtime = 0.0
+        self.generation = 0  # Bumped each time compaction rewrites the files
+        self.writes = 0  # Bumped on every change made through this store
+        self.compactions = 0
+        self.compaction_task: Optional[asyncio.Task] = None
     
     async def initialize(self) -> None:
-        """Initialize memory store"""
-        pass  # No initialization needed
+        """Map existing segments (O(1) in corpus size) and replay the WAL"""
+        if not self.read_only:
+            os.makedirs(self.path, exist_ok=True)
+        self._open()
+        if not self.read_only:
+            self._replay_wal()
     
     async def upsert(self, chunks: List[DocumentChunk]) -> None:
-        """Insert chunks into memory"""
-        for chunk in chunks:
-            if chunk.embedding:
-                self.vectors[chunk.id] = (chunk.embedding, chunk)
+        """Log, then append rows; earlier versions of the same ids are marked dead"""
+        latest = {chunk.id: chunk for chunk in chunks if chunk.embedding}
+        if not latest:
+            return
+        records = [{**_chunk_to_dict(chunk), 'embedding': chunk.embedding} for chunk in latest.values()]
+        self._log({'op': 'upsert', 'chunks': records})
+        self._apply_upsert(records)
+        self._checkpoint_soon()
+        self._schedule_compaction()
     
     async def search(
         self,
-        query_embedding: List[float],
+        embedding: List[float],
         top_k: int,
         filter: Optional[Dict[str, Any]] = None
     ) -> List[SearchResult]:
-        """Search in memory"""
-        results = []
+        """Scan live rows segment by segment, reading only the top-K chunks from disk"""
+        return (await self.search_batch([embedding], top_k, [filter]))[0]
+    
+    async def search_batch(
+        self,
+        embeddings: List[List[float]],
+        top_k: int,
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[List[SearchResult]]:
+        """Score all queries against each segment with one matrix-matrix product"""
+        self._refresh()
+        results: List[List[SearchResult]] = [[] for _ in embeddings]
+        if self.live_count == 0 or top_k <= 0 or not embeddings:
+            return results
         
-        for chunk_id, (embedding, chunk) in self.vectors.items():
-            # Apply metadata filter
-            if filter and not self._matches_filter(chunk.metadata, filter):
-                continue
+        queries = self.metric.prepare(embeddings)
+        if queries.shape[1] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {queries.shape[1]} does not match store dimension {self.dimension}"
+            )
+        
+        for filter, members in _group_filters(filters, len(embeddings)):
+            rows = self._filter_rows(filter) if filter else None
+            found_rows, found_scores = [], []
+            for number, (vectors, _, live) in enumerate(self.segments):
+                start = number * self.SEGMENT_ROWS
+                count = min(self.SEGMENT_ROWS, self.size - start)
+                if count <= 0:
+                    break
+                
+                if rows is None:
+                    local = np.flatnonzero(live[:count])
+                else:
+                    in_segment = rows[(rows >= start) & (rows < start + count)] - start
+                    local = in_segment[live[in_segment].astype(bool)]
+                if len(local) == 0:
+                    continue
+                
+                # A fully live segment is scored straight from the mapping without a copy
+                block = vectors[:count] if len(local) == count else vectors[local]
+                scores = queries[members] @ np.asarray(block).T
+                best = _top_k_rows(scores, top_k)
+                found_rows.append(local[best] + start)
+                found_scores.append(np.take_along_axis(scores, best, axis=1))
             
-            score = self._cosine_similarity(query_embedding, embedding)
-            results.append(SearchResult(chunk=chunk, score=score))
+            if not found_rows:
+                continue
+            all_rows = np.concatenate(found_rows, axis=1)
+            all_scores = np.concatenate(found_scores, axis=1)
+            best = _top_k_rows(all_scores, top_k)
+            for index, query_rows, query_scores in zip(
+                members.tolist(),
+                np.take_along_axis(all_rows, best, axis=1),
+                np.take_along_axis(all_scores, best, axis=1)
+            ):
+                results[index] = [
+                    SearchResult(chunk=self._read_chunk(int(row)), score=float(score))
+                    for row, score in zip(query_rows, query_scores)
+                ]
+        return results
+    
+    async def keyword_search(
+        self,
+        query: str,
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None
+    ) -> List[SearchResult]:
+        """BM25 search over live rows"""
+        self._refresh()
+        if self.live_count == 0 or top_k <= 0:
+            return []
         
-        # Sort by score and return top K
-        results.sort(key=lambda x: x.score, reverse=True)
-        return results[:top_k]
+        self._index_new_rows()
+        allowed = set(self._filter_rows(filter).tolist()) if filter else None
+        
+        def accept(row: int) -> bool:
+            (_, _, live), local = self._locate(row)
+            return bool(live[local]) and (allowed is None or row in allowed)
+        
+        return [
+            SearchResult(chunk=self._read_chunk(row), score=score)
+            for row, score in self.keyword_index.search(query, top_k, accept)
+        ]
     
     async def delete(self, ids: List[str]) -> None:
-        """Delete from memory"""
-        for id in ids:
-            self.vectors.pop(id, None)
+        """Log, then mark rows dead in the live bitmap"""
+        self._load_rows()
+        ids = [id for id in ids if id in self.rows]
+        if not ids:
+            return
+        self._log({'op': 'delete', 'ids': ids})
+        self._apply_delete(ids)
+        self._checkpoint_soon()
+        self._schedule_compaction()
     
     async def clear(self) -> None:
-        """Clear memory"""
-        self.vectors.clear()
+        """Remove all segments and files"""
+        self._check_writable()
+        await self._wait_for_compaction()
+        self._cancel_checkpoint()
+        self._close()
+        for name in os.listdir(self.path):
+            if name.startswith(('segment-', 'chunks-')) or name in (self.MANIFEST_FILE, self.WAL_FILE):
+                os.remove(os.path.join(self.path, name))
+        self.size = self.live_count = self.sidecar_bytes = self.indexed_size = self.generation = 0
+        self.wal_bytes = 0
+        self.writes += 1
+        self.rows = {}
+        self.metadata_index = MetadataIndex()
+        self.keyword_index = KeywordIndex()
+        self._open()
     
-    async def get_stats(self) -> Dict[str, Any]:
-        """Get memory stats"""
-        if self.vectors:
-            first_vector = next(iter(self.vectors.values()))
-            dimensions = len(first_vector[0])
-        else:
-            dimensions = 0
+    async def compact(self) -> None:
+        """Rewrite live rows into a new generation of segment and sidecar files
+        
+        The copy runs in a worker thread against rows that are never rewritten;
+        writes that land meanwhile are carried over before the new manifest is
+        published, and the previous generation is removed afterwards.
+        """
+        self._check_writable()
+        self._load_rows()
+        if self.size == self.live_count:
+            return
+        
+        snapshot = self.size
+        keep = self._live_row_numbers(0, snapshot)
+        generation = self.generation + 1
+        segments, sidecar_fd, sidecar_bytes = await asyncio.to_thread(
+            self._write_generation, generation, keep, list(self.segments), self.sidecar_fd
+        )
+        
+        # Carry over deletes and appends made while the copy was running
+        still_live = self._gather_live(keep)
+        tail = [
+            {**_chunk_to_dict(chunk), 'embedding': chunk.embedding}
+            for chunk in map(self._read_chunk, self._live_row_numbers(snapshot, self.size).tolist())
+        ]
+        for number, (_, _, live) in enumerate(segments):
+            block = still_live[number * self.SEGMENT_ROWS:(number + 1) * self.SEGMENT_ROWS]
+            live[:len(block)] = block
         
+        previous = self.generation
+        self._close()
+        self.generation = generation
+        self.segments = segments
+        self.sidecar_fd = sidecar_fd
+        self.sidecar_bytes = sidecar_bytes
+        self.size = len(keep)
+        self.live_count = int(still_live.sum())
+        self.dirty = set(range(len(segments)))
+        self.rows = None
+        self.metadata_index = None
+        self.keyword_index = None
+        if tail:
+            self._apply_upsert(tail)
+        self._checkpoint()
+        self._remove_generation(previous)
+        self.compactions += 1
+    
+    def version(self) -> Optional[Hashable]:
+        """Manifest generation, size and live count as last read, plus local writes"""
+        self._refresh()
+        return (self.generation, self.size, self.live_count, self.manifest_mtime, self.writes)
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """Get file-backed store stats"""
+        self._refresh()
         return {
-            'count': len(self.vectors),
-            'dimensions': dimensions
+            'count': self.live_count,
+            'dimensions': self.dimension if self.live_count else 0,
+            'rows': self.size,
+            'dead_rows': self.size - self.live_count,
+            'segments': len(self.segments),
+            'sidecar_bytes': self.sidecar_bytes,
+            'generation': self.generation,
+            'compactions': self.compactions,
+            'wal_bytes': self.wal_bytes,
+            'read_only': self.read_only
         }
     
-    def _cosine_similarity(self, a: List[float], b: List[float]) -> float:
-        """Calculate cosine similarity"""
-        a_np = np.array(a)
-        b_np = np.array(b)
-        return float(np.dot(a_np, b_np) / (np.linalg.norm(a_np) * np.linalg.norm(b_np)))
+    async def cleanup(self) -> None:
+        """Finish any compaction, checkpoint, then flush and release file handles"""
+        await self._wait_for_compaction()
+        if self.wal_bytes:
+            self._checkpoint()
+        self._cancel_checkpoint()
+        self._close()
     
-    def _matches_filter(self, metadata: Dict[str, Any], filter: Dict[str, Any]) -> bool:
-        """Check if metadata matches filter"""
-        for key, value in filter.items():
-            if metadata.get(key) != value:
-                return False
-        return True
+    def _open(self) -> None:
+        """Read the manifest and map every segment"""
+        manifest_path = os.path.join(self.path, self.MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['format'] != self.FORMAT_VERSION:
+                raise ValueError(f"Unsupported mmap store format: {manifest['format']}")
+            self.dimension = manifest['dimension']
+            self.size = manifest['size']
+            self.live_count = manifest['live_count']
+            self.sidecar_bytes = manifest['sidecar_bytes']
+            self.generation = manifest['generation']
+            self.manifest_mtime = os.stat(manifest_path).st_mtime
+        elif self.read_only:
+            return
+        
+        sidecar_path = self._sidecar_path(self.generation)
+        if self.read_only:
+            self.sidecar_fd = os.open(sidecar_path, os.O_RDONLY)
+        else:
+            self.sidecar_fd = os.open(sidecar_path, os.O_RDWR | os.O_CREAT, 0o644)
+            # Drop bytes from a write that never reached a checkpoint
+            os.ftruncate(self.sidecar_fd, self.sidecar_bytes)
+        
+        self.segments = []
+        for number in range(-(-self.size // self.SEGMENT_ROWS)):
+            self.segments.append(self._map_segment(number, create=False))
+    
+    def _close(self) -> None:
+        """Flush segments and close the sidecar"""
+        if not self.read_only:
+            for segment in self.segments:
+                for array in segment:
+                    array.flush()
+        self.segments = []
+        if self.sidecar_fd is not None:
+            os.close(self.sidecar_fd)
+            self.sidecar_fd = None
+    
+    def _refresh(self) -> None:
+        """Readers pick up rows committed by the writer since the last call"""
+        if not self.read_only:
+            return
+        manifest_path = os.path.join(self.path, self.MANIFEST_FILE)
+        try:
+            mtime = os.stat(manifest_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self.manifest_mtime:
+            generation = self.generation
+            self._close()
+            try:
+                self._open()
+            except FileNotFoundError:
+                self._open()  # Compaction replaced the files between manifest read and open
+            if self.generation != generation or self.size < self.indexed_size:
+                self.metadata_index = None  # Rows were renumbered or cleared
+                self.keyword_index = None
+    
+    def _map_segment(
+        self,
+        number: int,
+        create: bool,
+        generation: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Memory-map (or create) the vector, offset and live files of a segment"""
+        generation = self.generation if generation is None else generation
+        paths = [
+            os.path.join(self.path, self.SEGMENT_FILE.format(generation=generation, number=number, kind=kind))
+            for kind in ('vectors', 'offsets', 'live')
+        ]
+        if create:
+            shapes = [
+                ((self.SEGMENT_ROWS, self.dimension), np.float32),
+                ((self.SEGMENT_ROWS, 2), np.int64),
+                ((self.SEGMENT_ROWS,), np.uint8)
+            ]
+            return tuple(
+                np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+                for path, (shape, dtype) in zip(paths, shapes)
+            )
+        mode = 'r' if self.read_only else 'r+'
+        return tuple(np.load(path, mmap_mode=mode) for path in paths)
+    
+    def _sidecar_path(self, generation: int) -> str:
+        """Sidecar file of a generation"""
+        return os.path.join(self.path, self.SIDECAR_FILE.format(generation=generation))
+    
+    def _locate(self, row: int) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], int]:
+        """Segment and local index of a row"""
+        return self.segments[row // self.SEGMENT_ROWS], row % self.SEGMENT_ROWS
+    
+    def _read_chunk(self, row: int) -> DocumentChunk:
+        """Read one chunk from the sidecar and attach its vector"""
+        (vectors, offsets, _), local = self._locate(row)
+        offset, length = offsets[local]
+        data = json.loads(os.pread(self.sidecar_fd, int(length), int(offset)))
+        return DocumentChunk(**data, embedding=vectors[local].tolist())
+    
+    def _load_rows(self) -> None:
+        """Build the id map (and indexes) from one sequential sidecar read"""
+        if self.rows is not None:
+            return
+        self.rows = {}
+        self.metadata_index = MetadataIndex()
+        self.keyword_index = KeywordIndex()
+        for row, data in self._scan_sidecar(0, self.size):
+            self.rows[data['id']] = row
+            self._index_row(row, data)
+        self.indexed_size = self.size
+    
+    def _filter_rows(self, filter: Dict[str, Any]) -> np.ndarray:
+        """Compile a filter through the metadata index"""
+        self._index_new_rows()
+        return self.metadata_index.select(filter)
+    
+    def _index_new_rows(self) -> None:
+        """Bring the metadata and keyword indexes up to the current size"""
+        if self.metadata_index is None:
+            self.metadata_index = MetadataIndex()
+            self.keyword_index = KeywordIndex()
+            self.indexed_size = 0
+        for row, data in self._scan_sidecar(self.indexed_size, self.size):
+            self._index_row(row, data)
+        self.indexed_size = self.size
+    
+    def _index_row(self, row: int, data: Dict[str, Any]) -> None:
+        """Add a chunk record to the metadata and keyword indexes"""
+        self.metadata_index.add(row, {'document_id': data['document_id'], **data['metadata']})
+        self.keyword_index.add(row, data['content'])
+    
+    def _scan_sidecar(self, start: int, end: int) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Yield (row, chunk dict) for live rows in [start, end)"""
+        if start >= end:
+            return
+        (_, first_offsets, _), first = self._locate(start)
+        base = int(first_offsets[first][0])
+        data = os.pread(self.sidecar_fd, self.sidecar_bytes - base, base)
+        for row in range(start, end):
+            (_, offsets, live), local = self._locate(row)
+            if live[local]:
+                offset, length = offsets[local]
+                yield row, json.loads(data[offset - base:offset - base + length])
+    
+    def _apply_upsert(self, records: List[Dict[str, Any]]) -> None:
+        """Append vectors and sidecar lines for chunk records"""
+        self._check_writable()
+        self._load_rows()
+        vectors = self.metric.prepare([record['embedding'] for record in records])
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.dimension}"
+            )
+        
+        lines = []
+        for record in records:
+            data = {key: value for key, value in record.items() if key != 'embedding'}
+            lines.append(json.dumps(data, default=str).encode() + b'\n')
+        os.pwrite(self.sidecar_fd, b''.join(lines), self.sidecar_bytes)
+        
+        offset = self.sidecar_bytes
+        for record, vector, line in zip(records, vectors, lines):
+            self._apply_delete([record['id']])
+            row = self.size
+            if row // self.SEGMENT_ROWS == len(self.segments):
+                self.segments.append(self._map_segment(len(self.segments), create=True))
+            (segment_vectors, offsets, live), local = self._locate(row)
+            self.dirty.add(row // self.SEGMENT_ROWS)
+            segment_vectors[local] = vector
+            offsets[local] = (offset, len(line))
+            live[local] = 1
+            self.rows[record['id']] = row
+            self._index_row(row, record)
+            offset += len(line)
+            self.size += 1
+            self.live_count += 1
+        
+        self.sidecar_bytes = offset
+        self.indexed_size = self.size
+        self.writes += 1
+    
+    def _apply_delete(self, ids: List[str]) -> None:
+        """Clear live bits for ids"""
+        for id in ids:
+            row = self.rows.pop(id, None)
+            if row is None:
+                continue
+            self.keyword_index.remove(row)
+            (_, _, live), local = self._locate(row)
+            if live[local]:
+                live[local] = 0
+                self.live_count -= 1
+                self.dirty.add(row // self.SEGMENT_ROWS)
+                self.writes += 1
+    
+    def _live_row_numbers(self, start: int, end: int) -> np.ndarray:
+        """Live rows in [start, end)"""
+        found = []
+        for number in range(start // self.SEGMENT_ROWS, -(-end // self.SEGMENT_ROWS)):
+            base = number * self.SEGMENT_ROWS
+            lo, hi = max(start - base, 0), min(end - base, self.SEGMENT_ROWS)
+            found.append(np.flatnonzero(self.segments[number][2][lo:hi]) + base + lo)
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+    
+    def _gather_live(self, rows: np.ndarray) -> np.ndarray:
+        """Current live bits of sorted rows"""
+        bits = np.zeros(len(rows), dtype=np.uint8)
+        numbers = rows // self.SEGMENT_ROWS
+        for number in np.unique(numbers).tolist():
+            mask = numbers == number
+            bits[mask] = self.segments[number][2][rows[mask] - number * self.SEGMENT_ROWS]
+        return bits
+    
+    def _write_generation(
+        self,
+        generation: int,
+        keep: np.ndarray,
+        segments: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+        sidecar_fd: int
+    ) -> Tuple[List[Tuple[np.ndarray, np.ndarray, np.ndarray]], int, int]:
+        """Copy rows into fresh segment and sidecar files (runs off the event loop)"""
+        fd = os.open(self._sidecar_path(generation), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        written_segments: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        written = out = 0
+        numbers = keep // self.SEGMENT_ROWS
+        
+        for number in np.unique(numbers).tolist():
+            vectors, offsets, _ = segments[number]
+            local = keep[numbers == number] - number * self.SEGMENT_ROWS
+            spans = offsets[local]
+            # Rows were appended in order, so a segment's lines form one byte range
+            base = int(spans[0, 0])
+            blob = os.pread(sidecar_fd, int(spans[-1, 0] + spans[-1, 1]) - base, base)
+            os.write(fd, b''.join(blob[start - base:start - base + length] for start, length in spans.tolist()))
+            new_offsets = np.stack([written + np.cumsum(spans[:, 1]) - spans[:, 1], spans[:, 1]], axis=1)
+            written += int(spans[:, 1].sum())
+            block = vectors[local]
+            
+            done = 0
+            while done < len(local):
+                if out // self.SEGMENT_ROWS == len(written_segments):
+                    written_segments.append(self._map_segment(len(written_segments), True, generation))
+                target_vectors, target_offsets, target_live = written_segments[-1]
+                at = out % self.SEGMENT_ROWS
+                count = min(len(local) - done, self.SEGMENT_ROWS - at)
+                target_vectors[at:at + count] = block[done:done + count]
+                target_offsets[at:at + count] = new_offsets[done:done + count]
+                target_live[at:at + count] = 1
+                done += count
+                out += count
+        
+        for segment in written_segments:
+            for array in segment:
+                array.flush()
+        os.fsync(fd)
+        return written_segments, fd, written
+    
+    def _remove_generation(self, generation: int) -> None:
+        """Delete the files of a replaced generation"""
+        prefix = self.SEGMENT_FILE.split('{number')[0].format(generation=generation)
+        for name in os.listdir(self.path):
+            if name.startswith(prefix):
+                os.remove(os.path.join(self.path, name))
+        if os.path.exists(self._sidecar_path(generation)):
+            os.remove(self._sidecar_path(generation))
+    
+    def _schedule_compaction(self) -> None:
+        """Compact in a background task once the dead-row ratio passes the threshold"""
+        dead = self.size - self.live_count
+        if dead == 0 or dead < self.size * self.config.compaction_threshold:
+            return
+        if self.compaction_task and not self.compaction_task.done():
+            return
+        self.compaction_task = asyncio.get_running_loop().create_task(self.compact())
+    
+    async def _wait_for_compaction(self) -> None:
+        """Let a running compaction finish"""
+        if self.compaction_task and not self.compaction_task.done():
+            await self.compaction_task
+        self.compaction_task = None
+    
+    def _log(self, record: Dict[str, Any]) -> None:
+        """Durably append an operation to the WAL before applying it"""
+        self._check_writable()
+        line = json.dumps(record, default=str) + '\n'
+        with open(os.path.join(self.path, self.WAL_FILE), 'a') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.wal_bytes += len(line)
+    
+    def _checkpoint_soon(self) -> None:
+        """Checkpoint now once the WAL is large, otherwise within CHECKPOINT_SECONDS"""
+        if self.wal_bytes >= self.CHECKPOINT_BYTES:
+            self._checkpoint()
+        elif self.checkpoint_timer is None:
+            self.checkpoint_timer = asyncio.get_running_loop().call_later(
+                self.CHECKPOINT_SECONDS, self._checkpoint
+            )
+    
+    def _cancel_checkpoint(self) -> None:
+        """Drop a scheduled checkpoint"""
+        if self.checkpoint_timer:
+            self.checkpoint_timer.cancel()
+            self.checkpoint_timer = None
+    
+    def _checkpoint(self) -> None:
+        """Flush data files, publish the manifest atomically and truncate the WAL"""
+        self._cancel_checkpoint()
+        for number in sorted(self.dirty):
+            for array in self.segments[number]:
+                array.flush()
+        self.dirty.clear()
+        os.fsync(self.sidecar_fd)
+        
+        manifest_path = os.path.join(self.path, self.MANIFEST_FILE)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump({
+                'format': self.FORMAT_VERSION,
+                'dimension': self.dimension,
+                'size': self.size,
+                'live_count': self.live_count,
+                'sidecar_bytes': self.sidecar_bytes,
+                'generation': self.generation
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(manifest_path + '.tmp', manifest_path)
+        open(os.path.join(self.path, self.WAL_FILE), 'w').close()
+        self.wal_bytes = 0
+    
+    def _replay_wal(self) -> None:
+        """Re-apply operations logged after the last checkpoint"""
+        wal_path = os.path.join(self.path, self.WAL_FILE)
+        if not os.path.exists(wal_path) or os.path.getsize(wal_path) == 0:
+            return
+        
+        # Live bits the OS flushed after the checkpoint may already be cleared; replay clears them again
+        self.live_count = len(self._live_row_numbers(0, self.size))
+        replayed = 0
+        with open(wal_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # Torn final write; the operation was never acknowledged
+                if record['op'] == 'upsert':
+                    self._apply_upsert(record['chunks'])
+                else:
+                    self._load_rows()
+                    self._apply_delete(record['ids'])
+                replayed += 1
+        
+        logger.info(f"Replayed {replayed} WAL operations from {wal_path}")
+        self._checkpoint()
+    
+    def _check_writable(self) -> None:
+        """Reject writes through a read-only store"""
+        if self.read_only:
+            raise PermissionError('Vector store was opened read-only')
 
 
 # ============== Pinecone Vector Store ==============
@@ -563,19 +3974,26 @@ class DocumentChunker:
         self.config = config
     
     def chunk(self, document: Document) -> List[DocumentChunk]:
-        """Chunk a document"""
+        """Chunk a document, numbering chunk ids by position"""
         if self.config.strategy == ChunkingStrategy.FIXED:
-            return self._fixed_chunking(document)
+            chunks = self._fixed_chunking(document)
         elif self.config.strategy == ChunkingStrategy.SENTENCE:
-            return self._sentence_chunking(document)
+            chunks = self._sentence_chunking(document)
         elif self.config.strategy == ChunkingStrategy.PARAGRAPH:
-            return self._paragraph_chunking(document)
+            chunks = self._paragraph_chunking(document)
         elif self.config.strategy == ChunkingStrategy.SEMANTIC:
-            return self._semantic_chunking(document)
+            chunks = self._semantic_chunking(document)
         elif self.config.strategy == ChunkingStrategy.RECURSIVE:
-            return self._recursive_chunking(document)
+            chunks = self._recursive_chunking(document)
         else:
-            return self._fixed_chunking(document)
+            chunks = self._fixed_chunking(document)
+        
+        # Split paragraphs and recursive depths restart their own counts, so ids
+        # are assigned once here to stay unique within the document
+        for index, chunk in enumerate(chunks):
+            chunk.id = f"{document.id}-chunk-{index}"
+            chunk.metadata['chunk_index'] = index
+        return chunks
     
     def _fixed_chunking(self, document: Document) -> List[DocumentChunk]:
         """Fixed-size chunking"""
@@ -841,43 +4259,218 @@ class DocumentChunker:
         return sections
 
 
+# ============== Rescore Vectors ==============
+
+class RescoreVectors:
+    """Float32 chunk embeddings keyed by chunk id, the exact source for cascade rescoring
+    
+    Rescoring threads read `state` once. Writers only append rows or
+    overwrite a chunk's own row in place, and swap in a new state whenever
+    rows move, so a reader never sees an id pointing at another chunk's row.
+    """
+    
+    FILE = 'rescore_vectors.npz'
+    MIN_CAPACITY = 16
+    
+    def __init__(self):
+        self.state: Tuple[Dict[str, int], np.ndarray] = ({}, np.zeros((0, 0), dtype=np.float32))
+        self.size = 0  # Rows written, live or dead
+    
+    def put(self, ids: List[str], embeddings: List[List[float]]) -> None:
+        """Store or overwrite the vectors of chunks"""
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        rows, matrix = self.state
+        if matrix.shape[1] != vectors.shape[1]:
+            # Embedding model changed; vectors of the old dimension are useless
+            rows, matrix, self.size = {}, np.zeros((0, vectors.shape[1]), dtype=np.float32), 0
+        
+        needed = self.size + len({id for id in ids if id not in rows})
+        if needed > len(matrix):
+            grown = np.zeros((max(needed, len(matrix) * 2, self.MIN_CAPACITY), vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = matrix[:self.size]
+            rows, matrix = dict(rows), grown
+        
+        for id, vector in zip(ids, vectors):
+            row = rows.get(id)
+            if row is None:
+                row = self.size
+                self.size += 1
+                matrix[row] = vector
+                rows[id] = row  # Published only once the row holds the vector
+            else:
+                matrix[row] = vector
+        self.state = (rows, matrix)
+        
+        # Reclaim dead rows once they make up most of the matrix
+        if self.size > max(self.MIN_CAPACITY, len(rows) * 2):
+            self._compact()
+    
+    def delete(self, ids: List[str]) -> None:
+        """Forget the vectors of chunks"""
+        rows = self.state[0]
+        for id in ids:
+            rows.pop(id, None)
+    
+    def get(self, ids: List[str]) -> Optional[np.ndarray]:
+        """Vectors for every id, or None when any is missing"""
+        rows, matrix = self.state
+        positions = [rows.get(id) for id in ids]
+        if any(position is None for position in positions):
+            return None
+        return matrix[positions]
+    
+    def clear(self) -> None:
+        """Forget all vectors"""
+        self.state = ({}, np.zeros((0, 0), dtype=np.float32))
+        self.size = 0
+    
+    def save(self, path: str) -> None:
+        """Write live vectors next to the document snapshot"""
+        rows, matrix = self.state
+        target = os.path.join(path, self.FILE)
+        with open(target + '.tmp', 'wb') as f:
+            np.savez(f, ids=np.asarray(list(rows), dtype=str), vectors=matrix[list(rows.values())])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(target + '.tmp', target)
+    
+    def load(self, path: str) -> None:
+        """Restore vectors written by save()"""
+        target = os.path.join(path, self.FILE)
+        self.clear()
+        if os.path.exists(target):
+            with np.load(target) as arrays:
+                self.put(arrays['ids'].tolist(), arrays['vectors'])
+    
+    def _compact(self) -> None:
+        """Move live vectors into a fresh matrix"""
+        rows, matrix = self.state
+        ids = list(rows)
+        compacted = np.zeros((max(len(ids) * 2, self.MIN_CAPACITY), matrix.shape[1]), dtype=np.float32)
+        compacted[:len(ids)] = matrix[list(rows.values())]
+        self.state = ({id: row for row, id in enumerate(ids)}, compacted)
+        self.size = len(ids)
+
+
+# ============== Stage Timing ==============
+
+class StageTimer:
+    """Wall-clock timings per pipeline stage, with running totals and metrics sinks"""
+    
+    def __init__(self):
+        self.totals: Dict[str, Tuple[int, float]] = {}  # stage -> (calls, total ms)
+        self.sinks: List[Callable[[str, float], None]] = []
+    
+    def add_sink(self, sink: Callable[[str, float], None]) -> None:
+        """Register a callable that receives (stage, milliseconds) for every timed stage"""
+        self.sinks.append(sink)
+    
+    @contextmanager
+    def stage(self, name: str, timings: Optional[Dict[str, float]] = None) -> Iterator[None]:
+        """Time a block, adding its milliseconds to timings, the totals and every sink"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + elapsed
+            calls, total = self.totals.get(name, (0, 0.0))
+            self.totals[name] = (calls + 1, total + elapsed)
+            for sink in self.sinks:
+                try:
+                    sink(name, elapsed)
+                except Exception as e:
+                    logger.warning(f"Metrics sink failed for stage {name}: {e}")
+    
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Calls, total and mean milliseconds per stage"""
+        return {
+            name: {'calls': calls, 'total_ms': total, 'mean_ms': total / calls}
+            for name, (calls, total) in self.totals.items()
+        }
+
+
 # ============== Retriever ==============
 
 class Retriever:
     """Document retrieval service"""
     
+    RESCORE_DTYPES = {'float32': np.float32, 'float64': np.float64}
+    
     def __init__(
         self,
         config: RetrievalConfig,
         vector_store: BaseVectorStore,
-        reranker: Optional['Reranker'] = None
+        reranker: Optional['Reranker'] = None,
+        chunk_index: Optional[Dict[str, Dict[int, DocumentChunk]]] = None,
+        timer: Optional[StageTimer] = None,
+        rescore_vectors: Optional[RescoreVectors] = None
     ):
         self.config = config
         self.vector_store = vector_store
         self.reranker = reranker
+        self.chunk_index = chunk_index  # doc_id -> chunk_index -> chunk, for neighbor lookups
+        self.rescore_vectors = rescore_vectors  # Full-precision vectors for the cascade's rescoring pass
+        self.timer = timer or StageTimer()
+        self.executor = _create_executor(config.executor_workers)
+        if config.rescore_precision not in self.RESCORE_DTYPES:
+            raise ValueError(f"Unsupported rescore precision: {config.rescore_precision}")
     
     async def retrieve(
         self,
         query: str,
         query_embedding: List[float],
-        filter: Optional[Dict[str, Any]] = None
+        filter: Optional[Dict[str, Any]] = None,
+        timings: Optional[Dict[str, float]] = None
     ) -> List[SearchResult]:
-        """Retrieve relevant documents"""
+        """Retrieve relevant documents, adding per-stage milliseconds to timings"""
         
         if self.config.strategy == RetrievalStrategy.SIMILARITY:
-            results = await self._similarity_search(query_embedding, filter)
+            results = await self._similarity_search(query_embedding, filter, timings)
         elif self.config.strategy == RetrievalStrategy.MMR:
-            results = await self._mmr_search(query_embedding, filter)
+            results = await self._mmr_search(query_embedding, filter, timings)
         elif self.config.strategy == RetrievalStrategy.HYBRID:
-            results = await self._hybrid_search(query, query_embedding, filter)
+            results = await self._hybrid_search(query, query_embedding, filter, timings)
         elif self.config.strategy == RetrievalStrategy.CONTEXTUAL:
-            results = await self._contextual_search(query, query_embedding, filter)
+            results = await self._contextual_search(query, query_embedding, filter, timings)
         else:
-            results = await self._similarity_search(query_embedding, filter)
+            results = await self._similarity_search(query_embedding, filter, timings)
         
+        return await self._finalize(query, results, timings)
+    
+    async def retrieve_many(
+        self,
+        queries: List[str],
+        query_embeddings: List[List[float]],
+        filter: Optional[Dict[str, Any]] = None,
+        timings: Optional[Dict[str, float]] = None
+    ) -> List[List[SearchResult]]:
+        """Retrieve for several queries; similarity search runs as one batched store call"""
+        if self.config.strategy != RetrievalStrategy.SIMILARITY:
+            return list(await asyncio.gather(*(
+                self.retrieve(query, embedding, filter, timings)
+                for query, embedding in zip(queries, query_embeddings)
+            )))
+        
+        batches = await self._vector_search_batch(query_embeddings, self.config.top_k * 2, filter, timings)
+        return list(await asyncio.gather(*(
+            self._finalize(query, results, timings) for query, results in zip(queries, batches)
+        )))
+    
+    async def _finalize(
+        self,
+        query: str,
+        results: List[SearchResult],
+        timings: Optional[Dict[str, float]] = None
+    ) -> List[SearchResult]:
+        """Rerank, threshold and truncate candidates"""
         # Apply reranking
         if self.reranker:
-            results = await self.reranker.rerank(query, results)
+            with self.timer.stage('reranking', timings):
+                results = await self.reranker.rerank(query, results)
         
         # Apply score threshold
         if self.config.score_threshold:
@@ -885,56 +4478,118 @@ class Retriever:
         
         return results[:self.config.top_k]
     
+    def get_stats(self) -> Dict[str, Any]:
+        """Cumulative per-stage timings"""
+        return self.timer.get_stats()
+    
+    async def cleanup(self) -> None:
+        """Stop the selection threads"""
+        if self.executor:
+            self.executor.shutdown(wait=False)
+    
+    async def _vector_search(
+        self,
+        query_embedding: List[float],
+        count: int,
+        filter: Optional[Dict[str, Any]],
+        timings: Optional[Dict[str, float]]
+    ) -> List[SearchResult]:
+        """Store search, as a wider coarse pass plus exact rescoring when the cascade is on"""
+        multiplier = self.config.cascade_multiplier
+        if multiplier <= 1:
+            with self.timer.stage('vector_search', timings):
+                return await self.vector_store.search(query_embedding, count, filter)
+        
+        with self.timer.stage('coarse_search', timings):
+            candidates = await self.vector_store.search(query_embedding, count * multiplier, filter)
+        with self.timer.stage('rescore', timings):
+            return (await _run_in(self.executor, self._rescore, query_embedding, candidates))[:count]
+    
+    async def _vector_search_batch(
+        self,
+        query_embeddings: List[List[float]],
+        count: int,
+        filter: Optional[Dict[str, Any]],
+        timings: Optional[Dict[str, float]]
+    ) -> List[List[SearchResult]]:
+        """Batched _vector_search: one store call for the coarse pass of every query"""
+        filters = [filter] * len(query_embeddings)
+        multiplier = self.config.cascade_multiplier
+        if multiplier <= 1:
+            with self.timer.stage('vector_search', timings):
+                return await self.vector_store.search_batch(query_embeddings, count, filters)
+        
+        with self.timer.stage('coarse_search', timings):
+            batches = await self.vector_store.search_batch(query_embeddings, count * multiplier, filters)
+        with self.timer.stage('rescore', timings):
+            rescored = await asyncio.gather(*(
+                _run_in(self.executor, self._rescore, embedding, candidates)
+                for embedding, candidates in zip(query_embeddings, batches)
+            ))
+        return [results[:count] for results in rescored]
+    
+    def _rescore(self, query_embedding: List[float], candidates: List[SearchResult]) -> List[SearchResult]:
+        """Candidates re-ranked by exact scores from their full-precision vectors"""
+        # All or nothing: exact and coarse scores are not comparable within one ranking
+        vectors = self.rescore_vectors.get([c.chunk.id for c in candidates]) if self.rescore_vectors else None
+        if vectors is None or not candidates:
+            return candidates
+        
+        scores = self.vector_store.metric.pairwise(
+            [query_embedding],
+            vectors,
+            self.RESCORE_DTYPES[self.config.rescore_precision]
+        )[0]
+        rescored = [replace(candidate, score=score) for candidate, score in zip(candidates, scores.tolist())]
+        rescored.sort(key=lambda r: r.score, reverse=True)
+        return rescored
+    
     async def _similarity_search(
         self,
         query_embedding: List[float],
-        filter: Optional[Dict[str, Any]]
+        filter: Optional[Dict[str, Any]],
+        timings: Optional[Dict[str, float]] = None
     ) -> List[SearchResult]:
         """Standard similarity search"""
-        return await self.vector_store.search(query_embedding, self.config.top_k * 2, filter)
+        return await self._vector_search(query_embedding, self.config.top_k * 2, filter, timings)
     
     async def _mmr_search(
         self,
         query_embedding: List[float],
-        filter: Optional[Dict[str, Any]]
+        filter: Optional[Dict[str, Any]],
+        timings: Optional[Dict[str, float]] = None
     ) -> List[SearchResult]:
         """Maximum Marginal Relevance search"""
-        candidates = await self.vector_store.search(
-            query_embedding,
-            self.config.top_k * 3,
-            filter
-        )
+        candidates = await self._vector_search(query_embedding, self.config.top_k * 3, filter, timings)
+        if not candidates:
+            return []
+        
+        with self.timer.stage('mmr', timings):
+            return await _run_in(self.executor, self._mmr_select, candidates)
+    
+    def _mmr_select(self, candidates: List[SearchResult]) -> List[SearchResult]:
+        """Greedy MMR selection of top_k candidates"""
+        # Candidate-to-candidate similarities, computed once; chunks without an
+        # embedding count as dissimilar to everything
+        embedded = [i for i, c in enumerate(candidates) if c.chunk.embedding]
+        similarities = np.zeros((len(candidates), len(candidates)))
+        if embedded:
+            metric = self.vector_store.metric
+            vectors = metric.prepare([candidates[i].chunk.embedding for i in embedded])
+            similarities[np.ix_(embedded, embedded)] = metric.pairwise(vectors, vectors)
         
+        lambda_param = self.config.mmr_lambda
+        relevance = lambda_param * np.asarray([c.score for c in candidates])
+        max_similarity = np.zeros(len(candidates))  # Closest selected result so far
+        available = np.ones(len(candidates), dtype=bool)
         selected = []
-        lambda_param = 0.5  # Balance between relevance and diversity
         
-        while len(selected) < self.config.top_k and candidates:
-            best_score = -float('inf')
-            best_index = -1
-            
-            for i, candidate in enumerate(candidates):
-                relevance = candidate.score
-                max_similarity = 0
-                
-                for selected_result in selected:
-                    if candidate.chunk.embedding and selected_result.chunk.embedding:
-                        similarity = self._calculate_similarity(
-                            candidate.chunk.embedding,
-                            selected_result.chunk.embedding
-                        )
-                        max_similarity = max(max_similarity, similarity)
-                
-                mmr_score = lambda_param * relevance - (1 - lambda_param) * max_similarity
-                
-                if mmr_score > best_score:
-                    best_score = mmr_score
-                    best_index = i
-            
-            if best_index != -1:
-                selected.append(candidates[best_index])
-                candidates.pop(best_index)
-            else:
-                break
+        for _ in range(min(self.config.top_k, len(candidates))):
+            mmr_scores = np.where(available, relevance - (1 - lambda_param) * max_similarity, -np.inf)
+            best = int(np.argmax(mmr_scores))
+            selected.append(candidates[best])
+            available[best] = False
+            np.maximum(max_similarity, similarities[best], out=max_similarity)
         
         return selected
     
@@ -942,57 +4597,87 @@ class Retriever:
         self,
         query: str,
         query_embedding: List[float],
-        filter: Optional[Dict[str, Any]]
+        filter: Optional[Dict[str, Any]],
+        timings: Optional[Dict[str, float]] = None
     ) -> List[SearchResult]:
-        """Hybrid vector + keyword search"""
-        # Vector search
-        vector_results = await self.vector_store.search(
-            query_embedding,
-            self.config.top_k,
-            filter
+        """Hybrid vector + keyword search; the legs overlap only when the store scores on executor threads"""
+        depth = self.config.top_k * 2
+        # With inline stores each leg holds the event loop until it finishes, so gather runs them in turn
+        vector_results, keyword_results = await asyncio.gather(
+            self._vector_search(query_embedding, self.config.vector_depth or depth, filter, timings),
+            self._keyword_search(query, self.config.keyword_depth or depth, filter, timings)
         )
         
-        # Keyword search
-        keyword_results = await self._keyword_search(query, filter)
-        
-        # Merge results
-        alpha = self.config.hybrid_alpha
-        merged = {}
-        
-        for result in vector_results:
-            merged[result.chunk.id] = SearchResult(
-                chunk=result.chunk,
-                score=result.score * alpha
-            )
-        
-        for result in keyword_results:
-            if result.chunk.id in merged:
-                merged[result.chunk.id].score += result.score * (1 - alpha)
+        with self.timer.stage('fusion', timings):
+            # Put both legs on a comparable scale
+            fusion = self.config.hybrid_fusion
+            if fusion == 'rrf':
+                vector_scores = self._reciprocal_ranks(len(vector_results))
+                keyword_scores = self._reciprocal_ranks(len(keyword_results))
+            elif fusion == 'minmax':
+                vector_scores = self._min_max([r.score for r in vector_results])
+                keyword_scores = self._min_max([r.score for r in keyword_results])
+            elif fusion == 'weighted':
+                vector_scores = [self.vector_store.metric.bounded(r.score) for r in vector_results]
+                # BM25 scores are unbounded; scale them to [0, 1] by the best match
+                top_keyword = keyword_results[0].score if keyword_results else 1.0
+                keyword_scores = [r.score / top_keyword for r in keyword_results]
             else:
-                merged[result.chunk.id] = SearchResult(
-                    chunk=result.chunk,
-                    score=result.score * (1 - alpha)
-                )
-        
-        results = list(merged.values())
-        results.sort(key=lambda x: x.score, reverse=True)
+                raise ValueError(f"Unsupported hybrid fusion: {fusion}")
+            
+            # Merge results
+            alpha = self.config.hybrid_alpha
+            merged: Dict[str, SearchResult] = {}
+            for results, scores, weight in (
+                (vector_results, vector_scores, alpha),
+                (keyword_results, keyword_scores, 1 - alpha)
+            ):
+                for result, score in zip(results, scores):
+                    if result.chunk.id in merged:
+                        merged[result.chunk.id].score += score * weight
+                    else:
+                        merged[result.chunk.id] = SearchResult(chunk=result.chunk, score=score * weight)
+            
+            results = list(merged.values())
+            results.sort(key=lambda x: x.score, reverse=True)
         return results[:self.config.top_k]
     
+    def _reciprocal_ranks(self, count: int) -> List[float]:
+        """Reciprocal rank fusion scores for a ranked list"""
+        return [1 / (self.config.rrf_k + rank) for rank in range(1, count + 1)]
+    
+    @staticmethod
+    def _min_max(scores: List[float]) -> List[float]:
+        """Scores rescaled to [0, 1]; a list of equal scores maps to 1"""
+        if not scores:
+            return []
+        low, high = min(scores), max(scores)
+        if high == low:
+            return [1.0] * len(scores)
+        return [(score - low) / (high - low) for score in scores]
+    
     async def _contextual_search(
         self,
         query: str,
         query_embedding: List[float],
-        filter: Optional[Dict[str, Any]]
+        filter: Optional[Dict[str, Any]],
+        timings: Optional[Dict[str, float]] = None
     ) -> List[SearchResult]:
         """Contextual search with neighboring chunks"""
-        results = await self._similarity_search(query_embedding, filter)
-        expanded_results = []
+        results = await self._similarity_search(query_embedding, filter, timings)
         
-        for result in results:
+        # Add neighboring chunks for all hits at once
+        with self.timer.stage('neighbor_expansion', timings):
+            if self.chunk_index is not None:
+                neighbor_lists = [self._lookup_neighbors(result) for result in results]
+            else:
+                neighbor_lists = await asyncio.gather(*(
+                    self._get_neighboring_chunks(result.chunk) for result in results
+                ))
+        
+        expanded_results = []
+        for result, neighbors in zip(results, neighbor_lists):
             expanded_results.append(result)
-            
-            # Add neighboring chunks
-            neighbors = await self._get_neighboring_chunks(result.chunk)
             expanded_results.extend(neighbors)
         
         # Deduplicate and sort
@@ -1008,45 +4693,39 @@ class Retriever:
     async def _keyword_search(
         self,
         query: str,
-        filter: Optional[Dict[str, Any]]
+        top_k: int,
+        filter: Optional[Dict[str, Any]],
+        timings: Optional[Dict[str, float]] = None
     ) -> List[SearchResult]:
-        """Simple keyword search"""
-        keywords = query.lower().split()
-        all_results = await self.vector_store.search(
-            [0] * 1536,  # Dummy embedding
-            1000,
-            filter
-        )
-        
-        scored_results = []
-        for result in all_results:
-            content = result.chunk.content.lower()
-            score = sum(1 for keyword in keywords if keyword in content) / len(keywords)
-            if score > 0:
-                scored_results.append(SearchResult(
-                    chunk=result.chunk,
-                    score=score
-                ))
+        """BM25 keyword search over the store's inverted index"""
+        with self.timer.stage('keyword_search', timings):
+            return await self.vector_store.keyword_search(query, top_k, filter)
+    
+    def _lookup_neighbors(self, result: SearchResult) -> List[SearchResult]:
+        """Neighbors of a hit from the chunk index; they inherit the hit's score"""
+        position = result.chunk.metadata.get('chunk_index')
+        chunks = self.chunk_index.get(result.chunk.document_id)
+        if position is None or not chunks:
+            return []
         
-        scored_results.sort(key=lambda x: x.score, reverse=True)
-        return scored_results
+        window = self.config.context_window
+        return [
+            SearchResult(chunk=chunks[index], score=result.score)
+            for index in range(position - window, position + window + 1)
+            if index != position and index in chunks
+        ]
     
     async def _get_neighboring_chunks(self, chunk: DocumentChunk) -> List[SearchResult]:
-        """Get neighboring chunks from same document"""
+        """Get neighboring chunks from same document through a filtered store search"""
+        window = self.config.context_window
         filter = {
             'document_id': chunk.document_id,
             'chunk_index': {
-                '$gte': chunk.metadata.get('chunk_index', 0) - 1,
-                '$lte': chunk.metadata.get('chunk_index', 0) + 1
+                '$gte': chunk.metadata.get('chunk_index', 0) - window,
+                '$lte': chunk.metadata.get('chunk_index', 0) + window
             }
         }
-        return await self.vector_store.search(chunk.embedding or [], 3, filter)
-    
-    def _calculate_similarity(self, a: List[float], b: List[float]) -> float:
-        """Calculate similarity between embeddings"""
-        a_np = np.array(a)
-        b_np = np.array(b)
-        return float(np.dot(a_np, b_np))
+        return await self.vector_store.search(chunk.embedding or [], 2 * window + 1, filter)
 
 
 # ============== Reranker ==============
@@ -1133,19 +4812,68 @@ class Reranker:
 class RAGManager:
     """Main RAG Manager class"""
     
+    DOCUMENTS_FILE = 'documents.json'
+    DOCUMENTS_LOG = 'documents.log'  # Document changes since the last snapshot
+    LOG_CHECKPOINT = 1000  # Logged changes (at least one per document) before the snapshot is rewritten
+    
     def __init__(self, config: RAGConfig):
         self.config = config
         self.vector_store = self._create_vector_store(config.vector_store)
-        self.embedding_provider = self._create_embedding_provider(config.embeddings)
+        provider = self._create_embedding_provider(config.embeddings)
+        self.embedding_provider = provider
+        # Local TF-IDF weights are fitted on the first corpus indexed, then kept with the store
+        self.idf_provider = provider if isinstance(provider, HashingEmbeddings) else None
+        self.embedding_cache = ChunkEmbeddingCache(
+            config.embeddings.cache_path,
+            config.embeddings.model,
+            config.embeddings.dimensions,
+            config.embeddings.cache_size
+        ) if config.embeddings.cache_path else None  # Read and filled only when indexing chunks
+        # Local providers answer without a round trip, so there is no request to share
+        self.embedding_coalescer = CoalescingEmbeddingProvider(
+            self.embedding_provider,
+            config.embeddings.coalesce_window,
+            config.embeddings.batch_size
+        ) if config.embeddings.coalesce_window > 0 and not isinstance(provider, HashingEmbeddings) else None
+        if self.embedding_coalescer:
+            # Concurrent searches share query embedding requests
+            self.embedding_provider = self.embedding_coalescer
+        self.cached_embeddings = CachedEmbeddingProvider(
+            self.embedding_provider,
+            self.embedding_cache
+        ) if self.embedding_cache else None
+        self.query_cache = QueryEmbeddingCache(
+            config.embeddings.model,
+            config.embeddings.dimensions,
+            config.embeddings.query_cache_size,
+            config.embeddings.query_cache_ttl,
+            config.embeddings.query_cache_path
+        ) if config.embeddings.query_cache_size > 0 else None
+        self.result_cache = SearchResultCache(
+            config.retrieval.result_cache_size
+        ) if config.retrieval.result_cache_size > 0 else None
+        self.index_version = 0  # Bumped after every document change; with the store's version, tags cached results
         self.chunker = DocumentChunker(config.chunking)
         self.reranker = Reranker(config.reranking) if config.reranking else None
-        self.retriever = Retriever(config.retrieval, self.vector_store, self.reranker)
         self.documents: Dict[str, Document] = {}
         self.document_index: Dict[str, List[str]] = {}  # doc_id -> chunk_ids
+        self.chunk_index: Dict[str, Dict[int, DocumentChunk]] = {}  # doc_id -> chunk_index -> chunk
+        self.logged = 0  # Records in the document log
+        self.timer = StageTimer()  # Shared with the retriever so every stage lands in one place
+        self.rescore_vectors = RescoreVectors() if config.retrieval.cascade_multiplier > 1 else None
+        self.retriever = Retriever(
+            config.retrieval, self.vector_store, self.reranker, self.chunk_index, self.timer,
+            self.rescore_vectors
+        )
     
     async def initialize(self) -> None:
         """Initialize RAG system"""
         await self.vector_store.initialize()
+        if self.idf_provider and self.config.vector_store.persist_path:
+            self.idf_provider.load(self.config.vector_store.persist_path)
+        self._load_documents()
+        if self.query_cache:
+            self.query_cache.load()
     
     async def add_document(
         self,
@@ -1166,7 +4894,7 @@ class RAGManager:
         
         # Generate embeddings
         texts = [c.content for c in chunks]
-        embeddings = await self.embedding_provider.embed_batch(texts)
+        embeddings = await self._embed_chunks(texts)
         
         # Add embeddings to chunks
         for i, chunk in enumerate(chunks):
@@ -1174,11 +4902,17 @@ class RAGManager:
         
         # Store in vector store
         await self.vector_store.upsert(chunks)
+        if self.rescore_vectors:
+            self.rescore_vectors.put([c.id for c in chunks], embeddings)
+        self._release_embeddings(chunks)
         
         # Store document and index
         document.chunks = chunks
         self.documents[document.id] = document
         self.document_index[document.id] = [c.id for c in chunks]
+        self._index_chunks(document.id, chunks)
+        self._log_document({'op': 'put', 'document': self._document_record(document)})
+        self.index_version += 1
         
         return document
     
@@ -1187,6 +4921,9 @@ class RAGManager:
         documents: List[Dict[str, Any]]
     ) -> List[Document]:
         """Add multiple documents"""
+        if self.idf_provider and self.idf_provider.idf is None and not self.documents and documents:
+            self._fit_idf([doc['content'] for doc in documents])
+        
         results = []
         batch_size = 10
         
@@ -1205,23 +4942,39 @@ class RAGManager:
         
         return results
     
+    def add_metrics_sink(self, sink: Callable[[str, float], None]) -> None:
+        """Register a callable that receives (stage, milliseconds) for every timed stage"""
+        self.timer.add_sink(sink)
+    
     async def search(
         self,
         query: str,
         filter: Optional[Dict[str, Any]] = None,
         top_k: Optional[int] = None,
-        include_metadata: bool = True
+        include_metadata: bool = True,
+        timings: Optional[Dict[str, float]] = None
     ) -> List[SearchResult]:
-        """Search knowledge base"""
+        """Search knowledge base, adding per-stage milliseconds to timings"""
+        top_k = top_k or self.config.retrieval.top_k
+        version = self._results_version()
+        key = self._result_key(query, filter, top_k, include_metadata) if version is not None else None
+        if key:
+            cached = self.result_cache.get(key, version)
+            if cached is not None:
+                return cached
+        
         # Generate query embedding
-        query_embedding = await self.embedding_provider.embed(query)
+        with self.timer.stage('embedding', timings):
+            query_embedding = await self._embed_query(query)
         
         # Retrieve relevant chunks
-        results = await self.retriever.retrieve(
-            query,
-            query_embedding,
-            filter
-        )
+        with self.timer.stage('retrieval', timings):
+            results = await self.retriever.retrieve(
+                query,
+                query_embedding,
+                filter,
+                timings
+            )
         
         # Add document information
         if include_metadata:
@@ -1230,7 +4983,50 @@ class RAGManager:
                 if document:
                     result.document = document
         
-        return results[:top_k or self.config.retrieval.top_k]
+        results = results[:top_k]
+        if key:
+            self.result_cache.put(key, version, results)
+        return results
+    
+    async def search_many(
+        self,
+        queries: List[str],
+        filter: Optional[Dict[str, Any]] = None,
+        top_k: Optional[int] = None,
+        include_metadata: bool = True,
+        timings: Optional[Dict[str, float]] = None
+    ) -> List[List[SearchResult]]:
+        """Search several queries with one embedding call and one batched store search"""
+        if not queries:
+            return []
+        top_k = top_k or self.config.retrieval.top_k
+        version = self._results_version()
+        keys = [
+            self._result_key(query, filter, top_k, include_metadata) if version is not None else None
+            for query in queries
+        ]
+        batches = [self.result_cache.get(key, version) if key else None for key in keys]
+        
+        missing = [i for i, results in enumerate(batches) if results is None]
+        if not missing:
+            return batches
+        missing_queries = [queries[i] for i in missing]
+        with self.timer.stage('embedding', timings):
+            query_embeddings = await self._embed_queries(missing_queries)
+        with self.timer.stage('retrieval', timings):
+            fresh = await self.retriever.retrieve_many(missing_queries, query_embeddings, filter, timings)
+        
+        for i, results in zip(missing, fresh):
+            if include_metadata:
+                for result in results:
+                    document = self.documents.get(result.chunk.document_id)
+                    if document:
+                        result.document = document
+            batches[i] = results[:top_k]
+            if keys[i]:
+                self.result_cache.put(keys[i], version, batches[i])
+        
+        return batches
     
     async def generate_with_rag(
         self,
@@ -1244,11 +5040,15 @@ class RAGManager:
         model_config: Optional[Any] = None
     ) -> RAGResponse:
         """Generate response with RAG context"""
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        
         # Search for relevant context
-        search_results = await self.search(query, filter=filter, include_metadata=True)
+        search_results = await self.search(query, filter=filter, include_metadata=True, timings=timings)
         
         # Build context
-        context = self._build_context(search_results, max_context_tokens)
+        with self.timer.stage('context_building', timings):
+            context = self._build_context(search_results, max_context_tokens)
         
         # Create prompt
         if not system_prompt:
@@ -1264,11 +5064,12 @@ class RAGManager:
         ]
         
         # Generate response
-        response = await ai_manager.complete(
-            messages,
-            provider=provider,
-            model_config=model_config
-        )
+        with self.timer.stage('generation', timings):
+            response = await ai_manager.complete(
+                messages,
+                provider=provider,
+                model_config=model_config
+            )
         
         # Extract citations if requested
         citations = []
@@ -1286,9 +5087,11 @@ class RAGManager:
             },
             citations=citations,
             metadata={
-                'query_embedding_time': 0,
-                'search_time': 0,
-                'generation_time': response.latency
+                'query_embedding_time': timings.get('embedding', 0.0),
+                'search_time': timings.get('retrieval', 0.0),
+                'generation_time': timings['generation'],
+                'total_time': (time.perf_counter() - start) * 1000,
+                'timings': timings  # Milliseconds per stage; search stages are absent on a result cache hit
             }
         )
     
@@ -1299,10 +5102,7 @@ class RAGManager:
         metadata: Optional[Dict[str, Any]] = None
     ) -> Document:
         """Update existing document"""
-        # Delete old chunks
         old_chunk_ids = self.document_index.get(document_id, [])
-        if old_chunk_ids:
-            await self.vector_store.delete(old_chunk_ids)
         
         # Create updated document
         document = Document(
@@ -1316,18 +5116,30 @@ class RAGManager:
         # Re-chunk and embed
         chunks = self.chunker.chunk(document)
         texts = [c.content for c in chunks]
-        embeddings = await self.embedding_provider.embed_batch(texts)
+        embeddings = await self._embed_chunks(texts)
         
         for i, chunk in enumerate(chunks):
             chunk.embedding = embeddings[i]
         
-        # Update vector store
+        # Every strategy numbers chunk ids by position, so upserting overwrites
+        # the old chunks in place; only ids past the new chunk count need deleting
         await self.vector_store.upsert(chunks)
+        new_chunk_ids = {c.id for c in chunks}
+        stale_ids = [id for id in old_chunk_ids if id not in new_chunk_ids]
+        if stale_ids:
+            await self.vector_store.delete(stale_ids)
+        if self.rescore_vectors:
+            self.rescore_vectors.delete(stale_ids)
+            self.rescore_vectors.put([c.id for c in chunks], embeddings)
         
         # Update indexes
+        self._release_embeddings(chunks)
         document.chunks = chunks
         self.documents[document.id] = document
         self.document_index[document.id] = [c.id for c in chunks]
+        self._index_chunks(document.id, chunks)
+        self._log_document({'op': 'put', 'document': self._document_record(document)})
+        self.index_version += 1
         
         return document
     
@@ -1336,20 +5148,30 @@ class RAGManager:
         chunk_ids = self.document_index.get(document_id, [])
         if chunk_ids:
             await self.vector_store.delete(chunk_ids)
+            if self.rescore_vectors:
+                self.rescore_vectors.delete(chunk_ids)
             del self.document_index[document_id]
             del self.documents[document_id]
+            self.chunk_index.pop(document_id, None)
+            self._log_document({'op': 'delete', 'id': document_id})
+            self.index_version += 1
     
     async def clear(self) -> None:
         """Clear all data"""
         await self.vector_store.clear()
+        if self.rescore_vectors:
+            self.rescore_vectors.clear()
         self.documents.clear()
         self.document_index.clear()
+        self.chunk_index.clear()
+        self._log_document({'op': 'clear'})
+        self.index_version += 1
     
     async def get_stats(self) -> Dict[str, Any]:
         """Get RAG statistics"""
         vector_stats = await self.vector_store.get_stats()
         
-        return {
+        stats = {
             'documents': len(self.documents),
             'chunks': vector_stats['count'],
             'dimensions': vector_stats['dimensions'],
@@ -1358,6 +5180,17 @@ class RAGManager:
             ),
             'total_tokens': self._estimate_total_tokens()
         }
+        if self.query_cache:
+            stats['query_cache'] = self.query_cache.get_stats()
+        if self.result_cache:
+            stats['result_cache'] = self.result_cache.get_stats()
+        if self.embedding_cache:
+            stats['embedding_cache'] = self.embedding_cache.get_stats()
+        if self.embedding_coalescer:
+            stats['embedding_coalescing'] = self.embedding_coalescer.get_stats()
+        if self.timer.totals:
+            stats['stages'] = self.timer.get_stats()
+        return stats
     
     def get_document(self, document_id: str) -> Optional[Document]:
         """Get document by ID"""
@@ -1372,7 +5205,20 @@ class RAGManager:
         """Create vector store instance"""
         if config.provider == VectorStoreProvider.PINECONE:
             return PineconeVectorStore(config)
+        elif config.provider == VectorStoreProvider.FAISS:
+            return FAISSVectorStore(config)
+        elif config.provider == VectorStoreProvider.MMAP:
+            return MmapVectorStore(config)
+        elif config.provider == VectorStoreProvider.SHARDED:
+            return ShardedVectorStore(config)
         elif config.provider == VectorStoreProvider.MEMORY:
+            if config.index_type == 'ivf':
+                return IVFVectorStore(config)
+            if config.index_type == 'hnsw':
+                # Graph search needs native code to pay off; FAISS provides it
+                return FAISSVectorStore(config)
+            if config.storage_layout == 'matrix' or config.compression != 'none':
+                return MatrixVectorStore(config)
             return MemoryVectorStore(config)
         else:
             return MemoryVectorStore(config)
@@ -1381,9 +5227,60 @@ class RAGManager:
         """Create embedding provider instance"""
         if config.provider == EmbeddingProvider.OPENAI:
             return OpenAIEmbeddings(config)
+        elif config.provider == EmbeddingProvider.CUSTOM:
+            return HashingEmbeddings(config)
         else:
             raise ValueError(f"Unsupported embedding provider: {config.provider}")
     
+    def _results_version(self) -> Optional[Hashable]:
+        """Version cached results are tagged with, or None when the store cannot report changes"""
+        # Writes can bypass the manager (direct store calls, another process sharing an mmap
+        # directory), so the store's own version is part of the tag
+        store_version = self.vector_store.version()
+        return None if store_version is None else (self.index_version, store_version)
+    
+    def _result_key(
+        self,
+        query: str,
+        filter: Optional[Dict[str, Any]],
+        top_k: int,
+        include_metadata: bool
+    ) -> Optional[str]:
+        """Result cache key for a search, or None when the cache is off"""
+        if not self.result_cache:
+            return None
+        strategy = self.config.retrieval.strategy.value
+        return self.result_cache.key(query, filter, top_k, strategy, include_metadata)
+    
+    async def _embed_chunks(self, texts: List[str]) -> List[List[float]]:
+        """Chunk embeddings for indexing; unchanged chunks are served from the file cache"""
+        if not self.cached_embeddings:
+            return await self.embedding_provider.embed_batch(texts)
+        return await self.cached_embeddings.embed_batch(texts)
+    
+    async def _embed_query(self, query: str) -> List[float]:
+        """Query embedding, served from the query cache when possible"""
+        if not self.query_cache:
+            return await self.embedding_provider.embed(query)
+        embedding = self.query_cache.get(query)
+        if embedding is None:
+            embedding = await self.embedding_provider.embed(query)
+            self.query_cache.put(query, embedding)
+        return embedding
+    
+    async def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Query embeddings with one batch call for the cache misses"""
+        if not self.query_cache:
+            return await self.embedding_provider.embed_batch(queries)
+        embeddings = [self.query_cache.get(query) for query in queries]
+        missing = list(dict.fromkeys(q for q, e in zip(queries, embeddings) if e is None))
+        if missing:
+            fetched = dict(zip(missing, await self.embedding_provider.embed_batch(missing)))
+            for query, embedding in fetched.items():
+                self.query_cache.put(query, embedding)
+            embeddings = [fetched[q] if e is None else e for q, e in zip(queries, embeddings)]
+        return embeddings
+    
     def _build_context(self, results: List[SearchResult], max_tokens: Optional[int]) -> str:
         """Build context from search results"""
         max_context_tokens = max_tokens or self.config.retrieval.max_tokens or 2000
@@ -1442,6 +5339,174 @@ class RAGManager:
         """Estimate token count"""
         return len(text) // 4
     
+    def _load_documents(self) -> None:
+        """Restore documents saved next to a persisted vector store, then replay the document log"""
+        path = self.config.vector_store.persist_path
+        if not path:
+            return
+        
+        if self.rescore_vectors:
+            self.rescore_vectors.load(path)
+        if os.path.exists(os.path.join(path, self.DOCUMENTS_FILE)):
+            with open(os.path.join(path, self.DOCUMENTS_FILE)) as f:
+                for record in json.load(f)['documents']:
+                    self._restore_document(record)
+        
+        log_path = os.path.join(path, self.DOCUMENTS_LOG)
+        if not os.path.exists(log_path) or os.path.getsize(log_path) == 0:
+            return
+        with open(log_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # Torn final write; the change was never acknowledged
+                if record['op'] == 'put':
+                    self._restore_document(record['document'])
+                elif record['op'] == 'delete':
+                    self.documents.pop(record['id'], None)
+                    self.document_index.pop(record['id'], None)
+                    self.chunk_index.pop(record['id'], None)
+                else:
+                    self.documents.clear()
+                    self.document_index.clear()
+                    self.chunk_index.clear()
+        # Fold the replayed changes into the snapshot, which also drops a torn tail
+        self._save_documents()
+    
+    def _restore_document(self, record: Dict[str, Any]) -> None:
+        """Rebuild a document and its indexes from a saved record"""
+        record = dict(record)
+        chunk_ids = record.pop('chunk_ids')
+        chunks = record.pop('chunks', None)
+        record['created_at'] = datetime.fromisoformat(record['created_at'])
+        record['updated_at'] = datetime.fromisoformat(record['updated_at'])
+        document = Document(**record)
+        self.documents[document.id] = document
+        self.document_index[document.id] = chunk_ids
+        if chunks is None:
+            # Records saved without their chunks; chunking is deterministic, so re-chunk
+            self._index_chunks(document.id, self.chunker.chunk(document))
+        else:
+            self._index_chunks(document.id, [
+                self._restore_chunk(document, data, chunk_ids[position] if position < len(chunk_ids) else None)
+                for position, data in enumerate(chunks)
+            ])
+    
+    def _document_record(self, document: Document) -> Dict[str, Any]:
+        """Serializable document fields with its chunk ids and the neighbor index chunks"""
+        record = asdict(replace(document, chunks=None))
+        record['chunk_ids'] = chunk_ids = self.document_index.get(document.id, [])
+        record['chunks'] = [
+            self._chunk_record(document, chunk, chunk_ids[position] if position < len(chunk_ids) else None)
+            for position, chunk in enumerate(self.chunk_index.get(document.id, {}).values())
+        ]
+        return record
+    
+    def _chunk_record(self, document: Document, chunk: DocumentChunk, id: Optional[str]) -> Dict[str, Any]:
+        """Chunk fields its document record does not already imply, so loading skips the chunker"""
+        data = {
+            key: value for key, value in _chunk_to_dict(chunk).items()
+            if value is not None and key != 'document_id'
+        }
+        if chunk.id == id:
+            del data['id']
+        if document.content[chunk.start_index:chunk.end_index] == chunk.content:
+            del data['content']
+        else:
+            # Some chunkers record offsets into intermediate splits; point at the text instead
+            found = document.content.find(chunk.content)
+            if found >= 0:
+                data['span'] = [found, found + len(chunk.content)]
+                del data['content']
+        # Chunkers copy the document metadata into every chunk; keep only what they add
+        data['metadata'] = {
+            key: value for key, value in chunk.metadata.items()
+            if key not in document.metadata or document.metadata[key] != value
+        }
+        return data
+    
+    def _restore_chunk(self, document: Document, data: Dict[str, Any], id: Optional[str]) -> DocumentChunk:
+        """Chunk rebuilt from a record written by _chunk_record()"""
+        start, end = data['start_index'], data['end_index']
+        if 'content' in data:
+            content = data['content']
+        elif 'span' in data:
+            content = document.content[data['span'][0]:data['span'][1]]
+        else:
+            content = document.content[start:end]
+        return DocumentChunk(
+            id=data.get('id', id),
+            document_id=document.id,
+            content=content,
+            metadata={**document.metadata, **data['metadata']},
+            start_index=start,
+            end_index=end,
+            page_number=data.get('page_number'),
+            section=data.get('section')
+        )
+    
+    def _log_document(self, record: Dict[str, Any]) -> None:
+        """Durably append a document change next to the vector store write it follows"""
+        path = self.config.vector_store.persist_path
+        if not path or self.config.vector_store.read_only:
+            return
+        if not self.vector_store.DURABLE_WRITES:
+            # The index reaches disk only at cleanup; logging documents sooner would let them
+            # disagree after a crash, so both are written together then
+            return
+        
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, self.DOCUMENTS_LOG), 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.logged += 1
+        if self.logged >= max(self.LOG_CHECKPOINT, len(self.documents)):
+            self._save_documents()
+    
+    def _save_documents(self) -> None:
+        """Snapshot documents and their chunk ids next to a persisted vector store, truncating the log"""
+        path = self.config.vector_store.persist_path
+        if not path or self.config.vector_store.read_only:
+            return
+        
+        records = [self._document_record(document) for document in self.documents.values()]
+        os.makedirs(path, exist_ok=True)
+        target = os.path.join(path, self.DOCUMENTS_FILE)
+        with open(target + '.tmp', 'w') as f:
+            json.dump({'documents': records}, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(target + '.tmp', target)
+        if self.rescore_vectors:
+            self.rescore_vectors.save(path)
+        open(os.path.join(path, self.DOCUMENTS_LOG), 'w').close()
+        self.logged = 0
+    
+    def _fit_idf(self, corpus: List[str]) -> None:
+        """Fit local embedding IDF weights on the first corpus, before anything is embedded with them"""
+        self.idf_provider.fit(corpus)
+        if self.query_cache:
+            self.query_cache.clear()  # Query vectors computed without the weights no longer match
+        path = self.config.vector_store.persist_path
+        if path and not self.config.vector_store.read_only:
+            os.makedirs(path, exist_ok=True)
+            self.idf_provider.save(path)
+    
+    def _release_embeddings(self, chunks: List[DocumentChunk]) -> None:
+        """Drop float lists from kept chunks once a compressed store holds their vectors"""
+        if self.config.vector_store.compression != 'none':
+            for chunk in chunks:
+                chunk.embedding = None
+    
+    def _index_chunks(self, document_id: str, chunks: List[DocumentChunk]) -> None:
+        """Replace a document's entries in the neighbor index"""
+        self.chunk_index[document_id] = {
+            chunk.metadata.get('chunk_index', position): chunk
+            for position, chunk in enumerate(chunks)
+        }
+    
     def _estimate_total_tokens(self) -> int:
         """Estimate total tokens in knowledge base"""
         total = 0
@@ -1451,10 +5516,16 @@ class RAGManager:
     
     async def cleanup(self) -> None:
         """Cleanup resources"""
+        self._save_documents()
+        if self.query_cache:
+            self.query_cache.save()
         if hasattr(self.vector_store, 'cleanup'):
             await self.vector_store.cleanup()
+        await self.retriever.cleanup()
         if hasattr(self.embedding_provider, 'cleanup'):
             await self.embedding_provider.cleanup()
+        if self.embedding_cache:
+            self.embedding_cache.close()
         if self.reranker and hasattr(self.reranker, 'cleanup'):
             await self.reranker.cleanup()
 
@@ -1469,6 +5540,23 @@ __all__ = [
     'RAGResponse',
     'Citation',
     'VectorStoreProvider',
+    'MatrixVectorStore',
+    'VectorCodec',
+    'VectorMetric',
+    'MetadataIndex',
+    'KeywordIndex',
+    'QueryEmbeddingCache',
+    'SearchResultCache',
+    'ChunkEmbeddingCache',
+    'CachedEmbeddingProvider',
+    'CoalescingEmbeddingProvider',
+    'HashingEmbeddings',
+    'RescoreVectors',
+    'StageTimer',
+    'IVFVectorStore',
+    'FAISSVectorStore',
+    'MmapVectorStore',
+    'ShardedVectorStore',
     'EmbeddingProvider',
     'ChunkingStrategy',
     'RetrievalStrategy',
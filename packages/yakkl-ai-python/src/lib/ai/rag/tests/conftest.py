@@ -0,0 +1,71 @@
+"""Shared fixtures for the RAG module tests"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# rag.py is a standalone module next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag  # noqa: E402
+
+
+DIMENSION = 32
+
+
+@pytest.fixture
+def rng():
+    """Seeded generator so vectors are the same on every run"""
+    return np.random.default_rng(7)
+
+
+@pytest.fixture
+def make_chunks(rng):
+    """Factory for chunks with random unit embeddings and filterable metadata"""
+    def make(count: int, offset: int = 0):
+        vectors = rng.standard_normal((count, DIMENSION))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return [
+            rag.DocumentChunk(
+                id=f"c{i}",
+                document_id=f"d{i % 7}",
+                content=f"text {i}",
+                embedding=vector.tolist(),
+                metadata={'n': i, 'tag': 'ab'[i % 2]}
+            )
+            for i, vector in zip(range(offset, offset + count), vectors)
+        ]
+    return make
+
+
+@pytest.fixture
+def query(rng):
+    """Random query vector"""
+    return rng.standard_normal(DIMENSION).tolist()
+
+
+def copy_chunks(chunks):
+    """Independent copies, since stores may release or rewrite chunk embeddings"""
+    return [rag.DocumentChunk(**chunk.__dict__) for chunk in chunks]
+
+
+def exact_ids(chunks, query, top_k, keep=None):
+    """Brute-force cosine top_k over the chunks passing keep"""
+    chunks = [chunk for chunk in chunks if keep is None or keep(chunk)]
+    vectors = np.asarray([chunk.embedding for chunk in chunks])
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = vectors @ (np.asarray(query) / np.linalg.norm(query))
+    return [chunks[i].id for i in np.argsort(-scores, kind='stable')[:top_k]]
+
+
+def manager_config(path=None, **retrieval):
+    """RAGManager config with local hashing embeddings"""
+    provider = rag.VectorStoreProvider.MMAP if path else rag.VectorStoreProvider.MEMORY
+    return rag.RAGConfig(
+        vector_store=rag.VectorStoreConfig(provider=provider, persist_path=path),
+        embeddings=rag.EmbeddingConfig(provider=rag.EmbeddingProvider.CUSTOM, model='hashing', dimensions=64),
+        retrieval=rag.RetrievalConfig(strategy=rag.RetrievalStrategy.SIMILARITY, **retrieval),
+        chunking=rag.ChunkingConfig(strategy=rag.ChunkingStrategy.FIXED, chunk_size=200, chunk_overlap=0)
+    )
@@ -0,0 +1,130 @@
+"""Cached query embeddings, search results and chunk embeddings stay consistent with the index"""
+
+import asyncio
+
+import rag
+from conftest import manager_config
+
+
+class VersionlessStore(rag.MemoryVectorStore):
+    """Memory store that cannot report changes, as for remote providers"""
+    
+    def version(self):
+        return None
+
+
+def result_cache_hits(manager):
+    return manager.result_cache.get_stats()['hits']
+
+
+def test_result_cache_hits_until_documents_change():
+    async def run():
+        manager = rag.RAGManager(manager_config())
+        await manager.initialize()
+        await manager.add_document('notes about rust ownership and borrowing ' * 5)
+        first = await manager.search('rust borrowing')
+        await manager.search('rust borrowing')
+        hits_before_write = result_cache_hits(manager)
+        
+        added = await manager.add_document('python borrowing library books ' * 5)
+        after_add = await manager.search('rust borrowing')
+        await manager.delete_document(added.id)
+        after_delete = await manager.search('rust borrowing')
+        await manager.cleanup()
+        return first, hits_before_write, after_add, after_delete, added.id, result_cache_hits(manager)
+    
+    first, hits_before_write, after_add, after_delete, added_id, hits = asyncio.run(run())
+    assert hits_before_write == 1
+    assert any(result.chunk.document_id == added_id for result in after_add)
+    assert all(result.chunk.document_id != added_id for result in after_delete)
+    assert [result.chunk.id for result in after_delete] == [result.chunk.id for result in first]
+    assert hits == 1
+
+
+def test_result_cache_sees_writes_that_bypass_the_manager():
+    async def run():
+        manager = rag.RAGManager(manager_config())
+        await manager.initialize()
+        document = await manager.add_document('alpha beta gamma delta ' * 5)
+        await manager.search('alpha')
+        await manager.vector_store.delete(manager.document_index[document.id])
+        results = await manager.search('alpha')
+        await manager.cleanup()
+        return results
+    
+    assert asyncio.run(run()) == []
+
+
+def test_result_cache_bypassed_when_store_has_no_version():
+    async def run():
+        manager = rag.RAGManager(manager_config())
+        manager.vector_store = VersionlessStore(manager.config.vector_store)
+        await manager.initialize()
+        await manager.add_document('alpha beta gamma delta ' * 5)
+        await manager.search('alpha')
+        await manager.search('alpha')
+        await manager.cleanup()
+        return manager.result_cache.get_stats()
+    
+    stats = asyncio.run(run())
+    assert stats['hits'] == 0 and stats['size'] == 0
+
+
+def test_query_cache_normalizes_whitespace_only(tmp_path):
+    cache = rag.QueryEmbeddingCache('model', 8, path=str(tmp_path / 'queries.npz'))
+    cache.put('  What is   Rust? ', [1.0] * 8)
+    
+    assert cache.get('What is Rust?') == [1.0] * 8
+    assert cache.get('what is rust?') is None
+    assert rag.QueryEmbeddingCache('model', 16)._key('What is Rust?') != cache._key('What is Rust?')
+    
+    cache.save()
+    reloaded = rag.QueryEmbeddingCache('model', 8, path=cache.path)
+    reloaded.load()
+    assert reloaded.get('What is Rust?') == [1.0] * 8
+
+
+class CountingEmbeddings(rag.BaseEmbeddingProvider):
+    """Provider recording how many texts it was asked to embed"""
+    
+    def __init__(self, config):
+        super().__init__(config)
+        self.texts = 0
+        self.variant = ''
+    
+    async def embed(self, text):
+        return (await self.embed_batch([text]))[0]
+    
+    async def embed_batch(self, texts):
+        self.texts += len(texts)
+        return [[float(len(text)), float(len(self.variant))] for text in texts]
+    
+    def get_dimensions(self):
+        return 2
+    
+    def fingerprint(self):
+        return self.variant
+
+
+def test_chunk_cache_serves_repeats_and_keys_on_fingerprint(tmp_path):
+    cache = rag.ChunkEmbeddingCache(str(tmp_path / 'chunks.sqlite'), 'model', max_size=3)
+    provider = CountingEmbeddings(None)
+    cached = rag.CachedEmbeddingProvider(provider, cache)
+    
+    async def run():
+        first = await cached.embed_batch(['one', 'two', 'one'])
+        again = await cached.embed_batch(['two', 'one'])
+        calls_after_repeat = provider.texts
+        provider.variant = 'refit'
+        refit = await cached.embed_batch(['one'])
+        return first, again, calls_after_repeat, refit
+    
+    first, again, calls_after_repeat, refit = asyncio.run(run())
+    assert first == [[3.0, 0.0], [3.0, 0.0], [3.0, 0.0]]
+    assert again == [[3.0, 0.0], [3.0, 0.0]]
+    assert calls_after_repeat == 2
+    assert refit == [[3.0, 5.0]] and provider.texts == 3
+    
+    cache.put_many(['three', 'four'], [[1.0, 0.0], [2.0, 0.0]])
+    assert cache.get_stats()['size'] == 3
+    cache.close()
@@ -0,0 +1,99 @@
+"""Deletes tombstone rows until compaction rewrites the store"""
+
+import asyncio
+
+import rag
+from conftest import copy_chunks, exact_ids
+
+
+def matrix_config(**options):
+    return rag.VectorStoreConfig(provider=rag.VectorStoreProvider.MEMORY, storage_layout='matrix', **options)
+
+
+def test_matrix_delete_tombstones_until_compaction(make_chunks, query):
+    chunks = make_chunks(500)
+    deleted = {chunk.id for chunk in chunks[::3]}
+    survivors = [chunk for chunk in chunks if chunk.id not in deleted]
+    
+    async def run():
+        store = rag.MatrixVectorStore(matrix_config(compaction_threshold=1.0))
+        await store.upsert(copy_chunks(chunks))
+        await store.delete(sorted(deleted))
+        before = await store.get_stats()
+        tombstoned = [result.chunk.id for result in await store.search(query, 20)]
+        store.compact()
+        after = await store.get_stats()
+        compacted = [result.chunk.id for result in await store.search(query, 20)]
+        filtered = [result.chunk.id for result in await store.search(query, 20, {'tag': 'a'})]
+        return before, tombstoned, after, compacted, filtered
+    
+    before, tombstoned, after, compacted, filtered = asyncio.run(run())
+    assert before['dead_rows'] == len(deleted) and before['count'] == len(survivors)
+    assert after['dead_rows'] == 0 and after['compactions'] == 1
+    assert tombstoned == compacted == exact_ids(survivors, query, 20)
+    assert filtered == exact_ids(survivors, query, 20, lambda chunk: chunk.metadata['tag'] == 'a')
+
+
+def test_matrix_compacts_in_background_past_threshold(make_chunks, query):
+    chunks = make_chunks(600)
+    
+    async def run():
+        store = rag.MatrixVectorStore(matrix_config(compaction_threshold=0.3))
+        await store.upsert(copy_chunks(chunks))
+        await store.delete([chunk.id for chunk in chunks[:300]])
+        await store.compaction_task
+        return await store.get_stats(), await store.search(query, 10)
+    
+    stats, results = asyncio.run(run())
+    assert stats['compactions'] == 1 and stats['dead_rows'] == 0 and stats['count'] == 300
+    assert [result.chunk.id for result in results] == exact_ids(chunks[300:], query, 10)
+
+
+def test_reinserting_a_deleted_id_revives_it(make_chunks, query):
+    chunks = make_chunks(50)
+    
+    async def run():
+        store = rag.MatrixVectorStore(matrix_config(compaction_threshold=1.0))
+        await store.upsert(copy_chunks(chunks))
+        await store.delete(['c5'])
+        await store.upsert(copy_chunks(chunks[5:6]))
+        return await store.search(chunks[5].embedding, 1), await store.get_stats()
+    
+    results, stats = asyncio.run(run())
+    assert results[0].chunk.id == 'c5'
+    assert stats['count'] == 50
+
+
+def test_mmap_compaction_writes_new_generation(tmp_path, make_chunks, query):
+    chunks = make_chunks(400)
+    deleted = [chunk.id for chunk in chunks[:100]]
+    config = rag.VectorStoreConfig(
+        provider=rag.VectorStoreProvider.MMAP,
+        persist_path=str(tmp_path),
+        compaction_threshold=1.0
+    )
+    
+    async def run():
+        store = rag.MmapVectorStore(config)
+        await store.initialize()
+        await store.upsert(copy_chunks(chunks))
+        await store.delete(deleted)
+        before = await store.get_stats()
+        await store.compact()
+        after = await store.get_stats()
+        results = [result.chunk.id for result in await store.search(query, 10)]
+        await store.cleanup()
+        
+        reopened = rag.MmapVectorStore(config)
+        await reopened.initialize()
+        reloaded = [result.chunk.id for result in await reopened.search(query, 10)]
+        stats = await reopened.get_stats()
+        await reopened.cleanup()
+        return before, after, results, reloaded, stats
+    
+    before, after, results, reloaded, stats = asyncio.run(run())
+    assert before['dead_rows'] == 100
+    assert after['dead_rows'] == 0 and after['generation'] == before['generation'] + 1
+    assert results == reloaded == exact_ids(chunks[100:], query, 10)
+    assert stats['count'] == 300 and stats['rows'] == 300
+    assert not any(path.name.startswith('segment-0000') for path in tmp_path.iterdir())
@@ -0,0 +1,78 @@
+"""Metadata filters return the exact top_k of the matching chunks"""
+
+import asyncio
+
+import pytest
+
+import rag
+from conftest import copy_chunks, exact_ids
+
+
+FILTERS = [
+    ({'tag': 'a'}, lambda chunk: chunk.metadata['tag'] == 'a'),
+    ({'n': {'$gte': 100, '$lt': 900}}, lambda chunk: 100 <= chunk.metadata['n'] < 900),
+    ({'document_id': 'd3'}, lambda chunk: chunk.document_id == 'd3'),
+    ({'tag': 'b', 'n': {'$lt': 50}}, lambda chunk: chunk.metadata['tag'] == 'b' and chunk.metadata['n'] < 50),
+]
+
+
+def memory_store(tmp_path):
+    return rag.MemoryVectorStore(rag.VectorStoreConfig(provider=rag.VectorStoreProvider.MEMORY))
+
+
+def matrix_store(tmp_path):
+    return rag.MatrixVectorStore(rag.VectorStoreConfig(
+        provider=rag.VectorStoreProvider.MEMORY,
+        storage_layout='matrix'
+    ))
+
+
+def faiss_store(tmp_path):
+    pytest.importorskip('faiss')
+    return rag.FAISSVectorStore(rag.VectorStoreConfig(provider=rag.VectorStoreProvider.FAISS))
+
+
+def mmap_store(tmp_path):
+    return rag.MmapVectorStore(rag.VectorStoreConfig(
+        provider=rag.VectorStoreProvider.MMAP,
+        persist_path=str(tmp_path)
+    ))
+
+
+@pytest.mark.parametrize('create', [memory_store, matrix_store, faiss_store, mmap_store])
+@pytest.mark.parametrize('filter, keep', FILTERS)
+def test_filtered_search_matches_exact(tmp_path, make_chunks, query, create, filter, keep):
+    chunks = make_chunks(1000)
+    store = create(tmp_path)
+    
+    async def run():
+        await store.initialize()
+        await store.upsert(copy_chunks(chunks))
+        results = await store.search(query, 10, filter)
+        await store.cleanup()
+        return results
+    
+    results = asyncio.run(run())
+    assert all(keep(result.chunk) for result in results)
+    assert [result.chunk.id for result in results] == exact_ids(chunks, query, 10, keep)
+
+
+@pytest.mark.parametrize('create', [memory_store, matrix_store, mmap_store])
+def test_filter_sees_updated_metadata(tmp_path, make_chunks, query, create):
+    chunks = make_chunks(200)
+    store = create(tmp_path)
+    
+    async def run():
+        await store.initialize()
+        await store.upsert(copy_chunks(chunks))
+        moved = copy_chunks(chunks[:10])
+        for chunk in moved:
+            chunk.metadata = {**chunk.metadata, 'tag': 'z'}
+        await store.upsert(moved)
+        await store.delete(['c0'])
+        results = await store.search(query, 20, {'tag': 'z'})
+        await store.cleanup()
+        return results
+    
+    ids = {result.chunk.id for result in asyncio.run(run())}
+    assert ids == {f"c{i}" for i in range(1, 10)}
@@ -0,0 +1,123 @@
+"""Persisted stores reopen with the same contents and replay logged writes"""
+
+import asyncio
+import json
+import os
+
+import rag
+from conftest import copy_chunks, exact_ids, manager_config
+
+
+def mmap_config(path, read_only=False):
+    return rag.VectorStoreConfig(provider=rag.VectorStoreProvider.MMAP, persist_path=str(path), read_only=read_only)
+
+
+def test_mmap_reopens_after_cleanup(tmp_path, make_chunks, query):
+    chunks = make_chunks(300)
+    
+    async def run():
+        store = rag.MmapVectorStore(mmap_config(tmp_path))
+        await store.initialize()
+        await store.upsert(copy_chunks(chunks))
+        await store.delete(['c1', 'c2'])
+        await store.cleanup()
+        
+        reopened = rag.MmapVectorStore(mmap_config(tmp_path))
+        await reopened.initialize()
+        results = [result.chunk.id for result in await reopened.search(query, 10, {'tag': 'a'})]
+        stats = await reopened.get_stats()
+        await reopened.cleanup()
+        return results, stats
+    
+    results, stats = asyncio.run(run())
+    survivors = [chunk for chunk in chunks if chunk.id not in ('c1', 'c2')]
+    assert results == exact_ids(survivors, query, 10, lambda chunk: chunk.metadata['tag'] == 'a')
+    assert stats['count'] == 298 and stats['wal_bytes'] == 0
+
+
+def test_mmap_replays_wal_after_crash(tmp_path, make_chunks, query):
+    chunks = make_chunks(200)
+    logged = make_chunks(2, offset=900)
+    
+    async def run():
+        store = rag.MmapVectorStore(mmap_config(tmp_path))
+        store.CHECKPOINT_SECONDS = 60
+        await store.initialize()
+        await store.upsert(copy_chunks(chunks))
+        store._checkpoint()
+        await store.delete(['c7'])
+        # A record logged before the crash, then one torn mid-write
+        record = {'op': 'upsert', 'chunks': [{**rag._chunk_to_dict(chunk), 'embedding': chunk.embedding} for chunk in logged]}
+        with open(os.path.join(tmp_path, store.WAL_FILE), 'a') as f:
+            f.write(json.dumps(record) + '\n{"op": "dele')
+        store._cancel_checkpoint()  # Crash: no cleanup
+        
+        reopened = rag.MmapVectorStore(mmap_config(tmp_path))
+        await reopened.initialize()
+        stats = await reopened.get_stats()
+        revived = await reopened.search(logged[0].embedding, 1)
+        results = [result.chunk.id for result in await reopened.search(query, 10)]
+        await reopened.cleanup()
+        return stats, revived, results
+    
+    stats, revived, results = asyncio.run(run())
+    expected = [chunk for chunk in chunks if chunk.id != 'c7'] + logged
+    assert stats['count'] == len(expected)
+    assert revived[0].chunk.id == 'c900'
+    assert results == exact_ids(expected, query, 10)
+
+
+def test_mmap_reader_sees_writes_after_checkpoint(tmp_path, make_chunks):
+    chunks = make_chunks(100)
+    extra = make_chunks(1, offset=500)
+    
+    async def run():
+        writer = rag.MmapVectorStore(mmap_config(tmp_path))
+        await writer.initialize()
+        await writer.upsert(copy_chunks(chunks))
+        writer._checkpoint()
+        reader = rag.MmapVectorStore(mmap_config(tmp_path, read_only=True))
+        await reader.initialize()
+        
+        await writer.upsert(copy_chunks(extra))
+        before = (await reader.search(extra[0].embedding, 1))[0].chunk.id
+        writer._checkpoint()
+        os.utime(os.path.join(tmp_path, writer.MANIFEST_FILE))
+        after = (await reader.search(extra[0].embedding, 1))[0].chunk.id
+        await reader.cleanup()
+        await writer.cleanup()
+        return before, after
+    
+    before, after = asyncio.run(run())
+    assert before != 'c500'
+    assert after == 'c500'
+
+
+def test_manager_reopens_documents_and_replays_log(tmp_path):
+    path = str(tmp_path)
+    
+    async def run():
+        manager = rag.RAGManager(manager_config(path))
+        await manager.initialize()
+        kept = await manager.add_document('the quick brown fox jumps over the lazy dog ' * 10)
+        dropped = await manager.add_document('a completely different note about sailing boats ' * 10)
+        await manager.update_document(kept.id, 'the quick brown fox naps in the sun ' * 10)
+        await manager.delete_document(dropped.id)
+        # Crash: no cleanup, so the snapshot is older than the document log
+        manager.vector_store._cancel_checkpoint()
+        assert os.path.getsize(os.path.join(path, manager.DOCUMENTS_LOG)) > 0
+        
+        reopened = rag.RAGManager(manager_config(path))
+        await reopened.initialize()
+        documents = dict(reopened.documents)
+        results = await reopened.search('fox naps')
+        stats = await reopened.vector_store.get_stats()
+        index = dict(reopened.document_index)
+        await reopened.cleanup()
+        return kept.id, dropped.id, documents, results, stats, index
+    
+    kept_id, dropped_id, documents, results, stats, index = asyncio.run(run())
+    assert list(documents) == [kept_id]
+    assert 'naps' in documents[kept_id].content
+    assert results and all(result.chunk.document_id == kept_id for result in results)
+    assert stats['count'] == len(index[kept_id])
@@ -0,0 +1,119 @@
+"""Approximate and compressed stores against exact search"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+import rag
+from conftest import DIMENSION, copy_chunks, exact_ids
+
+
+def recall(store, chunks, queries, top_k=10):
+    """Mean fraction of the exact top_k the store returns"""
+    async def run():
+        await store.initialize()
+        await store.upsert(copy_chunks(chunks))
+        found = await store.search_batch(queries, top_k)
+        await store.cleanup()
+        return found
+    
+    found = asyncio.run(run())
+    hits = [
+        len({result.chunk.id for result in results} & set(exact_ids(chunks, query, top_k))) / top_k
+        for query, results in zip(queries, found)
+    ]
+    return float(np.mean(hits))
+
+
+@pytest.fixture
+def corpus(make_chunks, rng):
+    """Chunks plus queries near some of them"""
+    chunks = make_chunks(2000)
+    queries = [
+        (np.asarray(chunk.embedding) + rng.normal(scale=0.3, size=DIMENSION)).tolist()
+        for chunk in chunks[:20]
+    ]
+    return chunks, queries
+
+
+def test_memory_store_is_exact(corpus):
+    chunks, queries = corpus
+    store = rag.MemoryVectorStore(rag.VectorStoreConfig(provider=rag.VectorStoreProvider.MEMORY))
+    assert recall(store, chunks, queries) == 1.0
+
+
+def test_full_precision_matrix_is_exact(corpus):
+    chunks, queries = corpus
+    store = rag.MatrixVectorStore(rag.VectorStoreConfig(
+        provider=rag.VectorStoreProvider.MEMORY,
+        storage_layout='matrix'
+    ))
+    assert recall(store, chunks, queries) == 1.0
+
+
+@pytest.mark.parametrize('compression, minimum', [('float16', 0.99), ('int8', 0.9)])
+def test_compressed_matrix_recall(corpus, compression, minimum):
+    chunks, queries = corpus
+    store = rag.MatrixVectorStore(rag.VectorStoreConfig(
+        provider=rag.VectorStoreProvider.MEMORY,
+        compression=compression
+    ))
+    assert recall(store, chunks, queries) >= minimum
+
+
+def test_binary_codes_rescored_from_side_copy(corpus):
+    chunks, queries = corpus
+    codes_only = rag.MatrixVectorStore(rag.VectorStoreConfig(
+        provider=rag.VectorStoreProvider.MEMORY,
+        compression='binary'
+    ))
+    rescored = rag.MatrixVectorStore(rag.VectorStoreConfig(
+        provider=rag.VectorStoreProvider.MEMORY,
+        compression='binary',
+        rescore=True
+    ))
+    assert recall(rescored, chunks, queries) > recall(codes_only, chunks, queries)
+
+
+def test_ivf_scanning_every_list_is_exact(corpus):
+    chunks, queries = corpus
+    store = rag.IVFVectorStore(rag.VectorStoreConfig(
+        provider=rag.VectorStoreProvider.MEMORY,
+        index_type='ivf',
+        nlist=16,
+        nprobe=16
+    ))
+    assert recall(store, chunks, queries) == 1.0
+
+
+def test_ivf_partial_probe_recall(corpus):
+    chunks, queries = corpus
+    store = rag.IVFVectorStore(rag.VectorStoreConfig(
+        provider=rag.VectorStoreProvider.MEMORY,
+        index_type='ivf',
+        nlist=16,
+        nprobe=8
+    ))
+    assert recall(store, chunks, queries) >= 0.7
+
+
+def test_faiss_flat_is_exact(corpus):
+    pytest.importorskip('faiss')
+    chunks, queries = corpus
+    store = rag.FAISSVectorStore(rag.VectorStoreConfig(provider=rag.VectorStoreProvider.FAISS))
+    assert recall(store, chunks, queries) == 1.0
+
+
+def test_recall_estimate_reported_for_codes_only_store(make_chunks):
+    async def run():
+        store = rag.MatrixVectorStore(rag.VectorStoreConfig(
+            provider=rag.VectorStoreProvider.MEMORY,
+            compression='int8'
+        ))
+        await store.upsert(make_chunks(500))
+        return (await store.get_stats())['recall_at_10']
+    
+    estimate = asyncio.run(run())
+    assert estimate['coarse'] >= 0.8
+    assert estimate['rescored'] is None